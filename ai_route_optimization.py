@@ -1,21 +1,79 @@
 import numpy as np
-import pandas as pd
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler
 from scipy.spatial.distance import cdist
 import folium
+from folium.plugins import FastMarkerCluster
 from datetime import datetime, timedelta
 import json
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Callable
 import random
+import re
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from distance_matrix import DistanceMatrix, haversine_distance, to_unit_vectors
+from distance_cache import open_distance_cache, location_key, stop_location_keys
+from stop_array import stops_from_requests, stop_coordinates, to_minutes
+from road_network import open_road_network
+from route_rendering import MARKER_CLUSTER_MIN_STOPS
+from route_local_search import improve_route
+from vrp_solver import VRPTWSolver
+from spatial_index import StopIndex
+from demand_aggregates import DemandAggregates, demand_aggregates
+from models import db, RouteOptimization
 
 class RouteOptimizer:
-    def __init__(self):
+    # Company depot used as the start of every route
+    DEFAULT_DEPOT = {'latitude': 40.7128, 'longitude': -74.0060}  # Example coordinates
+
+    # Requests may exceed a depot's fleet-proportional share by this factor to stay near their yard
+    DEPOT_BALANCE_SLACK = 1.5
+
+    ALGORITHM_NAME = 'kmeans+nearest_neighbor+2opt+oropt'
+    VRPTW_ALGORITHM_NAME = 'savings+relocate+2opt+oropt (cvrptw)'
+    HIERARCHICAL_ALGORITHM_NAME = 'minibatch-kmeans partitions+2opt+oropt+seam repair'
+
+    def __init__(self, depot: Dict = None, avg_speed_kmh: float = 30, service_time_hours: float = 0.25,
+                 local_search_iterations: int = 1000, local_search_time_limit: float = 1.0,
+                 spatial_index_min_stops: int = 200, max_matrix_stops: int = 2000,
+                 workers: int = 1, parallel_min_stops: int = 500, repair_time_limit: float = 0.05,
+                 distance_cache: str = None, road_network: str = None,
+                 hierarchical_min_stops: int = 20000, partition_size: int = 1000, boundary_window: int = 40):
         self.scaler = StandardScaler()
         self.kmeans = None
+        self.depot = depot or self.DEFAULT_DEPOT
+        self.avg_speed_kmh = avg_speed_kmh  # Average speed in urban areas
+        self.service_time_hours = service_time_hours  # 15 minutes per stop
+        # Budget of the 2-opt / Or-opt improvement stage (moves and seconds per route)
+        self.local_search_iterations = local_search_iterations
+        self.local_search_time_limit = local_search_time_limit
+        # Clusters above these sizes use the KD-tree for tour construction / skip the full matrix
+        self.spatial_index_min_stops = spatial_index_min_stops
+        self.max_matrix_stops = max_matrix_stops
+        # Process pool for per-cluster solving; small instances stay in-process
+        self.workers = max(1, workers)
+        self.parallel_min_stops = parallel_min_stops
+        self._executor = None
+        # Local search budget (seconds) when repairing a single route after an incremental change
+        self.repair_time_limit = repair_time_limit
+        # Directory of the persistent distance cache; None computes every matrix from scratch
+        self.distance_cache_dir = distance_cache
+        self.distance_cache = open_distance_cache(distance_cache, avg_speed_kmh) if distance_cache else None
+        # Road graph file used as the distance provider instead of straight-line distances
+        self.road_network_path = road_network
+        self.road_network = open_road_network(road_network) if road_network else None
+        # Instances this large are split into partitions of about `partition_size` stops per
+        # route, routed independently and stitched, with `boundary_window` stops re-optimized
+        # on each side of every seam
+        self.hierarchical_min_stops = hierarchical_min_stops
+        self.partition_size = partition_size
+        self.boundary_window = boundary_window
         
     def optimize_routes(self, service_requests: List[Dict], vehicles: List[Dict], 
-                       constraints: Dict = None) -> Dict:
+                       constraints: Dict = None, time_budget: float = None,
+                       progress: Callable[[Dict], None] = None) -> Dict:
         """
         Optimize routes using AI/ML algorithms
         
@@ -23,51 +81,388 @@ class RouteOptimizer:
             service_requests: List of service requests with coordinates
             vehicles: List of available vehicles
             constraints: Optimization constraints (time windows, capacity, etc.)
+            time_budget: Seconds to spend; the best plan found so far is returned when it runs out
+            progress: Called with each improved complete plan (anytime mode) and the final one
         
         Returns:
             Optimized routes with metrics
         """
+        # One pass over the dicts; everything after works on the stop array
+        stops = stops_from_requests(service_requests)
         
-        # Extract coordinates and create feature matrix
-        coordinates = np.array([[req['latitude'], req['longitude']] 
-                              for req in service_requests])
+        def expanded_progress(plan):
+            progress(self._expand_plan(plan, service_requests))
+        
+        result = self.optimize_stops(stops, vehicles, constraints, time_budget,
+                                     expanded_progress if progress is not None else None)
+        return self._expand_plan(result, service_requests)
+    
+    def optimize_stops(self, stops: np.ndarray, vehicles: List[Dict], constraints: Dict = None,
+                       time_budget: float = None, progress: Callable[[Dict], None] = None) -> Dict:
+        """
+        Optimize routes for a structured stop array (stop_array.STOP_DTYPE)
+        
+        Same plans as optimize_routes, except that each route lists its stops as
+        'stops', an array of row indices into `stops`, and unassigned stops (with
+        constraints) come back as 'unassigned_stops'.
+        """
+        started = time.perf_counter()
         
-        # Normalize coordinates
-        coordinates_scaled = self.scaler.fit_transform(coordinates)
+        # Capacity / time-window constraints are solved as a CVRPTW instead of by clustering
+        if constraints:
+            if time_budget is not None:
+                constraints = dict(constraints, time_limit=min(constraints.get('time_limit', 10.0), time_budget))
+            result = self._optimize_constrained_by_depot(stops, vehicles, constraints)
+            return self._report(result, started, 'complete', progress)
+        
+        # Extract coordinates and create feature matrix
+        coordinates = stop_coordinates(stops)
         
         # Determine optimal number of clusters (routes)
-        n_routes = min(len(vehicles), len(service_requests))
+        n_routes = min(len(vehicles), len(stops))
         if n_routes == 0:
             return {"error": "No vehicles or requests available"}
         
-        # Apply K-means clustering
-        self.kmeans = KMeans(n_clusters=n_routes, random_state=42)
-        cluster_labels = self.kmeans.fit_predict(coordinates_scaled)
+        # (stop indices, vehicle index, depot) for every route
+        partition = self._partition(coordinates, vehicles)
+        n_routes = len(partition)
+        
+        if len(coordinates) >= self.hierarchical_min_stops:
+            deadline = None if time_budget is None else started + time_budget
+            for stage, solutions in self._solve_hierarchical(coordinates, partition, deadline):
+                result = self._assemble_plan(coordinates, vehicles, partition, solutions)
+                result['algorithm'] = self.HIERARCHICAL_ALGORITHM_NAME
+                self._report(result, started, stage, progress)
+            return result
+        
+        keys = self._cache_locations(stops, coordinates, [depot for _, _, depot in partition])
+        cluster_coordinates = [coordinates[indices] for indices, _, _ in partition]
+        cluster_keys = None if keys is None else [[keys[i] for i in indices] for indices, _, _ in partition]
+        cluster_depots = [(depot['latitude'], depot['longitude']) for _, _, depot in partition]
+        
+        if time_budget is None:
+            solutions = self._solve_clusters(cluster_coordinates, cluster_keys, depots=cluster_depots)
+            result = self._assemble_plan(coordinates, vehicles, partition, solutions)
+            return self._report(result, started, 'complete', progress)
+        
+        # Anytime mode: greedy tours give a complete plan first, then each route is
+        # improved within an equal share of whatever budget is left
+        deadline = started + time_budget
+        solutions = self._solve_clusters(cluster_coordinates, cluster_keys, time_limit=0, depots=cluster_depots)
+        result = self._report(self._assemble_plan(coordinates, vehicles, partition, solutions),
+                              started, 'construction', progress)
+        
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return self._report(result, started, 'complete', None)
+        
+        parallel = min(self.workers, n_routes) if self._use_pool(cluster_coordinates) else 1
+        share = remaining * parallel / n_routes
+        orders = [order for order, _ in solutions]
+        for route_id, solution in enumerate(self._iter_cluster_solutions(cluster_coordinates, cluster_keys,
+                                                                         share, orders, cluster_depots)):
+            solutions[route_id] = solution
+            if progress is not None and route_id < n_routes - 1:
+                self._report(self._assemble_plan(coordinates, vehicles, partition, solutions),
+                             started, 'improvement', progress)
+        
+        result = self._assemble_plan(coordinates, vehicles, partition, solutions)
+        return self._report(result, started, 'complete', progress)
+    
+    def _expand_plan(self, plan: Dict, service_requests: List[Dict]) -> Dict:
+        """Copy of an optimize_stops plan with the stop indices replaced by the request dicts"""
+        if 'optimized_routes' not in plan:
+            return plan
+        expanded = dict(plan)
+        routes = []
+        for route in plan['optimized_routes']:
+            route = dict(route)
+            route['requests'] = [service_requests[i] for i in route.pop('stops').tolist()]
+            routes.append(route)
+        expanded['optimized_routes'] = routes
+        if 'unassigned_stops' in expanded:
+            expanded['unassigned_requests'] = [service_requests[i] for i in expanded.pop('unassigned_stops').tolist()]
+        return expanded
+    
+    def _vehicle_depot(self, vehicle: Dict) -> Dict:
+        """Yard a vehicle starts from: its own depot (or its department's), else the company default"""
+        if vehicle.get('depot'):
+            return vehicle['depot']
+        if vehicle.get('depot_latitude') is not None and vehicle.get('depot_longitude') is not None:
+            return {'latitude': vehicle['depot_latitude'], 'longitude': vehicle['depot_longitude']}
+        return self.depot
+    
+    def _group_by_depot(self, vehicles: List[Dict]) -> Tuple[List[Dict], List[List[int]]]:
+        """Distinct depots and the indices of the vehicles based at each"""
+        depots, groups, index = [], [], {}
+        for k, vehicle in enumerate(vehicles):
+            depot = self._vehicle_depot(vehicle)
+            key = (round(float(depot['latitude']), 6), round(float(depot['longitude']), 6))
+            if key not in index:
+                index[key] = len(depots)
+                depots.append({'latitude': float(depot['latitude']), 'longitude': float(depot['longitude'])})
+                groups.append([])
+            groups[index[key]].append(k)
+        return depots, groups
+    
+    def _assign_depots(self, coordinates: np.ndarray, depots: List[Dict], fleet_sizes: List[int]) -> np.ndarray:
+        """Depot index of every request: its nearest yard, within a quota proportional to that yard's fleet"""
+        n = len(coordinates)
+        if len(depots) == 1:
+            return np.zeros(n, dtype=int)
+        
+        yards = np.array([[d['latitude'], d['longitude']] for d in depots])
+        distance = haversine_distance(coordinates[:, 0, None], coordinates[:, 1, None],
+                                      yards[None, :, 0], yards[None, :, 1])
+        fleet = np.asarray(fleet_sizes, dtype=float)
+        quota = np.ceil(n * fleet / fleet.sum() * self.DEPOT_BALANCE_SLACK).astype(int)
         
-        # Create optimized routes
+        # Requests that lose most by missing their nearest yard choose first
+        ranked = np.argsort(distance, axis=1)
+        ranked_distance = np.take_along_axis(distance, ranked, axis=1)
+        regret = ranked_distance[:, 1] - ranked_distance[:, 0]
+        
+        assignment = np.empty(n, dtype=int)
+        load = np.zeros(len(depots), dtype=int)
+        for i in np.argsort(-regret, kind='stable'):
+            for d in ranked[i]:
+                if load[d] < quota[d]:
+                    assignment[i] = d
+                    load[d] += 1
+                    break
+        return assignment
+    
+    def _partition(self, coordinates: np.ndarray, vehicles: List[Dict]) -> List[Tuple[np.ndarray, int, Dict]]:
+        """Split requests into one cluster per route, seeded per depot
+        
+        Requests go to a depot first, then each depot's requests are clustered
+        with K-means into at most as many routes as it has vehicles.
+        """
+        depots, groups = self._group_by_depot(vehicles)
+        depot_of = self._assign_depots(coordinates, depots, [len(group) for group in groups])
+        
+        partition = []
+        for d, (depot, group) in enumerate(zip(depots, groups)):
+            members = np.flatnonzero(depot_of == d)
+            n_routes = min(len(group), len(members))
+            if n_routes == 0:
+                continue
+            
+            # Normalize coordinates
+            coordinates_scaled = self.scaler.fit_transform(coordinates[members])
+            
+            # Apply K-means clustering (mini-batch for very large instances)
+            if len(members) >= self.hierarchical_min_stops:
+                self.kmeans = MiniBatchKMeans(n_clusters=n_routes, random_state=42, batch_size=4096, n_init=3)
+            else:
+                self.kmeans = KMeans(n_clusters=n_routes, random_state=42)
+            cluster_labels = self.kmeans.fit_predict(coordinates_scaled)
+            
+            for route_id in range(n_routes):
+                partition.append((members[cluster_labels == route_id], group[route_id], depot))
+        
+        return partition
+    
+    def _report(self, result: Dict, started: float, stage: str, progress: Callable[[Dict], None] = None) -> Dict:
+        """Stamp a plan with its stage and elapsed time and hand it to the progress callback"""
+        if 'error' not in result:
+            result['stage'] = stage
+            result['elapsed'] = time.perf_counter() - started
+        if progress is not None:
+            progress(result)
+        return result
+    
+    def _split_route(self, coordinates: np.ndarray, depot: Dict) -> List[Tuple[np.ndarray, Tuple[float, float]]]:
+        """Cut one route's stops into partitions of about `partition_size`, in visiting order
+        
+        Partitions are visited in nearest-neighbour order of their centroids from the
+        depot; each is routed from the previous centroid (the depot for the first).
+        """
+        start = (depot['latitude'], depot['longitude'])
+        k = int(np.ceil(len(coordinates) / self.partition_size))
+        if k <= 1:
+            return [(np.arange(len(coordinates)), start)]
+        
+        labels = MiniBatchKMeans(n_clusters=k, random_state=42, batch_size=min(4096, len(coordinates)),
+                                 n_init=3).fit_predict(to_unit_vectors(coordinates))
+        groups = [group for group in (np.flatnonzero(labels == c) for c in range(k)) if len(group)]
+        centroids = np.array([coordinates[group].mean(axis=0) for group in groups])
+        
+        parts = []
+        remaining = list(range(len(groups)))
+        anchor = np.array(start)
+        while remaining:
+            gaps = haversine_distance(anchor[0], anchor[1], centroids[remaining, 0], centroids[remaining, 1])
+            nearest = remaining.pop(int(np.argmin(gaps)))
+            parts.append((groups[nearest], tuple(map(float, anchor))))
+            anchor = centroids[nearest]
+        return parts
+    
+    def _solve_hierarchical(self, coordinates: np.ndarray, partition: List[Tuple[np.ndarray, int, Dict]],
+                            deadline: float = None):
+        """Route every partition of every route in one pool run, then stitch and repair the seams
+        
+        Yields (stage, solutions). With a `deadline` (a time.perf_counter() value) the
+        greedy tours are stitched into a 'construction' plan first, then improved and
+        repaired within what is left of the budget; splitting and construction count
+        towards it too.
+        """
+        parts = []
+        for route_index, (indices, _, depot) in enumerate(partition):
+            for positions, anchor in self._split_route(coordinates[indices], depot):
+                parts.append((route_index, positions, anchor))
+        
+        part_coordinates = [coordinates[partition[r][0][positions]] for r, positions, _ in parts]
+        anchors = [anchor for _, _, anchor in parts]
+        if deadline is None:
+            part_solutions = self._solve_clusters(part_coordinates, depots=anchors)
+            yield 'complete', self._stitch(coordinates, partition, parts, part_solutions)
+            return
+        
+        part_solutions = self._solve_clusters(part_coordinates, time_limit=0, depots=anchors)
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            yield 'complete', self._stitch(coordinates, partition, parts, part_solutions, repair=False)
+            return
+        yield 'construction', self._stitch(coordinates, partition, parts, part_solutions, repair=False)
+        
+        # Most of the remaining budget for the partitions, the rest for the seams
+        remaining = max(0.0, deadline - time.perf_counter())
+        parallel = min(self.workers, len(parts)) if self._use_pool(part_coordinates) else 1
+        time_limit = min(self.local_search_time_limit, 0.8 * remaining * parallel / len(parts))
+        orders = [order for order, _ in part_solutions]
+        improving = self._iter_cluster_solutions(part_coordinates, None, time_limit, orders, anchors)
+        for k, solution in enumerate(improving):
+            part_solutions[k] = solution
+            if time.perf_counter() >= deadline:
+                # Later partitions keep their greedy tours
+                improving.close()
+                break
+        yield 'complete', self._stitch(coordinates, partition, parts, part_solutions, deadline=deadline)
+    
+    def _stitch(self, coordinates: np.ndarray, partition: List[Tuple[np.ndarray, int, Dict]],
+                parts: List[Tuple[int, np.ndarray, Tuple[float, float]]], part_solutions: List[Tuple[np.ndarray, Dict]],
+                repair: bool = True, deadline: float = None) -> List[Tuple[np.ndarray, Dict]]:
+        """Join each route's partition tours in visiting order, repairing the seams unless `repair` is False
+        
+        Route lengths come from the partitions' own stats plus the joins, measured with
+        the same distance source, rather than from re-measuring the whole route.
+        """
+        solutions = []
+        for route_index, (indices, _, depot) in enumerate(partition):
+            route_coordinates = coordinates[indices]
+            start = (depot['latitude'], depot['longitude'])
+            order, seams = [], []
+            initial_distance = distance = 0.0
+            minutes = 0.0
+            for (r, positions, anchor), (part_order, stats) in zip(parts, part_solutions):
+                if r != route_index or len(part_order) == 0:
+                    continue
+                previous = route_coordinates[order[-1]] if order else start
+                first = route_coordinates[positions[part_order[0]]]
+                # The partition was routed from its anchor; the route reaches it from the previous stop
+                legs = self._points_matrix([anchor, previous, first])
+                join = legs.distance(1, 2) - legs.distance(0, 2)
+                initial_distance += stats['initial_distance'] + join
+                distance += stats['final_distance'] + join
+                if minutes is not None and legs.durations is not None and 'travel_minutes' in stats:
+                    minutes += stats['travel_minutes'] + legs.durations[1, 2] - legs.durations[0, 2]
+                else:
+                    minutes = None
+                if order:
+                    seams.append(len(order))
+                order.extend(positions[part_order].tolist())
+            
+            if repair:
+                order, saved, saved_minutes = self._repair_seams(route_coordinates, order, seams, depot, deadline)
+                distance -= saved
+                if minutes is not None and saved_minutes is not None:
+                    minutes -= saved_minutes
+            stats = {
+                'initial_distance': initial_distance,
+                'final_distance': distance,
+                'improvement': initial_distance - distance
+            }
+            if minutes is not None:
+                stats['travel_minutes'] = float(minutes)
+            solutions.append((np.asarray(order, dtype=int), stats))
+        return solutions
+    
+    def _points_matrix(self, points) -> DistanceMatrix:
+        """Matrix between a few points, from the same distance source as the cluster matrices"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if self.road_network is not None and len(points) <= self.max_matrix_stops:
+            distances, durations = self.road_network.matrix(points)
+            return DistanceMatrix(points, distances, durations)
+        return DistanceMatrix(points)
+    
+    def _repair_seams(self, coordinates: np.ndarray, order: List[int], seams: List[int], depot: Dict,
+                      deadline: float = None) -> Tuple[List[int], float, float]:
+        """2-opt / Or-opt on a window around each seam, keeping the stops outside it fixed
+        
+        Each seam gets up to `repair_time_limit` seconds, none past `deadline`. Returns the
+        order and the kilometres (and driving minutes, or None) saved.
+        """
+        order = list(order)
+        saved, saved_minutes = 0.0, 0.0
+        for seam in seams:
+            time_limit = self.repair_time_limit
+            if deadline is not None:
+                time_limit = min(time_limit, deadline - time.perf_counter())
+                if time_limit <= 0:
+                    break
+            lo = max(0, seam - self.boundary_window)
+            hi = min(len(order), seam + self.boundary_window)
+            window = order[lo:hi]
+            start = [[depot['latitude'], depot['longitude']]] if lo == 0 else coordinates[[order[lo - 1]]]
+            points = [start, coordinates[window]]
+            if hi < len(order):
+                points.append(coordinates[[order[hi]]])
+            
+            distance_matrix = self._points_matrix(np.vstack(points))
+            end = len(window) + 1 if hi < len(order) else None
+            before = list(range(1, len(window) + 1))
+            improved, stats = improve_route(distance_matrix.distances, before,
+                                            self.local_search_iterations, time_limit, end)
+            order[lo:hi] = [window[k - 1] for k in improved]
+            saved += stats['improvement']
+            if distance_matrix.durations is None:
+                saved_minutes = None
+            elif saved_minutes is not None:
+                tail = [end] if end is not None else []
+                saved_minutes += (distance_matrix.path_duration([0] + before + tail)
+                                  - distance_matrix.path_duration([0] + improved + tail))
+        return order, saved, saved_minutes
+    
+    def _assemble_plan(self, coordinates: np.ndarray, vehicles: List[Dict],
+                       partition: List[Tuple[np.ndarray, int, Dict]],
+                       solutions: List[Tuple[np.ndarray, Dict]]) -> Dict:
+        """Build the plan dict (stop indices per route) from each cluster's visiting order and search stats"""
         optimized_routes = []
         total_distance = 0
         total_time = 0
+        original_distance = 0
         
-        for route_id in range(n_routes):
-            route_requests = [req for i, req in enumerate(service_requests) 
-                            if cluster_labels[i] == route_id]
-            
-            if not route_requests:
+        for route_id, ((indices, vehicle_index, depot), (order, search_stats)) in enumerate(zip(partition, solutions)):
+            if len(indices) == 0:
                 continue
-                
-            # Apply TSP (Traveling Salesman Problem) optimization
-            optimized_route = self._solve_tsp(route_requests)
+            
+            optimized_route = indices[order]
             
             # Calculate route metrics
-            distance = self._calculate_route_distance(optimized_route)
-            time = self._calculate_route_time(optimized_route)
+            distance = search_stats['final_distance']
+            time = self._route_time_from_distance(distance, len(optimized_route), search_stats.get('travel_minutes'))
+            first = coordinates[optimized_route[0]]
             
             route_info = {
                 'route_id': route_id,
-                'vehicle_id': vehicles[route_id]['id'] if route_id < len(vehicles) else None,
-                'requests': optimized_route,
+                'vehicle_id': vehicles[vehicle_index]['id'],
+                'depot': depot,
+                'stops': optimized_route,
+                'start_location': {'latitude': float(first[0]), 'longitude': float(first[1])},
                 'total_distance': distance,
+                'original_distance': search_stats['initial_distance'],
+                'distance_improvement': search_stats['improvement'],
                 'estimated_time': time,
                 'efficiency_score': self._calculate_efficiency_score(distance, time, len(optimized_route))
             }
@@ -75,67 +470,358 @@ class RouteOptimizer:
             optimized_routes.append(route_info)
             total_distance += distance
             total_time += time
+            original_distance += search_stats['initial_distance']
         
         return {
             'optimized_routes': optimized_routes,
             'total_distance': total_distance,
             'total_time': total_time,
+            'original_distance': original_distance,
+            'distance_improvement': original_distance - total_distance,
+            'improvement_percentage': (original_distance - total_distance) / original_distance * 100 if original_distance > 0 else 0,
+            'algorithm': self.ALGORITHM_NAME,
             'average_efficiency': np.mean([r['efficiency_score'] for r in optimized_routes]),
             'fuel_savings': self._calculate_fuel_savings(total_distance),
             'time_savings': self._calculate_time_savings(total_time)
         }
     
-    def _solve_tsp(self, requests: List[Dict]) -> List[Dict]:
-        """Solve Traveling Salesman Problem using nearest neighbor algorithm"""
+    def _cluster_options(self) -> Dict:
+        """Settings a worker process needs to rebuild this optimizer"""
+        return {
+            'avg_speed_kmh': self.avg_speed_kmh,
+            'service_time_hours': self.service_time_hours,
+            'local_search_iterations': self.local_search_iterations,
+            'local_search_time_limit': self.local_search_time_limit,
+            'spatial_index_min_stops': self.spatial_index_min_stops,
+            'max_matrix_stops': self.max_matrix_stops,
+            'distance_cache': self.distance_cache_dir,
+            'road_network': self.road_network_path,
+            'hierarchical_min_stops': self.hierarchical_min_stops,
+            'partition_size': self.partition_size,
+            'boundary_window': self.boundary_window
+        }
+    
+    def _cache_locations(self, stops: np.ndarray, coordinates: np.ndarray, depots: List[Dict] = None) -> List[str]:
+        """Register the depots and every stop in the distance cache; returns the stops' keys"""
+        if self.distance_cache is None:
+            return None
+        depots = depots or [self.depot]
+        keys = stop_location_keys(stops)
+        self.distance_cache.ensure([location_key(d) for d in depots] + keys,
+                                   np.vstack([[[d['latitude'], d['longitude']] for d in depots], coordinates]))
+        return keys
+    
+    def _use_pool(self, cluster_coordinates: List[np.ndarray]) -> bool:
+        total_stops = sum(len(c) for c in cluster_coordinates)
+        return self.workers > 1 and len(cluster_coordinates) > 1 and total_stops >= self.parallel_min_stops
+    
+    def _solve_clusters(self, cluster_coordinates: List[np.ndarray], cluster_keys: List[List[str]] = None,
+                        time_limit: float = None, orders: List[np.ndarray] = None,
+                        depots: List[Tuple[float, float]] = None) -> List[Tuple[np.ndarray, Dict]]:
+        """Solve every cluster, in a process pool when the instance is large enough
+        
+        Results come back in cluster order whichever mode is used, so the merge is
+        deterministic; only the coordinate arrays cross the process boundary.
+        """
+        return list(self._iter_cluster_solutions(cluster_coordinates, cluster_keys, time_limit, orders, depots))
+    
+    def _iter_cluster_solutions(self, cluster_coordinates: List[np.ndarray], cluster_keys: List[List[str]] = None,
+                                time_limit: float = None, orders: List[np.ndarray] = None,
+                                depots: List[Tuple[float, float]] = None):
+        """Yield (order, stats) per cluster as they finish; `orders` are starting tours to improve
+        
+        Every cluster may have its own depot, so several yards are solved in the same pool.
+        """
+        depots = depots or [(self.depot['latitude'], self.depot['longitude'])] * len(cluster_coordinates)
+        options = self._cluster_options()
+        if time_limit is not None:
+            options['local_search_time_limit'] = time_limit
+        cluster_keys = cluster_keys or [None] * len(cluster_coordinates)
+        orders = orders or [None] * len(cluster_coordinates)
+        
+        if self._use_pool(cluster_coordinates):
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            yield from self._executor.map(solve_cluster, cluster_coordinates, depots, repeat(options),
+                                          cluster_keys, orders)
+            return
+        
+        for c, depot, k, order in zip(cluster_coordinates, depots, cluster_keys, orders):
+            yield solve_cluster(c, depot, options, k, order)
+    
+    def clone(self) -> 'RouteOptimizer':
+        """A fresh optimizer with the same settings, e.g. for another thread"""
+        return RouteOptimizer(depot=self.depot, workers=self.workers, parallel_min_stops=self.parallel_min_stops,
+                              repair_time_limit=self.repair_time_limit, **self._cluster_options())
+    
+    def close(self):
+        """Shut down the worker pool, if one was started"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+    
+    def _optimize_constrained_by_depot(self, stops: np.ndarray, vehicles: List[Dict],
+                                       constraints: Dict) -> Dict:
+        """Solve the CVRPTW separately for every depot and merge the plans
+        
+        Requests are split between yards as in the unconstrained planner; each yard
+        gets a share of the time limit proportional to its requests.
+        """
+        depots, groups = self._group_by_depot(vehicles)
+        if len(depots) == 1 or len(stops) == 0:
+            return self._optimize_with_constraints(stops, vehicles, constraints, depots[0] if depots else None)
+        
+        coordinates = stop_coordinates(stops)
+        depot_of = self._assign_depots(coordinates, depots, [len(group) for group in groups])
+        time_limit = constraints.get('time_limit', 10.0)
+        
+        plans = []
+        for d, (depot, group) in enumerate(zip(depots, groups)):
+            members = np.flatnonzero(depot_of == d)
+            if len(members) == 0:
+                continue
+            share = dict(constraints, time_limit=time_limit * len(members) / len(stops))
+            plan = self._optimize_with_constraints(stops[members], [vehicles[k] for k in group], share, depot)
+            # Back from the yard's sub-array to rows of `stops`
+            for route in plan['optimized_routes']:
+                route['stops'] = members[route['stops']]
+            plan['unassigned_stops'] = members[plan['unassigned_stops']]
+            plans.append(plan)
+        
+        optimized_routes = [route for plan in plans for route in plan['optimized_routes']]
+        for route_id, route in enumerate(optimized_routes):
+            route['route_id'] = route_id
+        total_distance = sum(plan['total_distance'] for plan in plans)
+        total_time = sum(plan['total_time'] for plan in plans)
+        original_distance = sum(plan['original_distance'] for plan in plans)
+        
+        return {
+            'optimized_routes': optimized_routes,
+            'unassigned_stops': np.concatenate([plan['unassigned_stops'] for plan in plans]),
+            'total_distance': total_distance,
+            'total_time': total_time,
+            'original_distance': original_distance,
+            'distance_improvement': original_distance - total_distance,
+            'improvement_percentage': (original_distance - total_distance) / original_distance * 100 if original_distance > 0 else 0,
+            'algorithm': self.VRPTW_ALGORITHM_NAME,
+            'constraints': constraints,
+            'solve_time': sum(plan['solve_time'] for plan in plans),
+            'average_efficiency': np.mean([r['efficiency_score'] for r in optimized_routes]) if optimized_routes else 0,
+            'fuel_savings': self._calculate_fuel_savings(total_distance),
+            'time_savings': self._calculate_time_savings(total_time)
+        }
+    
+    def _optimize_with_constraints(self, stops: np.ndarray, vehicles: List[Dict],
+                                   constraints: Dict, depot: Dict = None) -> Dict:
+        """Capacitated vehicle routing with time windows
+        
+        Recognised constraints: vehicle_capacity (default for vehicles without one),
+        default_demand, shift_start, shift_end, time_window_slack (minutes around a
+        request's scheduled_time), time_limit (seconds) and neighbors.
+        """
+        if len(vehicles) == 0 or len(stops) == 0:
+            return {"error": "No vehicles or requests available"}
+        depot = depot or self.depot
+        
+        shift = (self._to_minutes(constraints.get('shift_start', '07:00')),
+                 self._to_minutes(constraints.get('shift_end', '19:00')))
+        default_capacity = constraints.get('vehicle_capacity', 10)
+        capacities = [self._parse_capacity(v.get('capacity'), default_capacity) for v in vehicles]
+        
+        coordinates = stop_coordinates(stops)
+        demands = np.where(np.isnan(stops['demand']), constraints.get('default_demand', 1), stops['demand'])
+        service_minutes = np.where(np.isnan(stops['service_minutes']), self.service_time_hours * 60,
+                                   stops['service_minutes'])
+        time_windows = self._time_windows(stops, shift, constraints.get('time_window_slack', 60))
+        
+        solver = VRPTWSolver(depot, self.avg_speed_kmh,
+                             neighbors=constraints.get('neighbors', 20),
+                             time_limit=constraints.get('time_limit', 10.0),
+                             local_search_iterations=self.local_search_iterations)
+        solution = solver.solve(coordinates, demands, time_windows, service_minutes, capacities, shift)
+        
+        optimized_routes = []
+        total_distance = 0
+        total_time = 0
+        original_distance = 0
+        
+        for route_id, route in enumerate(solution['routes']):
+            optimized_route = np.asarray(route['stops'], dtype=int)
+            distance = route['distance']
+            first = coordinates[optimized_route[0]]
+            time = (route['finish_time'] - shift[0]) / 60  # hours, including waiting
+            
+            optimized_routes.append({
+                'route_id': route_id,
+                'vehicle_id': vehicles[route['vehicle_index']]['id'],
+                'depot': depot,
+                'stops': optimized_route,
+                'start_location': {'latitude': float(first[0]), 'longitude': float(first[1])},
+                'total_distance': distance,
+                'original_distance': route['construction_distance'],
+                'distance_improvement': route['construction_distance'] - distance,
+                'estimated_time': time,
+                'load': route['load'],
+                'capacity': route['capacity'],
+                'arrival_times': [self._format_minutes(t) for t in route['arrival_times']],
+                'efficiency_score': self._calculate_efficiency_score(distance, time, len(optimized_route))
+            })
+            total_distance += distance
+            total_time += time
+            original_distance += route['construction_distance']
+        
+        return {
+            'optimized_routes': optimized_routes,
+            'unassigned_stops': np.asarray(solution['unassigned'], dtype=int),
+            'total_distance': total_distance,
+            'total_time': total_time,
+            'original_distance': original_distance,
+            'distance_improvement': original_distance - total_distance,
+            'improvement_percentage': (original_distance - total_distance) / original_distance * 100 if original_distance > 0 else 0,
+            'algorithm': self.VRPTW_ALGORITHM_NAME,
+            'constraints': constraints,
+            'solve_time': solution['elapsed'],
+            'average_efficiency': np.mean([r['efficiency_score'] for r in optimized_routes]) if optimized_routes else 0,
+            'fuel_savings': self._calculate_fuel_savings(total_distance),
+            'time_savings': self._calculate_time_savings(total_time)
+        }
+    
+    def _parse_capacity(self, capacity, default: float) -> float:
+        """Numeric capacity from values such as 8, '8' or '8 tons'"""
+        if capacity is None:
+            return float(default)
+        if isinstance(capacity, (int, float)):
+            return float(capacity)
+        match = re.search(r'\d+(\.\d+)?', str(capacity))
+        return float(match.group()) if match else float(default)
+    
+    def _to_minutes(self, value) -> float:
+        """Minutes from midnight for 'HH:MM' strings, time/datetime objects or plain minutes"""
+        return to_minutes(value)
+    
+    def _format_minutes(self, minutes: float) -> str:
+        minutes = int(round(minutes))
+        return f"{minutes // 60:02d}:{minutes % 60:02d}"
+    
+    def _time_window(self, request: Dict, shift: Tuple[float, float], slack: float) -> Tuple[float, float]:
+        """Pickup window of a request, defaulting to the whole shift"""
+        start = self._to_minutes(request.get('time_window_start'))
+        end = self._to_minutes(request.get('time_window_end'))
+        
+        scheduled = self._to_minutes(request.get('scheduled_time'))
+        if scheduled is not None:
+            start = scheduled - slack if start is None else start
+            end = scheduled + slack if end is None else end
+        
+        return (shift[0] if start is None else start, shift[1] if end is None else end)
+    
+    def _time_windows(self, stops: np.ndarray, shift: Tuple[float, float], slack: float) -> np.ndarray:
+        """(n, 2) pickup windows of a stop array; `_time_window` applied to every row at once"""
+        scheduled = stops['scheduled']
+        start = np.where(np.isnan(stops['window_start']), scheduled - slack, stops['window_start'])
+        end = np.where(np.isnan(stops['window_end']), scheduled + slack, stops['window_end'])
+        return np.column_stack([np.where(np.isnan(start), shift[0], start),
+                                np.where(np.isnan(end), shift[1], end)])
+    
+    def _build_distance_matrix(self, coordinates: np.ndarray, keys: List[str] = None) -> DistanceMatrix:
+        """Build the distance matrix for a cluster with the depot at index 0
+        
+        With a distance cache and the stops' location keys the matrix is sliced from
+        the cache instead of recomputed (clusters too large for a full matrix excepted).
+        """
+        depot = [[self.depot['latitude'], self.depot['longitude']]]
+        coordinates = np.vstack([depot, np.asarray(coordinates, dtype=float).reshape(-1, 2)])
+        if self.road_network is not None and len(coordinates) <= self.max_matrix_stops:
+            distances, durations = self.road_network.matrix(coordinates)
+            return DistanceMatrix(coordinates, distances, durations)
+        if self.distance_cache is None or keys is None or len(keys) > self.max_matrix_stops:
+            return DistanceMatrix(coordinates)
+        
+        distances, _ = self.distance_cache.submatrix([location_key(self.depot)] + list(keys))
+        return DistanceMatrix(coordinates, distances)
+    
+    def _nearest_neighbor_order(self, distance_matrix: DistanceMatrix) -> List[int]:
+        """Visit order (matrix indices, depot excluded) built by nearest neighbor from the depot"""
+        n = len(distance_matrix)
+        if n - 1 > self.spatial_index_min_stops:
+            index = StopIndex(distance_matrix.coordinates[1:])
+            return [stop + 1 for stop in index.nearest_neighbor_tour(distance_matrix.coordinates[0])]
+        
+        visited = np.zeros(n, dtype=bool)
+        visited[0] = True
+        current = 0
+        order = []
+        
+        while len(order) < n - 1:
+            candidates = np.where(visited, np.inf, distance_matrix.distances[current])
+            current = int(np.argmin(candidates))
+            visited[current] = True
+            order.append(current)
+        
+        return order
+    
+    def _route_order(self, distance_matrix: DistanceMatrix, order: List[int] = None) -> Tuple[List[int], Dict]:
+        """Nearest neighbor tour (unless a starting order is given) improved by 2-opt / Or-opt"""
+        if order is None:
+            order = self._nearest_neighbor_order(distance_matrix)
+        
+        # Very large clusters keep the greedy tour rather than materialising an n x n matrix
+        if len(order) > self.max_matrix_stops:
+            distance = distance_matrix.path_length([0] + order)
+            return order, {'initial_distance': distance, 'final_distance': distance, 'improvement': 0.0,
+                           'improvement_pct': 0, 'iterations': 0, 'two_opt_moves': 0, 'or_opt_moves': 0}
+        
+        return improve_route(distance_matrix.distances, order,
+                             self.local_search_iterations, self.local_search_time_limit)
+    
+    def _solve_tsp(self, requests: List[Dict], distance_matrix: DistanceMatrix = None) -> List[Dict]:
+        """Solve Traveling Salesman Problem using nearest neighbor plus 2-opt / Or-opt improvement"""
         if len(requests) <= 1:
             return requests
         
         # Start from depot (company location)
-        depot = {'latitude': 40.7128, 'longitude': -74.0060}  # Example coordinates
-        unvisited = requests.copy()
-        route = []
-        
-        # Find nearest request to depot
-        current = min(unvisited, key=lambda x: self._calculate_distance(depot, x))
-        route.append(current)
-        unvisited.remove(current)
+        if distance_matrix is None:
+            stops = stops_from_requests(requests)
+            coordinates = stop_coordinates(stops)
+            distance_matrix = self._build_distance_matrix(coordinates, self._cache_locations(stops, coordinates))
         
-        # Build route using nearest neighbor
-        while unvisited:
-            nearest = min(unvisited, key=lambda x: self._calculate_distance(current, x))
-            route.append(nearest)
-            unvisited.remove(nearest)
-            current = nearest
-        
-        return route
+        order, _ = self._route_order(distance_matrix)
+        return [requests[stop - 1] for stop in order]
     
     def _calculate_distance(self, point1: Dict, point2: Dict) -> float:
-        """Calculate Euclidean distance between two points"""
+        """Calculate great-circle (haversine) distance between two points in km"""
         lat1, lon1 = point1['latitude'], point1['longitude']
         lat2, lon2 = point2['latitude'], point2['longitude']
         
-        return np.sqrt((lat2 - lat1)**2 + (lon2 - lon1)**2)
+        return float(haversine_distance(lat1, lon1, lat2, lon2))
     
-    def _calculate_route_distance(self, route: List[Dict]) -> float:
-        """Calculate total distance for a route"""
-        if len(route) <= 1:
+    def _calculate_route_distance(self, route: List[Dict], distance_matrix: DistanceMatrix = None,
+                                  order: List[int] = None) -> float:
+        """Calculate total distance (km) for a route, starting from the depot"""
+        if len(route) == 0:
             return 0
+
+        # `order` holds the matrix indices of the route's stops in a precomputed depot-first matrix
+        if distance_matrix is None:
+            distance_matrix = self._build_distance_matrix([[r['latitude'], r['longitude']] for r in route])
+            order = range(1, len(route) + 1)
         
-        total_distance = 0
-        for i in range(len(route) - 1):
-            total_distance += self._calculate_distance(route[i], route[i + 1])
-        
-        return total_distance
+        return distance_matrix.path_length([0] + list(order))
     
-    def _calculate_route_time(self, route: List[Dict]) -> float:
+    def _calculate_route_time(self, route: List[Dict], distance_matrix: DistanceMatrix = None,
+                              order: List[int] = None) -> float:
         """Calculate estimated time for a route (hours)"""
-        # Assume average speed of 30 km/h in urban areas
-        avg_speed_kmh = 30
-        distance_km = self._calculate_route_distance(route) * 111  # Convert to km
-        travel_time = distance_km / avg_speed_kmh
-        
-        # Add service time (15 minutes per stop)
-        service_time = len(route) * 0.25
+        if len(route) and distance_matrix is None:
+            distance_matrix = self._build_distance_matrix([[r['latitude'], r['longitude']] for r in route])
+            order = range(1, len(route) + 1)
+        distance_km = self._calculate_route_distance(route, distance_matrix, order)
+        travel_minutes = distance_matrix.path_duration([0] + list(order)) if len(route) else None
+        return self._route_time_from_distance(distance_km, len(route), travel_minutes)
+    
+    def _route_time_from_distance(self, distance_km: float, stops: int, travel_minutes: float = None) -> float:
+        """Travel time (road network minutes, else average speed) plus service time per stop (hours)"""
+        travel_time = travel_minutes / 60 if travel_minutes is not None else distance_km / self.avg_speed_kmh
+        service_time = stops * self.service_time_hours
         
         return travel_time + service_time
     
@@ -161,61 +847,197 @@ class RouteOptimizer:
         baseline_time = optimized_time * 1.15
         return baseline_time - optimized_time
     
-    def predict_demand(self, historical_data: List[Dict]) -> Dict:
-        """Predict future demand using historical data"""
-        # Convert historical data to DataFrame
-        df = pd.DataFrame(historical_data)
-        df['date'] = pd.to_datetime(df['date'])
-        df['day_of_week'] = df['date'].dt.dayofweek
-        df['month'] = df['date'].dt.month
+    def insert_request(self, plan: Dict, request: Dict) -> Dict:
+        """Insert a new request at the cheapest feasible position of an optimized plan
+        
+        Only the receiving route is repaired with local search; the plan is updated
+        in place and returned. Capacity and, for constrained plans, time windows are
+        respected; the request lands in `unassigned_requests` if no route can take it.
+        """
+        routes = plan.get('optimized_routes', [])
+        constraints = plan.get('constraints')
+        demand = request.get('demand', (constraints or {}).get('default_demand', 1))
         
-        # Simple demand prediction based on day of week patterns
-        daily_patterns = df.groupby('day_of_week')['requests'].mean()
+        best_cost, best_route, best_position = np.inf, None, None
+        for route in routes:
+            if 'capacity' in route and route.get('load', len(route['requests'])) + demand > route['capacity']:
+                continue
+            costs = self._insertion_costs(route, request)
+            # Time windows only need checking for the few cheapest positions
+            for position in np.argsort(costs, kind='stable')[:5 if constraints else 1]:
+                if costs[position] >= best_cost:
+                    break
+                candidate = route['requests'][:position] + [request] + route['requests'][position:]
+                if constraints and not self._route_schedule(candidate, route, constraints)[2]:
+                    continue
+                best_cost, best_route, best_position = costs[position], route, int(position)
+                break
         
-        # Predict next week's demand
-        next_week_prediction = {}
-        for day in range(7):
-            predicted_demand = daily_patterns.get(day, df['requests'].mean())
-            next_week_prediction[day] = max(0, predicted_demand)
+        if best_route is None:
+            plan.setdefault('unassigned_requests', []).append(request)
+            return plan
         
-        return {
-            'next_week_prediction': next_week_prediction,
-            'confidence_level': 0.85,
-            'model_type': 'time_series_pattern'
-        }
+        best_route['requests'].insert(best_position, request)
+        if 'load' in best_route:
+            best_route['load'] += demand
+        self._repair_route(best_route, constraints)
+        self._refresh_plan_totals(plan)
+        return plan
+    
+    def remove_request(self, plan: Dict, request_id) -> Dict:
+        """Remove a cancelled request from an optimized plan and repair only its route"""
+        for route in plan.get('optimized_routes', []):
+            position = next((k for k, req in enumerate(route['requests']) if req.get('id') == request_id), None)
+            if position is None:
+                continue
+            
+            removed = route['requests'].pop(position)
+            if 'load' in route:
+                constraints = plan.get('constraints') or {}
+                route['load'] -= removed.get('demand', constraints.get('default_demand', 1))
+            
+            if route['requests']:
+                self._repair_route(route, plan.get('constraints'))
+            else:
+                plan['optimized_routes'].remove(route)
+            self._refresh_plan_totals(plan)
+            return plan
+        
+        plan['unassigned_requests'] = [req for req in plan.get('unassigned_requests', [])
+                                       if req.get('id') != request_id]
+        return plan
+    
+    def _route_depot(self, route: Dict) -> Dict:
+        return route.get('depot', self.depot)
+    
+    def _insertion_costs(self, route: Dict, request: Dict) -> np.ndarray:
+        """Extra km of inserting a request before each stop of a route (last entry: append)"""
+        depot = self._route_depot(route)
+        points = np.array([[depot['latitude'], depot['longitude']]] +
+                          [[req['latitude'], req['longitude']] for req in route['requests']])
+        to_new = haversine_distance(points[:, 0], points[:, 1], request['latitude'], request['longitude'])
+        legs = haversine_distance(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1])
+        
+        costs = to_new.copy()
+        costs[:-1] += to_new[1:] - legs
+        return costs
+    
+    def _route_schedule(self, requests: List[Dict], route: Dict, constraints: Dict) -> Tuple[List[float], float, bool]:
+        """Arrival minutes, final finish time and window feasibility of a constrained route"""
+        shift = (self._to_minutes(constraints.get('shift_start', '07:00')),
+                 self._to_minutes(constraints.get('shift_end', '19:00')))
+        slack = constraints.get('time_window_slack', 60)
+        depot = self._route_depot(route)
+        points = np.array([[depot['latitude'], depot['longitude']]] +
+                          [[req['latitude'], req['longitude']] for req in requests])
+        travel = haversine_distance(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1]) / self.avg_speed_kmh * 60
+        
+        arrivals = []
+        clock = shift[0]
+        feasible = True
+        for req, minutes in zip(requests, travel):
+            arrival = clock + minutes
+            start, end = self._time_window(req, shift, slack)
+            arrivals.append(arrival)
+            feasible &= max(arrival, start) <= end
+            clock = max(arrival, start) + req.get('service_minutes', self.service_time_hours * 60)
+        
+        return arrivals, clock, bool(feasible and clock <= shift[1])
+    
+    def _repair_route(self, route: Dict, constraints: Dict = None):
+        """Re-run 2-opt / Or-opt on one route and refresh its metrics"""
+        depot = self._route_depot(route)
+        distance_matrix = DistanceMatrix([[depot['latitude'], depot['longitude']]] +
+                                         [[req['latitude'], req['longitude']] for req in route['requests']])
+        current = list(range(1, len(route['requests']) + 1))
+        
+        if 2 < len(current) <= self.max_matrix_stops:
+            order, _ = improve_route(distance_matrix.distances, current,
+                                     self.local_search_iterations, self.repair_time_limit)
+            candidate = [route['requests'][k - 1] for k in order]
+            if not constraints or self._route_schedule(candidate, route, constraints)[2]:
+                route['requests'] = candidate
+                current = order
+        
+        distance = distance_matrix.path_length([0] + current)
+        if constraints:
+            arrivals, finish, _ = self._route_schedule(route['requests'], route, constraints)
+            route['arrival_times'] = [self._format_minutes(t) for t in arrivals]
+            time = (finish - self._to_minutes(constraints.get('shift_start', '07:00'))) / 60
+        else:
+            time = self._route_time_from_distance(distance, len(route['requests']))
+        
+        route['start_location'] = {'latitude': route['requests'][0]['latitude'],
+                                   'longitude': route['requests'][0]['longitude']}
+        route['total_distance'] = distance
+        route['estimated_time'] = time
+        route['efficiency_score'] = self._calculate_efficiency_score(distance, time, len(route['requests']))
+    
+    def _refresh_plan_totals(self, plan: Dict):
+        routes = plan.get('optimized_routes', [])
+        plan['total_distance'] = sum(r['total_distance'] for r in routes)
+        plan['total_time'] = sum(r['estimated_time'] for r in routes)
+        plan['average_efficiency'] = np.mean([r['efficiency_score'] for r in routes]) if routes else 0
+        plan['fuel_savings'] = self._calculate_fuel_savings(plan['total_distance'])
+        plan['time_savings'] = self._calculate_time_savings(plan['total_time'])
+    
+    def record_optimization(self, result: Dict, created_by: int = None) -> List[RouteOptimization]:
+        """Persist the local search improvement of each optimized route"""
+        records = []
+        for route in result.get('optimized_routes', []):
+            saved_km = route['original_distance'] - route['total_distance']
+            records.append(RouteOptimization(
+                route_id=route.get('db_route_id'),
+                original_distance=route['original_distance'],
+                optimized_distance=route['total_distance'],
+                time_saved=int(round(saved_km / self.avg_speed_kmh * 60)),
+                fuel_saved=saved_km * 0.1,  # 0.1 L/km
+                algorithm_used=result.get('algorithm', self.ALGORITHM_NAME),
+                created_by=created_by
+            ))
+        
+        db.session.add_all(records)
+        db.session.commit()
+        return records
+    
+    def predict_demand(self, historical_data: List[Dict] = None, department_id: int = None) -> Dict:
+        """Predict future demand from day-of-week patterns
+        
+        Without `historical_data` ({'date', 'requests'} rows) the prediction comes from
+        the DemandPattern table, which is kept current as requests change.
+        """
+        if historical_data is not None:
+            return DemandAggregates.predict_from_history(historical_data)
+        
+        demand_aggregates.ensure_loaded()
+        return demand_aggregates.predict(department_id)
     
     def optimize_vehicle_assignment(self, routes: List[Dict], vehicles: List[Dict]) -> Dict:
         """Optimize vehicle assignment to routes"""
         if len(routes) == 0 or len(vehicles) == 0:
             return {"error": "No routes or vehicles available"}
         
-        # Create cost matrix (route-vehicle compatibility)
-        cost_matrix = []
-        for route in routes:
-            route_costs = []
-            for vehicle in vehicles:
-                # Calculate compatibility score
-                compatibility = self._calculate_vehicle_route_compatibility(route, vehicle)
-                route_costs.append(compatibility)
-            cost_matrix.append(route_costs)
-        
-        # Use Hungarian algorithm for optimal assignment
+        # Route-vehicle compatibility for every pair in one batch
+        compatibility = self._compatibility_matrix(routes, vehicles)
+        
+        # Use Hungarian algorithm for the assignment with the highest total compatibility
         from scipy.optimize import linear_sum_assignment
-        route_indices, vehicle_indices = linear_sum_assignment(cost_matrix)
+        route_indices, vehicle_indices = linear_sum_assignment(compatibility, maximize=True)
         
         assignments = []
         total_cost = 0
         
         for route_idx, vehicle_idx in zip(route_indices, vehicle_indices):
+            score = float(compatibility[route_idx, vehicle_idx])
             assignment = {
                 'route_id': routes[route_idx]['route_id'],
                 'vehicle_id': vehicles[vehicle_idx]['id'],
-                'compatibility_score': cost_matrix[route_idx][vehicle_idx],
+                'compatibility_score': score,
                 'route': routes[route_idx],
                 'vehicle': vehicles[vehicle_idx]
             }
             assignments.append(assignment)
-            total_cost += cost_matrix[route_idx][vehicle_idx]
+            total_cost += score
         
         return {
             'assignments': assignments,
@@ -223,32 +1045,50 @@ class RouteOptimizer:
             'average_compatibility': total_cost / len(assignments) if assignments else 0
         }
     
-    def _calculate_vehicle_route_compatibility(self, route: Dict, vehicle: Dict) -> float:
-        """Calculate compatibility between vehicle and route"""
+    def _compatibility_matrix(self, routes: List[Dict], vehicles: List[Dict]) -> np.ndarray:
+        """Routes x vehicles compatibility scores (higher is better), broadcast over all pairs"""
         # Factors to consider:
         # 1. Vehicle capacity vs route demand
         # 2. Vehicle type vs route requirements
         # 3. Vehicle location vs route start point
-        
-        compatibility_score = 1.0
+        # Plans from optimize_stops list 'stops' rather than 'requests'
+        demand = np.array([route.get('load', len(route['requests'] if 'requests' in route else route['stops']))
+                           for route in routes], dtype=float)
+        capacity = np.array([self._parse_capacity(vehicle.get('capacity'), 10) for vehicle in vehicles])
         
         # Capacity compatibility
-        route_demand = len(route['requests'])
-        vehicle_capacity = vehicle.get('capacity', 10)
-        capacity_ratio = min(route_demand / vehicle_capacity, 1.0)
-        compatibility_score *= capacity_ratio
+        with np.errstate(divide='ignore', invalid='ignore'):
+            compatibility = np.minimum(demand[:, None] / capacity[None, :], 1.0)
+        compatibility = np.nan_to_num(compatibility, nan=1.0)
         
         # Vehicle type compatibility
-        if route.get('requires_special_vehicle') and vehicle.get('type') != 'special':
-            compatibility_score *= 0.5
+        special_route = np.array([bool(route.get('requires_special_vehicle')) for route in routes])
+        special_vehicle = np.array([vehicle.get('type') == 'special' for vehicle in vehicles])
+        compatibility *= np.where(special_route[:, None] & ~special_vehicle[None, :], 0.5, 1.0)
         
-        # Distance compatibility (prefer vehicles closer to route start)
-        if 'start_location' in route and 'current_location' in vehicle:
-            distance = self._calculate_distance(route['start_location'], vehicle['current_location'])
-            distance_factor = 1.0 / (1.0 + distance)  # Closer is better
-            compatibility_score *= distance_factor
+        # Distance compatibility (prefer vehicles closer to route start); pairs missing a location are unaffected
+        starts = np.array([[route['start_location']['latitude'], route['start_location']['longitude']]
+                           if 'start_location' in route else [np.nan, np.nan] for route in routes])
+        locations = np.array([self._vehicle_location(vehicle) for vehicle in vehicles], dtype=float)
+        distance = haversine_distance(starts[:, 0, None], starts[:, 1, None],
+                                      locations[None, :, 0], locations[None, :, 1])
+        compatibility *= np.where(np.isnan(distance), 1.0, 1.0 / (1.0 + distance))  # Closer is better (km)
         
-        return compatibility_score
+        return compatibility
+    
+    def _vehicle_location(self, vehicle: Dict) -> List[float]:
+        """[latitude, longitude] of a vehicle's last known position, from a 'current_location' dict or
+        the Vehicle model's current_latitude/current_longitude; NaNs when it has none"""
+        location = vehicle.get('current_location') or {}
+        latitude = location.get('latitude', vehicle.get('current_latitude'))
+        longitude = location.get('longitude', vehicle.get('current_longitude'))
+        if latitude is None or longitude is None:
+            return [np.nan, np.nan]
+        return [float(latitude), float(longitude)]
+    
+    def _calculate_vehicle_route_compatibility(self, route: Dict, vehicle: Dict) -> float:
+        """Calculate compatibility between vehicle and route"""
+        return float(self._compatibility_matrix([route], [vehicle])[0, 0])
     
     def generate_route_map(self, route: Dict) -> str:
         """Generate interactive map for a route"""
@@ -270,6 +1110,12 @@ class RouteOptimizer:
             opacity=0.8
         ).add_to(route_map)
         
+        # Dense routes get one clustered marker layer instead of a Marker object per stop;
+        # route_rendering serves the same data as polylines / GeoJSON without any HTML
+        if len(route['requests']) > MARKER_CLUSTER_MIN_STOPS:
+            FastMarkerCluster(coordinates).add_to(route_map)
+            return route_map._repr_html_()
+        
         # Add markers for each stop
         for i, request in enumerate(route['requests']):
             folium.Marker(
@@ -280,5 +1126,24 @@ class RouteOptimizer:
         
         return route_map._repr_html_()
 
+def solve_cluster(coordinates: np.ndarray, depot: Tuple[float, float], options: Dict,
+                  keys: List[str] = None, order: np.ndarray = None) -> Tuple[np.ndarray, Dict]:
+    """Order one cluster's stops; returns positions into `coordinates` plus search stats
+    
+    Module-level so it can be pickled as a process-pool task. A given `order`
+    (positions into `coordinates`) is improved instead of building a new tour.
+    """
+    if len(coordinates) == 0:
+        return np.empty(0, dtype=int), {'initial_distance': 0.0, 'final_distance': 0.0, 'improvement': 0.0}
+    
+    optimizer = RouteOptimizer(depot={'latitude': depot[0], 'longitude': depot[1]}, **options)
+    distance_matrix = optimizer._build_distance_matrix(coordinates, keys)
+    order, stats = optimizer._route_order(distance_matrix, None if order is None else [int(k) + 1 for k in order])
+    if distance_matrix.durations is not None:
+        stats['travel_minutes'] = distance_matrix.path_duration([0] + list(order))
+    return np.asarray(order, dtype=int) - 1, stats
+
 # Initialize route optimizer
-route_optimizer = RouteOptimizer() 
\ No newline at end of file
+route_optimizer = RouteOptimizer(workers=int(os.environ.get('ROUTE_OPTIMIZER_WORKERS', 1)),
+                                 distance_cache=os.environ.get('ROUTE_DISTANCE_CACHE_DIR'),
+                                 road_network=os.environ.get('ROUTE_ROAD_NETWORK')) 
\ No newline at end of file
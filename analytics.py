@@ -1,12 +1,41 @@
 from flask import Blueprint, render_template, request, jsonify
-from models import db, Customer, ServiceRequest, Vehicle, Employee, Payment, Invoice, Contract, PricingPlan, Bill, Route
+from flask_login import login_required, current_user
+from models import db, Customer, ServiceRequest, Vehicle, Employee, Payment, Invoice, Contract, PricingPlan, Bill, Route, ServiceMetrics
+from analytics_aggregation import count_by, sum_by_period, count_by_period, totals
+from metrics_rollup import rollup_summary, rollup_series
+from response_cache import response_cache
 from datetime import datetime, timedelta
 import json
 import random
 
 analytics = Blueprint('analytics', __name__)
 
+def _date_arg(name):
+    value = request.args.get(name)
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+def _department_arg():
+    """?department_id=, limited to the caller's own department unless they are a super admin"""
+    department_id = request.args.get('department_id', type=int)
+    if current_user.role == 'super_admin':
+        return department_id
+    if department_id is not None and not current_user.can_access_department(department_id):
+        raise PermissionError('Access denied. You cannot access this department.')
+    return current_user.department_id
+
+def _in_department(model, department_id):
+    """Filters limiting `model`'s rows to a department; None leaves them unfiltered"""
+    if department_id is None:
+        return []
+    if hasattr(model, 'department_id'):
+        return [model.department_id == department_id]
+    # Customers, and their payments, belong to the departments that served them
+    served = db.select(ServiceRequest.customer_id).where(ServiceRequest.department_id == department_id)
+    customer_id = model.id if model is Customer else model.customer_id
+    return [customer_id.in_(served)]
+
 @analytics.route('/analytics')
+@login_required
 def analytics_dashboard():
     """Analytics dashboard"""
     # Get basic statistics
@@ -20,7 +49,7 @@ def analytics_dashboard():
     recent_payments = Payment.query.order_by(Payment.payment_date.desc()).limit(10).all()
     
     # Calculate revenue
-    total_revenue = sum(payment.amount for payment in Payment.query.all())
+    total_revenue, = totals(db.func.coalesce(db.func.sum(Payment.amount), 0))
     
     # Get service type distribution
     service_types = db.session.query(ServiceRequest.service_type, db.func.count(ServiceRequest.id)).group_by(ServiceRequest.service_type).all()
@@ -44,18 +73,17 @@ def analytics_dashboard():
                          vehicle_status=vehicle_status)
 
 @analytics.route('/api/analytics/revenue')
+@login_required
+@response_cache.cached(models=(Payment,))
 def revenue_analytics():
     """Revenue analytics API"""
-    # Get monthly revenue data
-    payments = Payment.query.all()
-    
-    # Group by month
-    monthly_revenue = {}
-    for payment in payments:
-        month = payment.payment_date.strftime('%Y-%m')
-        if month not in monthly_revenue:
-            monthly_revenue[month] = 0
-        monthly_revenue[month] += payment.amount
+    try:
+        department_id = _department_arg()
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    # Monthly revenue, summed in the database
+    monthly_revenue = sum_by_period(Payment.payment_date, Payment.amount, 'month',
+                                    *_in_department(Payment, department_id))
     
     return jsonify({
         'monthly_revenue': monthly_revenue,
@@ -64,111 +92,107 @@ def revenue_analytics():
     })
 
 @analytics.route('/api/analytics/customers')
+@login_required
+@response_cache.cached(models=(Customer,))
 def customer_analytics():
     """Customer analytics API"""
-    customers = Customer.query.all()
-    
-    # Customer type distribution
-    customer_types = {}
-    for customer in customers:
-        customer_type = customer.customer_type
-        if customer_type not in customer_types:
-            customer_types[customer_type] = 0
-        customer_types[customer_type] += 1
-    
-    # Service frequency distribution
-    service_frequencies = {}
-    for customer in customers:
-        frequency = customer.service_frequency
-        if frequency not in service_frequencies:
-            service_frequencies[frequency] = 0
-        service_frequencies[frequency] += 1
+    try:
+        department_id = _department_arg()
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    # Customer type and service frequency distributions
+    customers = _in_department(Customer, department_id)
+    customer_types = count_by(Customer.customer_type, *customers)
+    service_frequencies = count_by(Customer.service_frequency, *customers)
     
     return jsonify({
-        'total_customers': len(customers),
+        'total_customers': sum(customer_types.values()),
         'customer_types': customer_types,
         'service_frequencies': service_frequencies
     })
 
 @analytics.route('/api/analytics/operations')
+@login_required
+@response_cache.cached(models=(ServiceRequest, Vehicle, Employee))
 def operations_analytics():
     """Operations analytics API"""
-    requests = ServiceRequest.query.all()
-    vehicles = Vehicle.query.all()
-    employees = Employee.query.all()
-    
-    # Service request status distribution
-    request_status = {}
-    for request in requests:
-        status = request.status
-        if status not in request_status:
-            request_status[status] = 0
-        request_status[status] += 1
-    
-    # Vehicle utilization
-    vehicle_utilization = {}
-    for vehicle in vehicles:
-        status = vehicle.status
-        if status not in vehicle_utilization:
-            vehicle_utilization[status] = 0
-        vehicle_utilization[status] += 1
-    
-    # Employee roles
-    employee_roles = {}
-    for employee in employees:
-        role = employee.role
-        if role not in employee_roles:
-            employee_roles[role] = 0
-        employee_roles[role] += 1
+    try:
+        department_id = _department_arg()
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    # Service request status, vehicle status and employee position distributions
+    request_status = count_by(ServiceRequest.status, *_in_department(ServiceRequest, department_id))
+    vehicle_utilization = count_by(Vehicle.status, *_in_department(Vehicle, department_id))
+    employee_roles = count_by(Employee.position, *_in_department(Employee, department_id))
     
     return jsonify({
-        'total_requests': len(requests),
+        'total_requests': sum(request_status.values()),
         'request_status': request_status,
         'vehicle_utilization': vehicle_utilization,
         'employee_roles': employee_roles
     })
 
 @analytics.route('/api/analytics/performance')
+@login_required
+@response_cache.cached(models=(ServiceMetrics, ServiceRequest, Customer))
 def performance_analytics():
     """Performance analytics API"""
-    # Calculate completion rate
-    total_requests = ServiceRequest.query.count()
-    completed_requests = ServiceRequest.query.filter_by(status='completed').count()
-    completion_rate = (completed_requests / total_requests * 100) if total_requests > 0 else 0
-    
-    # Calculate average response time (simplified)
-    recent_completed = ServiceRequest.query.filter_by(status='completed').order_by(ServiceRequest.completed_at.desc()).limit(10).all()
-    avg_response_time = 0
-    if recent_completed:
-        total_time = sum((req.completed_at - req.created_at).total_seconds() for req in recent_completed if req.completed_at)
-        avg_response_time = total_time / len(recent_completed)
+    # Completion and response times from the daily rollup; ?start=&end= (ISO dates) and ?department_id= narrow it
+    try:
+        department_id = _department_arg()
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    start, end = _date_arg('start'), _date_arg('end')
+    summary = rollup_summary(start, end, department_id)
+    avg_response_time = summary['average_response_hours'] * 3600 if summary['average_response_hours'] else 0
     
     # Customer satisfaction (simplified - based on repeat customers)
-    customers_with_multiple_requests = db.session.query(ServiceRequest.customer_id).group_by(ServiceRequest.customer_id).having(db.func.count(ServiceRequest.id) > 1).count()
-    total_customers = Customer.query.count()
+    customers_with_multiple_requests = db.session.query(ServiceRequest.customer_id).filter(*_in_department(ServiceRequest, department_id)).group_by(ServiceRequest.customer_id).having(db.func.count(ServiceRequest.id) > 1).count()
+    total_customers = Customer.query.filter(*_in_department(Customer, department_id)).count()
     satisfaction_rate = (customers_with_multiple_requests / total_customers * 100) if total_customers > 0 else 0
     
     return jsonify({
-        'completion_rate': completion_rate,
+        'completion_rate': summary['completion_rate'],
         'avg_response_time': avg_response_time,
         'satisfaction_rate': satisfaction_rate,
-        'total_requests': total_requests,
-        'completed_requests': completed_requests
+        'customer_rating': summary['customer_satisfaction'],
+        'total_requests': summary['total_requests'],
+        'completed_requests': summary['completed_requests']
+    })
+
+@analytics.route('/api/analytics/metrics')
+@login_required
+@response_cache.cached(models=(ServiceMetrics,))
+def metrics_analytics():
+    """Daily service metrics rollup, bucketed by ?granularity= (day, week, month, year)"""
+    try:
+        department_id = _department_arg()
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    try:
+        start, end = _date_arg('start'), _date_arg('end')
+        series = rollup_series(request.args.get('granularity', 'day'), start, end, department_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'series': series,
+        'summary': rollup_summary(start, end, department_id)
     })
 
 @analytics.route('/api/analytics/forecast')
+@login_required
+@response_cache.cached(ttl=300, models=(ServiceRequest,))
 def forecast_analytics():
     """Forecast analytics API"""
+    try:
+        department_id = _department_arg()
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
     # Simple demand forecasting based on historical data
-    requests = ServiceRequest.query.all()
-    
-    # Group by month
-    monthly_requests = {}
-    for request in requests:
-        month = request.scheduled_date.strftime('%Y-%m')
-        if month not in monthly_requests:
-            monthly_requests[month] = 0
-        monthly_requests[month] += 1
+    # Requests per scheduled month
+    monthly_requests = count_by_period(ServiceRequest.scheduled_date, 'month',
+                                       *_in_department(ServiceRequest, department_id))
     
     # Calculate trend (simplified)
     if len(monthly_requests) >= 2:
@@ -194,54 +218,63 @@ def forecast_analytics():
     })
 
 @analytics.route('/api/analytics/comprehensive')
+@login_required
+@response_cache.cached(models=(Payment, Customer, ServiceRequest, Vehicle, Employee))
 def comprehensive_analytics():
     """Comprehensive analytics combining all metrics"""
-    # Get all data
-    customers = Customer.query.all()
-    requests = ServiceRequest.query.all()
-    payments = Payment.query.all()
-    vehicles = Vehicle.query.all()
-    employees = Employee.query.all()
+    try:
+        department_id = _department_arg()
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    requests = _in_department(ServiceRequest, department_id)
+    # One aggregate query per table; no rows are loaded into Python
+    total_revenue, total_payments = totals(db.func.coalesce(db.func.sum(Payment.amount), 0),
+                                           db.func.count(Payment.id), filters=_in_department(Payment, department_id))
+    customer_types = count_by(Customer.customer_type, *_in_department(Customer, department_id))
+    request_status = count_by(ServiceRequest.status, *requests)
+    service_type_distribution = count_by(ServiceRequest.service_type, *requests)
+    vehicle_status = count_by(Vehicle.status, *_in_department(Vehicle, department_id))
+    total_employees, = totals(db.func.count(Employee.id), filters=_in_department(Employee, department_id))
+    
+    repeat_customers = db.session.query(ServiceRequest.customer_id).filter(*requests).group_by(ServiceRequest.customer_id) \
+        .having(db.func.count(ServiceRequest.id) > 1).subquery()
+    returning_customers, = totals(db.func.count(repeat_customers.c.customer_id))
+    
+    total_revenue = float(total_revenue)
+    total_customers = sum(customer_types.values())
+    total_requests = sum(request_status.values())
+    total_vehicles = sum(vehicle_status.values())
     
     # Financial metrics
-    total_revenue = sum(payment.amount for payment in payments)
-    avg_revenue_per_customer = total_revenue / len(customers) if customers else 0
+    avg_revenue_per_customer = total_revenue / total_customers if total_customers else 0
     
     # Operational metrics
-    completion_rate = len([r for r in requests if r.status == 'completed']) / len(requests) * 100 if requests else 0
-    vehicle_utilization = len([v for v in vehicles if v.status == 'in_use']) / len(vehicles) * 100 if vehicles else 0
+    completion_rate = request_status.get('completed', 0) / total_requests * 100 if total_requests else 0
+    vehicle_utilization = vehicle_status.get('in_use', 0) / total_vehicles * 100 if total_vehicles else 0
     
     # Customer metrics
-    customer_retention = len([c for c in customers if len(c.requests) > 1]) / len(customers) * 100 if customers else 0
-    
-    # Service metrics
-    service_type_distribution = {}
-    for request in requests:
-        service_type = request.service_type
-        if service_type not in service_type_distribution:
-            service_type_distribution[service_type] = 0
-        service_type_distribution[service_type] += 1
+    customer_retention = returning_customers / total_customers * 100 if total_customers else 0
     
     return jsonify({
         'financial': {
             'total_revenue': total_revenue,
             'avg_revenue_per_customer': avg_revenue_per_customer,
-            'total_payments': len(payments)
+            'total_payments': total_payments
         },
         'operational': {
             'completion_rate': completion_rate,
             'vehicle_utilization': vehicle_utilization,
-            'total_requests': len(requests),
-            'total_vehicles': len(vehicles),
-            'total_employees': len(employees)
+            'total_requests': total_requests,
+            'total_vehicles': total_vehicles,
+            'total_employees': total_employees
         },
         'customer': {
-            'total_customers': len(customers),
+            'total_customers': total_customers,
             'customer_retention': customer_retention,
-            'customer_types': {c.customer_type: len([c2 for c2 in customers if c2.customer_type == c.customer_type]) for c in customers}
+            'customer_types': customer_types
         },
         'service': {
             'service_type_distribution': service_type_distribution,
-            'request_status': {r.status: len([r2 for r2 in requests if r2.status == r.status]) for r in requests}
+            'request_status': request_status
         }
     }) 
\ No newline at end of file
@@ -0,0 +1,140 @@
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Sequence, Tuple
+from sqlalchemy import event, func, cast, Integer
+from sqlalchemy.orm import Session
+from models import db
+
+# strftime patterns for SQLite and MySQL, to_char patterns for PostgreSQL; weeks are ISO weeks
+# ('2024-W01' starts on the Monday of the week holding 4 January), derived by _iso_week on SQLite
+BUCKET_FORMATS = {
+    'day': {'sqlite': '%Y-%m-%d', 'postgresql': 'YYYY-MM-DD', 'mysql': '%Y-%m-%d'},
+    'week': {'postgresql': 'IYYY-"W"IW', 'mysql': '%x-W%v'},
+    'month': {'sqlite': '%Y-%m', 'postgresql': 'YYYY-MM', 'mysql': '%Y-%m'},
+    'year': {'sqlite': '%Y', 'postgresql': 'YYYY', 'mysql': '%Y'}
+}
+
+
+def _number(value):
+    # SUM/AVG over Numeric columns come back as Decimal (or None over no rows)
+    return float(value) if value is not None else 0
+
+
+def date_bucket(column, granularity: str = 'month', dialect: str = None):
+    """SQL expression labelling a date/datetime column with its period, e.g. '2024-03' for months"""
+    if granularity not in BUCKET_FORMATS:
+        raise ValueError(f"Unknown granularity '{granularity}', expected one of {sorted(BUCKET_FORMATS)}")
+    dialect = dialect or db.engine.dialect.name
+    if dialect == 'postgresql':
+        return func.to_char(column, BUCKET_FORMATS[granularity]['postgresql'])
+    if dialect in ('mysql', 'mariadb'):
+        return func.date_format(column, BUCKET_FORMATS[granularity]['mysql'])
+    if granularity == 'week':
+        return _iso_week(column)
+    return func.strftime(BUCKET_FORMATS[granularity]['sqlite'], column)
+
+
+def _iso_week(column):
+    # SQLite's %W counts Monday-based weeks of the calendar year, and %G/%V need 3.46; the ISO
+    # year and week are those of the week's Thursday instead
+    thursday = func.date(column, '-3 days', 'weekday 4')
+    week = (cast(func.strftime('%j', thursday), Integer) + 6) // 7
+    return func.printf('%s-W%02d', func.strftime('%Y', thursday), week)
+
+
+def count_by(key, *filters) -> Dict:
+    """{key: row count}, grouped in the database; `key` is a column or expression"""
+    rows = db.session.query(key, func.count()).filter(*filters).group_by(key).all()
+    return {value: count for value, count in rows}
+
+
+def sum_by(key, value, *filters) -> Dict:
+    """{key: SUM(value)}, grouped in the database"""
+    rows = db.session.query(key, func.sum(value)).filter(*filters).group_by(key).all()
+    return {group: _number(total) for group, total in rows}
+
+
+def count_by_period(column, granularity: str = 'month', *filters) -> Dict:
+    """{period: row count} over a date column, oldest period first; rows without a date are skipped"""
+    bucket = date_bucket(column, granularity)
+    rows = db.session.query(bucket, func.count()).filter(column.isnot(None), *filters) \
+        .group_by(bucket).order_by(bucket).all()
+    return {period: count for period, count in rows}
+
+
+def sum_by_period(column, value, granularity: str = 'month', *filters) -> Dict:
+    """{period: SUM(value)} over a date column, oldest period first"""
+    bucket = date_bucket(column, granularity)
+    rows = db.session.query(bucket, func.sum(value)).filter(column.isnot(None), *filters) \
+        .group_by(bucket).order_by(bucket).all()
+    return {period: _number(total) for period, total in rows}
+
+
+def totals(*aggregates, filters: List = ()) -> tuple:
+    """Several scalar aggregates (func.count(), func.sum(...)) computed in one statement"""
+    return tuple(db.session.query(*aggregates).filter(*filters).one())
+
+
+def hours_between(start, end, dialect: str = None):
+    """SQL expression for the hours from one datetime column to another"""
+    dialect = dialect or db.engine.dialect.name
+    if dialect == 'postgresql':
+        return func.extract('epoch', end - start) / 3600.0
+    if dialect in ('mysql', 'mariadb'):
+        return func.timestampdiff(db.text('SECOND'), start, end) / 3600.0
+    return (func.julianday(end) - func.julianday(start)) * 24.0
+
+
+def add_to_row(model, values: Dict, key: Sequence[str], added: Sequence[str], derived: Callable = None,
+               dialect: str = None):
+    """INSERT ... ON CONFLICT statement inserting `values`, or adding its `added` columns to the row
+    with the same `key` (the column names or expressions of a unique index)
+
+    `derived`, given {column: its updated total}, returns further columns to SET from them.
+    """
+    dialect = dialect or db.engine.dialect.name
+    table = model.__table__
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    statement = insert(table).values(values)
+    incoming = statement.inserted if dialect in ('mysql', 'mariadb') else statement.excluded
+    totals = {name: func.coalesce(table.c[name], 0) + incoming[name] for name in added}
+    extra = derived(totals) if derived else {}
+    if dialect in ('mysql', 'mariadb'):
+        # MySQL evaluates SET left to right against already updated columns: derived ones go first
+        return statement.on_duplicate_key_update(list(extra.items()) + list(totals.items()))
+    return statement.on_conflict_do_update(index_elements=list(key), set_={**totals, **extra})
+
+
+def changed_rows(session, flush_context, model, columns: Sequence[str]) -> Tuple[List, List, List, Dict]:
+    """New, edited and deleted `model` objects of a flush, with the old values of `columns` for the
+    edited and deleted ones by id (as namespaces); edited means one of `columns` changed
+
+    Old values are read back from the rows, since attributes expired by a commit keep no history;
+    the result is computed once per flush and model for every hook that asks.
+    """
+    history = session.info.get('changed_rows')
+    if history is None or history[0] is not flush_context:
+        history = session.info['changed_rows'] = (flush_context, {})
+    if model in history[1]:
+        return history[1][model]
+    new = [obj for obj in session.new if isinstance(obj, model)]
+    edited = [obj for obj in session.dirty if isinstance(obj, model) and obj.id is not None
+              and any(db.inspect(obj).attrs[name].history.has_changes() for name in columns)]
+    deleted = [obj for obj in session.deleted if isinstance(obj, model)]
+    old = {}
+    if edited or deleted:
+        with session.no_autoflush:
+            rows = session.query(model.id, *[getattr(model, name) for name in columns]) \
+                .filter(model.id.in_([obj.id for obj in edited + deleted])).all()
+        old = {row[0]: SimpleNamespace(**dict(zip(columns, row[1:]))) for row in rows}
+    result = history[1][model] = (new, edited, deleted, old)
+    return result
+
+
+@event.listens_for(Session, 'after_flush')
+def _forget_changed_rows(session, flush_context):
+    session.info.pop('changed_rows', None)
@@ -1,8 +1,19 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, send_file, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from models import db, User, Department, Customer, ServiceRequest, Vehicle, Employee, Payment, Invoice, Contract, PricingPlan, Bill, Schedule, Route, WasteType, Inventory, Notification, ServiceMetrics, CustomerFeedback, MarketAnalysis, EquipmentMaintenance, RouteOptimization, CustomerPortal, Task
+from models import db, User, Department, Customer, ServiceRequest, Vehicle, Employee, Payment, Invoice, Contract, PricingPlan, Bill, Schedule, Route, WasteType, Inventory, Notification, ServiceMetrics, CustomerFeedback, MarketAnalysis, EquipmentMaintenance, RouteOptimization, CustomerPortal, Task, ExportJob
 from auth import auth, require_role, require_permission, require_department_access, create_super_admin, create_departments, create_sample_users
+from route_optimization_api import route_optimization_api
+from optimization_jobs import optimization_jobs
+from analytics import analytics
+from mobile_app_api import mobile_tracking
+from metrics_rollup import rollup_summary, rollup_series
+from response_cache import response_cache
+from report_export import report_exports, report_name, report_header, check_format, stream_rows, TEXT_WRITERS, FILE_FORMATS, MIMETYPES
+from geocoding import batch_geocoder
+from schema_upgrade import upgrade_schema
+from eta_service import eta_service
+from demand_aggregates import demand_aggregates
 from datetime import datetime, timedelta
 import os
 
@@ -23,6 +34,13 @@ def load_user(user_id):
 
 # Register blueprints
 app.register_blueprint(auth, url_prefix='/auth')
+app.register_blueprint(route_optimization_api)
+app.register_blueprint(analytics)
+app.register_blueprint(mobile_tracking)
+optimization_jobs.init_app(app)
+response_cache.init_app(app)
+eta_service.init_app(app)
+report_exports.init_app(app)
 
 # Custom route to serve JavaScript files with correct MIME type
 @app.route('/static/js/<path:filename>')
@@ -33,6 +51,11 @@ def serve_js(filename):
 def init_database():
     with app.app_context():
         db.create_all()
+        upgrade_schema()
+        demand_aggregates.ensure_loaded()
+        optimization_jobs.resume()
+        report_exports.resume()
+        eta_service.restore()
         create_super_admin()
         create_departments()
         create_sample_users()
@@ -217,6 +240,7 @@ def add_customer():
                 address=address,
                 created_by=current_user.id
             )
+            batch_geocoder.geocode_customer(customer)
             db.session.add(customer)
             db.session.commit()
             flash('Customer added successfully!', 'success')
@@ -420,14 +444,18 @@ def get_department_details(dept_id):
 
 @app.route('/api/analytics/quick-report')
 @login_required
+@response_cache.cached(models=(Customer, ServiceRequest, Payment, ServiceMetrics))
 def quick_report():
-    # TODO: Implement actual analytics logic
+    # Request counts and growth come from the ServiceMetrics rollup
+    monthly = list(rollup_series('month').values())
+    previous, current = ([0, 0] + [month['total_requests'] for month in monthly])[-2:]
+    monthly_growth = round((current - previous) / previous * 100, 1) if previous else 0.0
     return jsonify({
         'total_customers': Customer.query.count(),
-        'total_requests': ServiceRequest.query.count(),
+        'total_requests': rollup_summary()['total_requests'],
         'pending_requests': ServiceRequest.query.filter_by(status='pending').count(),
         'total_revenue': db.session.query(db.func.sum(Payment.amount)).scalar() or 0.0,
-        'monthly_growth': 15.5,
+        'monthly_growth': monthly_growth,
         'top_services': ['Regular Pickup', 'Bulk Waste', 'Recycling'],
         'recent_activity': [
             {'type': 'New Customer', 'description': 'John Doe registered', 'time': '2 hours ago'},
@@ -439,6 +467,7 @@ def quick_report():
 # Comprehensive Reporting API Routes
 @app.route('/api/reports/overview')
 @login_required
+@response_cache.cached(models=(Invoice, ServiceRequest, Customer, Vehicle))
 def reports_overview():
     """Get overview statistics for the dashboard"""
     try:
@@ -685,17 +714,52 @@ def fleet_performance():
 @app.route('/api/reports/export/<report_type>')
 @login_required
 def export_report(report_type):
-    """Export reports in various formats"""
+    """Export a report as CSV or JSON Lines, streamed; ?background=1 (or Parquet/XLSX) writes it as a job"""
+    # Exports hold every customer, payment and invoice, not just the caller's department
+    if current_user.role not in ('super_admin', 'department_admin'):
+        return jsonify({'error': 'Access denied. Exports require an administrator.'}), 403
+    fmt = request.args.get('format', 'csv').lower()
     try:
-        # This would generate actual export files
-        # For now, return a success message
-        return jsonify({
-            'success': True,
-            'message': f'{report_type} report exported successfully',
-            'download_url': f'/downloads/{report_type}_report.pdf'
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        report_type = report_name(report_type)
+        check_format(fmt)
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else None
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if fmt in FILE_FORMATS or request.args.get('background') in ('1', 'true'):
+        job = report_exports.submit(report_type, fmt, start, end, created_by=current_user.id)
+        return jsonify({**job.to_dict(), 'status_url': url_for('export_status', job_id=job.id)}), 202
+    
+    # Chunked response straight from the server-side cursor
+    chunks = TEXT_WRITERS[fmt](report_header(report_type), stream_rows(report_type, start, end))
+    filename = f"{report_type}_{datetime.utcnow():%Y%m%d}.{fmt}"
+    return app.response_class(stream_with_context(chunks), mimetype=MIMETYPES[fmt],
+                              headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/api/reports/exports/<int:job_id>')
+@login_required
+def export_status(job_id):
+    """Status of a background export job"""
+    job = db.session.get(ExportJob, job_id)
+    if job is None or (job.created_by != current_user.id and current_user.role != 'super_admin'):
+        return jsonify({'error': 'Export job not found'}), 404
+    result = job.to_dict()
+    if job.status == 'completed':
+        result['download_url'] = url_for('download_export', job_id=job.id)
+    return jsonify(result)
+
+@app.route('/api/reports/exports/<int:job_id>/download')
+@login_required
+def download_export(job_id):
+    """File written by a completed export job"""
+    job = db.session.get(ExportJob, job_id)
+    if job is None or (job.created_by != current_user.id and current_user.role != 'super_admin'):
+        return jsonify({'error': 'Export job not found'}), 404
+    if job.status != 'completed' or not job.path or not os.path.exists(job.path):
+        return jsonify({'error': 'Export is not ready', 'status': job.status}), 409
+    return send_file(job.path, mimetype=MIMETYPES[job.format], as_attachment=True,
+                     download_name=os.path.basename(job.path))
 
 # Error handlers
 @app.errorhandler(404)
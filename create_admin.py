@@ -7,6 +7,7 @@ Creates super admin, departments, and sample users with role-based access contro
 from app import app, db
 from models import User, Department, Employee
 from auth import create_super_admin, create_departments, create_sample_users
+from schema_upgrade import upgrade_schema
 from datetime import datetime, date
 
 def init_database():
@@ -16,6 +17,7 @@ def init_database():
     with app.app_context():
         # Create database tables
         db.create_all()
+        upgrade_schema()
         print("✅ Database tables created")
         
         # Create super admin
@@ -0,0 +1,203 @@
+import calendar
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Tuple
+from sqlalchemy import event, func, case
+from sqlalchemy.orm import Session
+from models import db, ServiceRequest, ServiceMetrics, DemandPattern
+from analytics_aggregation import add_to_row, changed_rows
+
+
+def as_date(value) -> date:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])  # SQLite returns dates as text
+
+
+def request_day(service_request) -> date:
+    """Day a request counts towards: its scheduled date, else the day it was created"""
+    return as_date(service_request.scheduled_date) or as_date(service_request.created_at) or date.today()
+
+
+# Request columns the flush hooks derive their rollups from
+REQUEST_COLUMNS = ('status', 'scheduled_date', 'department_id', 'created_at', 'completed_at')
+
+
+class _Totals:
+    """Request totals and observed days per weekday and month"""
+
+    def __init__(self):
+        self.weekday_total = [0] * 7
+        self.weekday_days = [0] * 7
+        self.month_total = [0] * 13
+        self.month_days = [0] * 13
+        self.weekday_completed = [0] * 7
+        self.total = 0
+        self.days = 0
+
+    def add_requests(self, weekday: int, month: int, requests: int, completed: int = 0):
+        self.weekday_total[weekday] += requests
+        self.month_total[month] += requests
+        self.weekday_completed[weekday] += completed
+        self.total += requests
+
+    def add_day(self, day: date):
+        self.weekday_days[day.weekday()] += 1
+        self.month_days[day.month] += 1
+        self.days += 1
+
+    def add_span(self, first: date, last: date):
+        """Count every day from `first` to `last`, including those without requests, in O(months)"""
+        days = (last - first).days + 1
+        weeks, rest = divmod(days, 7)
+        for weekday in range(7):
+            self.weekday_days[weekday] += weeks + ((weekday - first.weekday()) % 7 < rest)
+        month_start = first
+        while month_start <= last:
+            month_end = month_start.replace(day=calendar.monthrange(month_start.year, month_start.month)[1])
+            self.month_days[month_start.month] += (min(month_end, last) - month_start).days + 1
+            month_start = month_end + timedelta(days=1)
+        self.days += days
+
+    def predict(self, confidence_level: float) -> Dict:
+        overall = self.total / self.days if self.days else 0
+        weekly = {day: max(0, self.weekday_total[day] / self.weekday_days[day])
+                  if self.weekday_days[day] else overall for day in range(7)}
+        monthly = {month: self.month_total[month] / self.month_days[month]
+                   for month in range(1, 13) if self.month_days[month]}
+        completion = {day: self.weekday_completed[day] / self.weekday_total[day]
+                      for day in range(7) if self.weekday_total[day]}
+        return {
+            'next_week_prediction': weekly,
+            'monthly_pattern': monthly,
+            'completion_rate': completion,
+            'days_observed': self.days,
+            'confidence_level': confidence_level,
+            'model_type': 'time_series_pattern'
+        }
+
+
+class DemandAggregates:
+    """Request demand per weekday and month, kept in the DemandPattern table
+
+    The table holds request and completion totals per scope (every department,
+    and each one), weekday and month. The flush hook below adds each flush's
+    changes to it in the same transaction, so every worker reads the same,
+    committed counts. A prediction reads at most 84 rows plus the first and
+    last day of the ServiceMetrics rollup; every day in between counts,
+    including those without requests.
+    """
+
+    CONFIDENCE_LEVEL = 0.85
+
+    def __init__(self):
+        self._seeded = False
+
+    def rebuild(self) -> int:
+        """(Re)build the table from the ServiceRequest history with one GROUP BY; returns rows written"""
+        day = func.coalesce(ServiceRequest.scheduled_date, func.date(ServiceRequest.created_at))
+        rows = db.session.query(
+            day, ServiceRequest.department_id, func.count(ServiceRequest.id),
+            func.sum(case((ServiceRequest.status == 'completed', 1), else_=0))
+        ).group_by(day, ServiceRequest.department_id).all()
+
+        totals = defaultdict(lambda: [0, 0])
+        for value, department_id, requests, completed in rows:
+            requests_day = as_date(value) or date.today()
+            for scope in _scopes(department_id):
+                bucket = totals[(scope, requests_day.weekday(), requests_day.month)]
+                bucket[0] += requests
+                bucket[1] += completed or 0
+        DemandPattern.query.delete(synchronize_session=False)
+        db.session.add_all(DemandPattern(scope=scope, weekday=weekday, month=month, requests=requests,
+                                         completed=completed)
+                           for (scope, weekday, month), (requests, completed) in totals.items())
+        db.session.commit()
+        return len(totals)
+
+    def ensure_loaded(self):
+        """Build the table once if it is empty while requests exist (call inside an app context)"""
+        if self._seeded:
+            return
+        if DemandPattern.query.first() is None and ServiceRequest.query.first() is not None:
+            self.rebuild()
+        self._seeded = True
+
+    def predict(self, department_id: int = None) -> Dict:
+        """Expected requests for each weekday (0 = Monday), with monthly and completion patterns"""
+        scope = _scope(department_id)
+        totals = _Totals()
+        for weekday, month, requests, completed in db.session.query(
+                DemandPattern.weekday, DemandPattern.month, DemandPattern.requests, DemandPattern.completed) \
+                .filter(DemandPattern.scope == scope):
+            totals.add_requests(weekday, month, requests or 0, completed or 0)
+
+        in_scope = [ServiceMetrics.total_requests > 0]
+        if department_id is not None:
+            in_scope.append(ServiceMetrics.department_id == department_id)
+        first, last = db.session.query(func.min(ServiceMetrics.metric_date), func.max(ServiceMetrics.metric_date)) \
+            .filter(*in_scope).one()
+        if first is not None:
+            totals.add_span(as_date(first), as_date(last))
+        return totals.predict(self.CONFIDENCE_LEVEL)
+
+    @classmethod
+    def predict_from_history(cls, historical_data: List[Dict]) -> Dict:
+        """Prediction from explicit {'date', 'requests'} rows instead of the database; every row is a
+        day observed, including those with no requests"""
+        totals = _Totals()
+        days = set()
+        for row in historical_data:
+            day = as_date(row['date'])
+            if day not in days:
+                days.add(day)
+                totals.add_day(day)
+            totals.add_requests(day.weekday(), day.month, int(row['requests']), int(row.get('completed', 0)))
+        return totals.predict(cls.CONFIDENCE_LEVEL)
+
+
+# Shared aggregates over the ServiceRequest table
+demand_aggregates = DemandAggregates()
+
+
+def _scope(department_id) -> str:
+    return 'all' if department_id is None else str(department_id)
+
+
+def _scopes(department_id) -> List[str]:
+    # Requests without a department only count towards the total
+    return ['all'] if department_id is None else ['all', str(department_id)]
+
+
+def _request_change(service_request, sign: int) -> Tuple[int, date, int, int]:
+    return (service_request.department_id, request_day(service_request), sign,
+            sign if service_request.status == 'completed' else 0)
+
+
+@event.listens_for(Session, 'before_flush')
+def _update_demand_patterns(session, flush_context, instances):
+    if not (session.new or session.dirty or session.deleted):
+        return
+    new, edited, deleted, old = changed_rows(session, flush_context, ServiceRequest, REQUEST_COLUMNS)
+    changes = [_request_change(obj, 1) for obj in new + edited]
+    changes += [_request_change(previous, -1) for previous in old.values()]
+    if not changes:
+        return
+
+    deltas = defaultdict(lambda: [0, 0])
+    for department_id, day, requests, completed in changes:
+        for scope in _scopes(department_id):
+            delta = deltas[(scope, day.weekday(), day.month)]
+            delta[0] += requests
+            delta[1] += completed
+    # Upserts in the flush's transaction: they commit or roll back with the requests
+    with session.no_autoflush:
+        for (scope, weekday, month), (requests, completed) in deltas.items():
+            if requests or completed:
+                session.execute(add_to_row(DemandPattern, {'scope': scope, 'weekday': weekday, 'month': month,
+                                                           'requests': requests, 'completed': completed},
+                                           key=('scope', 'weekday', 'month'), added=('requests', 'completed')))
@@ -0,0 +1,237 @@
+import json
+import os
+import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Tuple, Sequence
+from distance_matrix import haversine_distance
+from stop_array import MISSING_ID
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single worker
+    fcntl = None
+
+
+def location_key(point: Dict) -> str:
+    """Stable cache key for a stop: its customer when known, otherwise its rounded coordinates"""
+    if point.get('customer_id') is not None:
+        return f"customer:{point['customer_id']}"
+    return f"{float(point['latitude']):.6f},{float(point['longitude']):.6f}"
+
+
+def stop_location_keys(stops: np.ndarray) -> List[str]:
+    """`location_key` of every row of a structured stop array (see stop_array.STOP_DTYPE)"""
+    return [f"customer:{customer}" if customer != MISSING_ID else f"{lat:.6f},{lon:.6f}"
+            for customer, lat, lon in zip(stops['customer_id'].tolist(), stops['latitude'].tolist(),
+                                          stops['longitude'].tolist())]
+
+
+class DistanceCache:
+    """Disk-backed distance (km) and travel-time (minutes) matrices keyed by location ID
+
+    Both matrices are float32 memory maps in `directory`, sized to a capacity that
+    doubles as locations are added; `index.json` maps location IDs to rows. Rows are
+    filled against every known location when a location is registered, so lookups
+    only ever slice. Recently used sub-matrices are kept in an in-memory LRU.
+
+    Several processes may share a directory: `ensure` holds an exclusive lock on
+    `index.lock` while it reloads the index and writes rows and index, lookups
+    hold a shared one, and rows are only ever appended, never reassigned.
+    """
+
+    INDEX_FILE = 'index.json'
+    LOCK_FILE = 'index.lock'
+    DISTANCE_FILE = 'distances.dat'
+    DURATION_FILE = 'durations.dat'
+    DTYPE = np.float32
+    CHUNK_ROWS = 1024
+
+    def __init__(self, directory: str, avg_speed_kmh: float = 30, initial_capacity: int = 1024,
+                 max_cached_submatrices: int = 32):
+        self.directory = directory
+        self.avg_speed_kmh = avg_speed_kmh
+        self.initial_capacity = initial_capacity
+        self.max_cached_submatrices = max_cached_submatrices
+        self._submatrices = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+        with self._locked():
+            self._load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _locked(self, exclusive: bool = False):
+        """Hold the directory's lock file, shared for reads and exclusive for writes"""
+        if fcntl is None:
+            yield
+            return
+        with open(self._path(self.LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self):
+        """(Re)open the index and memory maps as they are on disk"""
+        index_path = self._path(self.INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+        else:
+            index = {'capacity': 0, 'avg_speed_kmh': self.avg_speed_kmh, 'ids': [], 'coordinates': []}
+
+        # Travel times are only valid for the speed they were computed with
+        if index['ids'] and index.get('avg_speed_kmh') != self.avg_speed_kmh:
+            index = {'capacity': 0, 'avg_speed_kmh': self.avg_speed_kmh, 'ids': [], 'coordinates': []}
+
+        self.capacity = index['capacity']
+        self.ids = index['ids']
+        self.rows = {location_id: row for row, location_id in enumerate(self.ids)}
+        self.coordinates = np.zeros((self.capacity, 2))
+        self.coordinates[:len(self.ids)] = np.asarray(index['coordinates'], dtype=float).reshape(-1, 2)
+        self.distances = self._open(self.DISTANCE_FILE, self.capacity)
+        self.durations = self._open(self.DURATION_FILE, self.capacity)
+        self._submatrices.clear()
+        self._index_stamp = self._modified()
+
+    def _modified(self) -> tuple:
+        # The index is replaced, never rewritten in place, so a new inode means a new index
+        path = self._path(self.INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _open(self, name: str, capacity: int, mode: str = 'r+'):
+        if capacity == 0:
+            return np.zeros((0, 0), dtype=self.DTYPE)
+        return np.memmap(self._path(name), dtype=self.DTYPE, mode=mode, shape=(capacity, capacity))
+
+    def _save_index(self):
+        index = {
+            'capacity': self.capacity,
+            'avg_speed_kmh': self.avg_speed_kmh,
+            'ids': self.ids,
+            'coordinates': self.coordinates[:len(self.ids)].tolist()
+        }
+        temporary = self._path(self.INDEX_FILE + '.tmp')
+        with open(temporary, 'w') as f:
+            json.dump(index, f)
+        os.replace(temporary, self._path(self.INDEX_FILE))
+        self._index_stamp = self._modified()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, location_id: str) -> bool:
+        return location_id in self.rows
+
+    def _grow(self, required: int):
+        """Copy both matrices into larger files when the capacity is exhausted"""
+        capacity = max(self.capacity, self.initial_capacity)
+        while capacity < required:
+            capacity *= 2
+        if capacity == self.capacity:
+            return
+
+        size = len(self.ids)
+        for name, attribute in ((self.DISTANCE_FILE, 'distances'), (self.DURATION_FILE, 'durations')):
+            grown = np.memmap(self._path(name + '.tmp'), dtype=self.DTYPE, mode='w+', shape=(capacity, capacity))
+            grown[:size, :size] = getattr(self, attribute)[:size, :size]
+            grown.flush()
+            del grown
+            setattr(self, attribute, None)
+            os.replace(self._path(name + '.tmp'), self._path(name))
+
+        coordinates = np.zeros((capacity, 2))
+        coordinates[:size] = self.coordinates[:size]
+        self.coordinates = coordinates
+        self.capacity = capacity
+        self.distances = self._open(self.DISTANCE_FILE, capacity)
+        self.durations = self._open(self.DURATION_FILE, capacity)
+
+    def ensure(self, location_ids: Sequence[str], coordinates) -> int:
+        """Register unknown locations (or moved ones) and fill their rows; returns rows written"""
+        coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+        with self._locked(exclusive=True):
+            # Rows are assigned from the index on disk, which another process may have extended
+            if self._modified() != self._index_stamp:
+                self._load()
+            return self._ensure(location_ids, coordinates)
+
+    def _ensure(self, location_ids: Sequence[str], coordinates: np.ndarray) -> int:
+        stale = {}
+        for location_id, point in zip(location_ids, coordinates):
+            row = self.rows.get(location_id)
+            if row is None or not np.allclose(self.coordinates[row], point):
+                stale[location_id] = point
+        if not stale:
+            return 0
+
+        new_ids = [location_id for location_id in stale if location_id not in self.rows]
+        self._grow(len(self.ids) + len(new_ids))
+        for location_id in new_ids:
+            self.rows[location_id] = len(self.ids)
+            self.ids.append(location_id)
+
+        rows = np.array([self.rows[location_id] for location_id in stale])
+        self.coordinates[rows] = np.array(list(stale.values()))
+        size = len(self.ids)
+
+        # Vectorized blocks of stale rows against every known location, bounded in memory
+        known = self.coordinates[:size]
+        for chunk in range(0, len(rows), self.CHUNK_ROWS):
+            part = rows[chunk:chunk + self.CHUNK_ROWS]
+            block = haversine_distance(self.coordinates[part, 0, None], self.coordinates[part, 1, None],
+                                       known[None, :, 0], known[None, :, 1])
+            self.distances[part, :size] = block
+            self.distances[:size, part] = block.T
+            self.durations[part, :size] = block / self.avg_speed_kmh * 60
+            self.durations[:size, part] = block.T / self.avg_speed_kmh * 60
+        self.distances.flush()
+        self.durations.flush()
+        self._save_index()
+        self._submatrices.clear()
+        return len(rows)
+
+    def submatrix(self, location_ids: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Distance and duration matrices between the given (already registered) locations"""
+        with self._locked():
+            return self._submatrix(tuple(location_ids))
+
+    def _submatrix(self, key: Tuple[str, ...]) -> Tuple[np.ndarray, np.ndarray]:
+        # Another process may have registered or moved locations since this one opened the files
+        if self._modified() != self._index_stamp:
+            self._load()
+
+        cached = self._submatrices.get(key)
+        if cached is not None:
+            self._submatrices.move_to_end(key)
+            return cached
+
+        missing = [location_id for location_id in key if location_id not in self.rows]
+        if missing:
+            raise KeyError(f"Locations not in distance cache: {missing[:5]}")
+
+        rows = np.array([self.rows[location_id] for location_id in key], dtype=int)
+        block = np.ix_(rows, rows)
+        result = (self.distances[block].astype(float), self.durations[block].astype(float))
+
+        self._submatrices[key] = result
+        if len(self._submatrices) > self.max_cached_submatrices:
+            self._submatrices.popitem(last=False)
+        return result
+
+
+# One cache per directory and process, so pool workers reuse their open memory maps
+_open_caches = {}
+
+
+def open_distance_cache(directory: str, avg_speed_kmh: float = 30) -> DistanceCache:
+    cache = _open_caches.get((directory, avg_speed_kmh))
+    if cache is None:
+        cache = _open_caches[(directory, avg_speed_kmh)] = DistanceCache(directory, avg_speed_kmh)
+    return cache
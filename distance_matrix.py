@@ -0,0 +1,87 @@
+import numpy as np
+from typing import List, Dict, Sequence
+
+# Mean Earth radius used for great-circle distances
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometres; accepts scalars or broadcastable arrays"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_matrix(origins, destinations=None) -> np.ndarray:
+    """Pairwise great-circle distances (km) between two (n, 2) lat/lon arrays"""
+    origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+    destinations = origins if destinations is None else np.asarray(destinations, dtype=float).reshape(-1, 2)
+
+    return haversine_distance(origins[:, 0, None], origins[:, 1, None],
+                              destinations[None, :, 0], destinations[None, :, 1])
+
+
+class DistanceMatrix:
+    """Pairwise great-circle distances (km) for a set of stops, computed in one batch
+
+    The full matrix is only built on first access to `distances`, so very large
+    clusters can still measure paths leg by leg without O(n^2) memory. Matrices
+    from a road network also carry `durations` (minutes).
+    """
+
+    def __init__(self, coordinates, distances: np.ndarray = None, durations: np.ndarray = None):
+        self.coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+        self._distances = None if distances is None else np.asarray(distances, dtype=float)
+        self.durations = None if durations is None else np.asarray(durations, dtype=float)
+
+    @property
+    def distances(self) -> np.ndarray:
+        if self._distances is None:
+            self._distances = haversine_matrix(self.coordinates)
+        return self._distances
+
+    @classmethod
+    def from_points(cls, points: List[Dict]) -> 'DistanceMatrix':
+        """Build a matrix from dicts carrying 'latitude'/'longitude' keys"""
+        return cls([[p['latitude'], p['longitude']] for p in points])
+
+    def __len__(self) -> int:
+        return len(self.coordinates)
+
+    def distance(self, i: int, j: int) -> float:
+        return float(self.distances[i, j])
+
+    def path_length(self, order: Sequence[int]) -> float:
+        """Total length of the path visiting the given indices in order"""
+        order = np.asarray(order, dtype=int)
+        if len(order) < 2:
+            return 0.0
+        if self._distances is not None:
+            return float(self._distances[order[:-1], order[1:]].sum())
+
+        points = self.coordinates[order]
+        return float(haversine_distance(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1]).sum())
+
+    def path_duration(self, order: Sequence[int]) -> float:
+        """Driving minutes along the path, or None when the matrix has no durations"""
+        if self.durations is None:
+            return None
+        order = np.asarray(order, dtype=int)
+        return float(self.durations[order[:-1], order[1:]].sum()) if len(order) > 1 else 0.0
+
+    def submatrix(self, indices: Sequence[int]) -> 'DistanceMatrix':
+        """Matrix restricted to a subset of stops, without recomputing distances"""
+        indices = np.asarray(indices, dtype=int)
+        block = np.ix_(indices, indices)
+        return DistanceMatrix(self.coordinates[indices], self.distances[block],
+                              None if self.durations is None else self.durations[block])
+
+
+def to_unit_vectors(coordinates) -> np.ndarray:
+    """Map lat/lon to 3D points on the unit sphere; chord order matches great-circle order"""
+    coordinates = np.radians(np.asarray(coordinates, dtype=float).reshape(-1, 2))
+    lat, lon = coordinates[:, 0], coordinates[:, 1]
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
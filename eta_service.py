@@ -0,0 +1,241 @@
+import json
+import os
+import sqlite3
+import threading
+import numpy as np
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from distance_matrix import haversine_distance
+from stop_array import to_minutes
+
+# A GPS fix this close to a stop counts as arriving there; leaving this radius again as departing
+ARRIVAL_RADIUS_KM = 0.05
+DEPARTURE_RADIUS_KM = 0.15
+# Stops ahead of the expected one checked for arrival, so skipped stops do not stall the ETAs
+ARRIVAL_LOOKAHEAD = 5
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS routes (vehicle_id TEXT PRIMARY KEY, loaded_at TEXT NOT NULL,
+        stop_count INTEGER NOT NULL, next_stop INTEGER NOT NULL DEFAULT 0, arrived INTEGER NOT NULL DEFAULT 0,
+        fix_time TEXT, lead_minutes REAL NOT NULL DEFAULT 0);
+    CREATE TABLE IF NOT EXISTS stops (vehicle_id TEXT NOT NULL, position INTEGER NOT NULL, request_id TEXT,
+        latitude REAL NOT NULL, longitude REAL NOT NULL, travel REAL NOT NULL, service REAL NOT NULL,
+        planned TEXT, PRIMARY KEY (vehicle_id, position));
+    CREATE INDEX IF NOT EXISTS stops_request ON stops (request_id);
+"""
+
+
+class ETAService:
+    """Live arrival estimates for the stops of every vehicle's planned route
+
+    Routes are loaded from optimized plans. Each stop row keeps prefix sums of
+    the route's travel minutes and of the service minutes before it; each route
+    row keeps the vehicle's progress. A GPS fix moves the vehicle along its route
+    (plus a short arrival lookahead) and only updates that vehicle's lead time;
+    a stop's ETA is then the fix time plus the lead plus differences of the
+    prefix sums, one indexed lookup per request.
+
+    The table is a SQLite file shared by every worker (`init_app`), so fixes
+    received by one worker move the ETAs served by all of them. Without
+    `init_app` it is an in-memory database private to the process.
+    """
+
+    def __init__(self, avg_speed_kmh: float = 30, service_minutes: float = 15):
+        # Same defaults as RouteOptimizer, so ETAs line up with the planned times
+        self.avg_speed_kmh = avg_speed_kmh
+        self.service_minutes = service_minutes
+        self.path = None
+        self._memory = None
+        self._local = threading.local()
+        self._lock = threading.RLock()
+
+    def init_app(self, app):
+        self.path = app.config.get('ETA_TABLE_PATH') or os.path.join(app.instance_path, 'eta.db')
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._connection().executescript(SCHEMA)
+        app.extensions['eta_service'] = self
+
+    def _connection(self) -> sqlite3.Connection:
+        if self.path is None:
+            if self._memory is None:
+                self._memory = sqlite3.connect(':memory:', isolation_level=None, check_same_thread=False)
+                self._memory.executescript(SCHEMA)
+            return self._memory
+        # One autocommit connection per thread and file, as in the response cache
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.path != self.path:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection, self._local.path = connection, self.path
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front, so read-modify-write of a route is atomic across workers
+        with self._lock:
+            connection = self._connection()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+    def _minutes(self, distance_km):
+        return distance_km / self.avg_speed_kmh * 60
+
+    def load_plan(self, plan: Dict, service_date: datetime = None, loaded_at: datetime = None,
+                  replace: bool = True):
+        """Register every route of an optimized plan, replacing earlier routes of the same vehicles
+
+        With `replace=False` vehicles that already have a route keep it, and their progress.
+        """
+        service_date = (service_date or datetime.utcnow()).replace(hour=0, minute=0, second=0, microsecond=0)
+        loaded_at = (loaded_at or datetime.utcnow()).isoformat()
+        with self._transaction() as connection:
+            for route in plan.get('optimized_routes', []):
+                requests = route.get('requests', [])
+                if route.get('vehicle_id') is None or not requests:
+                    continue
+                vehicle_id = str(route['vehicle_id'])
+                if not replace and connection.execute('SELECT 1 FROM routes WHERE vehicle_id = ?',
+                                                      (vehicle_id,)).fetchone():
+                    continue
+
+                coordinates = np.array([[r['latitude'], r['longitude']] for r in requests], dtype=float)
+                legs = haversine_distance(coordinates[:-1, 0], coordinates[:-1, 1],
+                                          coordinates[1:, 0], coordinates[1:, 1])
+                travel = np.concatenate([[0.0], np.cumsum(self._minutes(legs))])
+                service = np.concatenate([[0.0], np.cumsum([r.get('service_minutes') or self.service_minutes
+                                                             for r in requests])])
+                planned = [(service_date + timedelta(minutes=to_minutes(t))).isoformat()
+                           for t in route.get('arrival_times', [])] or [None] * len(requests)
+
+                connection.execute('DELETE FROM stops WHERE vehicle_id = ?', (vehicle_id,))
+                connection.execute('INSERT OR REPLACE INTO routes (vehicle_id, loaded_at, stop_count) VALUES (?, ?, ?)',
+                                   (vehicle_id, loaded_at, len(requests)))
+                connection.executemany('INSERT INTO stops VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+                    (vehicle_id, position, str(r['id']) if r.get('id') is not None else None,
+                     float(coordinates[position, 0]), float(coordinates[position, 1]),
+                     float(travel[position]), float(service[position]), planned[position])
+                    for position, r in enumerate(requests)])
+
+    def restore(self, since: datetime = None):
+        """Drop routes loaded before `since` (default: today) and load today's completed plans
+        for vehicles without a route (call inside an app context)"""
+        from models import OptimizationJob
+
+        since = since or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM stops WHERE vehicle_id IN '
+                               '(SELECT vehicle_id FROM routes WHERE loaded_at < ?)', (since.isoformat(),))
+            connection.execute('DELETE FROM routes WHERE loaded_at < ?', (since.isoformat(),))
+
+        # Newest first: each vehicle keeps its latest plan, and routes already live keep their progress
+        jobs = OptimizationJob.query.filter(OptimizationJob.status == 'completed',
+                                            OptimizationJob.finished_at >= since)
+        for job in jobs.order_by(OptimizationJob.finished_at.desc()).all():
+            self.load_plan(json.loads(job.result), job.finished_at, loaded_at=job.finished_at, replace=False)
+
+    def update_position(self, vehicle_id, latitude: float, longitude: float, timestamp: datetime = None) -> bool:
+        """Apply a GPS fix; returns False when the vehicle has no planned route"""
+        timestamp = timestamp or datetime.utcnow()
+        vehicle_id = str(vehicle_id)
+        with self._transaction() as connection:
+            route = connection.execute('SELECT stop_count, next_stop, arrived, fix_time FROM routes '
+                                       'WHERE vehicle_id = ?', (vehicle_id,)).fetchone()
+            if route is None:
+                return False
+            n, next_stop, arrived, fix_time = route
+            if fix_time is not None and timestamp < datetime.fromisoformat(fix_time):
+                return True  # out-of-order fix
+
+            lead = None  # unchanged
+            if next_stop < n:
+                window = np.array(connection.execute(
+                    'SELECT latitude, longitude FROM stops WHERE vehicle_id = ? AND position >= ? AND position < ? '
+                    'ORDER BY position', (vehicle_id, next_stop, next_stop + ARRIVAL_LOOKAHEAD)).fetchall())
+                distance = haversine_distance(latitude, longitude, window[:, 0], window[:, 1])
+                first = next_stop
+                if arrived and distance[0] > DEPARTURE_RADIUS_KM:
+                    next_stop += 1
+                    arrived = False
+                    lead = self._lead(window, next_stop - first, next_stop < n, arrived, latitude, longitude)
+                elif not arrived:
+                    reached = np.flatnonzero(distance <= ARRIVAL_RADIUS_KM)
+                    if len(reached):
+                        next_stop += int(reached[-1])
+                        arrived = True
+                    lead = self._lead(window, next_stop - first, next_stop < n, arrived, latitude, longitude)
+            connection.execute('UPDATE routes SET next_stop = ?, arrived = ?, fix_time = ?, '
+                               'lead_minutes = COALESCE(?, lead_minutes) WHERE vehicle_id = ?',
+                               (next_stop, int(arrived), timestamp.isoformat(), lead, vehicle_id))
+            return True
+
+    def _lead(self, window: np.ndarray, offset: int, pending: bool, arrived: bool,
+              latitude: float, longitude: float) -> float:
+        # Minutes from the fix to the next stop, which is `offset` rows into the lookahead window
+        if arrived or not pending:
+            return 0.0
+        target = window[offset]
+        return float(self._minutes(haversine_distance(latitude, longitude, target[0], target[1])))
+
+    def mark_completed(self, request_id):
+        """A stop reported done by the driver: the vehicle heads for the stop after it"""
+        with self._transaction() as connection:
+            entry = connection.execute(
+                'SELECT r.vehicle_id, s.position, s.travel, r.next_stop, r.stop_count FROM stops s '
+                'JOIN routes r ON r.vehicle_id = s.vehicle_id WHERE s.request_id = ? '
+                'ORDER BY r.loaded_at DESC LIMIT 1', (str(request_id),)).fetchone()
+            if entry is None:
+                return
+            vehicle_id, position, travel, next_stop, n = entry
+            if position < next_stop:
+                return
+            lead = None
+            # Next fix sets the lead; until then count from the completed stop
+            if position + 1 < n:
+                following, = connection.execute('SELECT travel FROM stops WHERE vehicle_id = ? AND position = ?',
+                                                (vehicle_id, position + 1)).fetchone()
+                lead = following - travel
+            connection.execute('UPDATE routes SET next_stop = ?, arrived = 0, fix_time = ?, '
+                               'lead_minutes = COALESCE(?, lead_minutes) WHERE vehicle_id = ?',
+                               (position + 1, datetime.utcnow().isoformat(), lead, vehicle_id))
+
+    def eta(self, request_id) -> Optional[Dict]:
+        """Estimated arrival at a request's stop, or None when it is on no loaded route"""
+        with self._lock:
+            entry = self._connection().execute(
+                'SELECT r.vehicle_id, s.position, s.travel, s.service, s.planned, r.next_stop, r.arrived, '
+                'r.fix_time, r.lead_minutes, n.travel, n.service FROM stops s '
+                'JOIN routes r ON r.vehicle_id = s.vehicle_id '
+                'LEFT JOIN stops n ON n.vehicle_id = r.vehicle_id AND n.position = r.next_stop '
+                'WHERE s.request_id = ? ORDER BY r.loaded_at DESC LIMIT 1', (str(request_id),)).fetchone()
+        if entry is None:
+            return None
+        vehicle_id, k, travel, service, planned, nxt, arrived, fix_time, lead, next_travel, next_service = entry
+        result = {'vehicle_id': vehicle_id, 'stop_number': k + 1, 'last_fix': fix_time}
+
+        if fix_time is None:
+            result.update(status='planned', stops_before=k, estimated_arrival=planned)
+            return result
+        if k < nxt or (k == nxt and arrived):
+            result.update(status='arrived' if k == nxt else 'visited', stops_before=0, estimated_arrival=None)
+            return result
+
+        minutes = lead + (travel - next_travel) + (service - next_service)
+        result.update(status='en_route', stops_before=k - nxt,
+                      estimated_arrival=(datetime.fromisoformat(fix_time) + timedelta(minutes=minutes)).isoformat())
+        return result
+
+    def estimated_arrival(self, request_id) -> Optional[str]:
+        """ISO arrival time of a request's stop, or None"""
+        eta = self.eta(request_id)
+        return eta['estimated_arrival'] if eta else None
+
+
+# Shared ETA table; app.py calls init_app and optimization_jobs loads finished plans into it
+eta_service = ETAService()
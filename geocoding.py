@@ -0,0 +1,211 @@
+import csv
+import hashlib
+import os
+import re
+import threading
+from bisect import bisect_left
+from typing import List, Dict, Tuple, Optional
+from models import db, Customer, GeocodeCache
+
+# Canonical forms of common address words, so "123 Main Street" and "123 main st." match
+ADDRESS_ABBREVIATIONS = {
+    'street': 'st', 'avenue': 'ave', 'av': 'ave', 'road': 'rd', 'boulevard': 'blvd', 'drive': 'dr',
+    'lane': 'ln', 'court': 'ct', 'place': 'pl', 'terrace': 'ter', 'parkway': 'pkwy', 'highway': 'hwy',
+    'square': 'sq', 'circle': 'cir', 'north': 'n', 'south': 's', 'east': 'e', 'west': 'w',
+    'northeast': 'ne', 'northwest': 'nw', 'southeast': 'se', 'southwest': 'sw'
+}
+# Unit designators and the token after them; they do not move the pickup point
+UNIT_PATTERN = re.compile(r'\b(apt|apartment|unit|suite|ste|floor|fl|room|rm)\b\.?\s*\S+|#\s*\S+')
+HOUSE_NUMBER_PATTERN = re.compile(r'^(\d+)[a-z]?\s+(.*)$')
+
+# Rows looked up per query when matching customers against the cache
+LOOKUP_CHUNK = 500
+
+
+def normalize_address(address: str) -> str:
+    """Lowercase address without units or punctuation, with standard abbreviations"""
+    address = UNIT_PATTERN.sub(' ', (address or '').lower())
+    address = re.sub(r'[^\w\s]', ' ', address)
+    return ' '.join(ADDRESS_ABBREVIATIONS.get(word, word) for word in address.split())
+
+
+def address_hash(address: str) -> str:
+    """Cache key of an address: sha256 of its normalized form"""
+    return hashlib.sha256(normalize_address(address).encode()).hexdigest()
+
+
+class Gazetteer:
+    """Local address file: CSV with address, latitude and longitude columns
+
+    Addresses are matched on their normalized form. Unknown house numbers on a
+    known street are interpolated between the nearest numbers listed for it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.addresses = {}
+        self.streets = {}
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                normalized = normalize_address(row['address'])
+                point = (float(row['latitude']), float(row['longitude']))
+                self.addresses[normalized] = point
+                match = HOUSE_NUMBER_PATTERN.match(normalized)
+                if match:
+                    self.streets.setdefault(match.group(2), []).append((int(match.group(1)), point))
+        for numbers in self.streets.values():
+            numbers.sort()
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def lookup(self, normalized: str) -> Optional[Tuple[float, float, str]]:
+        """(latitude, longitude, precision) of a normalized address, or None"""
+        if normalized in self.addresses:
+            return self.addresses[normalized] + ('exact',)
+
+        match = HOUSE_NUMBER_PATTERN.match(normalized)
+        if match is None or match.group(2) not in self.streets:
+            return None
+        number, numbers = int(match.group(1)), self.streets[match.group(2)]
+        k = bisect_left(numbers, (number,))
+        if k == 0 or k == len(numbers):
+            # Beyond the listed numbers: the closest end of the street
+            return numbers[min(k, len(numbers) - 1)][1] + ('street',)
+        (low, (lat0, lon0)), (high, (lat1, lon1)) = numbers[k - 1], numbers[k]
+        t = (number - low) / (high - low) if high != low else 0.0
+        return (lat0 + t * (lat1 - lat0), lon0 + t * (lon1 - lon0), 'interpolated')
+
+
+def _unconsulted(entry: GeocodeCache) -> bool:
+    # Misses cached by earlier versions when no gazetteer was configured carry no source
+    return entry.latitude is None and entry.source is None
+
+
+class BatchGeocoder:
+    """Fills Customer.latitude/longitude from the gazetteer, geocoding each address once
+
+    Results, misses included, are kept in `GeocodeCache` by address hash;
+    `Customer.address_hash` records which address the coordinates belong to, so
+    only new or edited addresses are looked at again.
+    """
+
+    def __init__(self, gazetteer_path: str = None):
+        self.gazetteer_path = gazetteer_path
+        self._gazetteer = None
+        self._lock = threading.Lock()
+
+    @property
+    def gazetteer(self) -> Optional[Gazetteer]:
+        # Loaded on first use; None when no gazetteer file is configured
+        with self._lock:
+            if self._gazetteer is None and self.gazetteer_path and os.path.exists(self.gazetteer_path):
+                self._gazetteer = Gazetteer(self.gazetteer_path)
+            return self._gazetteer
+
+    def _cached(self, hashes: List[str]) -> Dict[str, GeocodeCache]:
+        found = {}
+        for start in range(0, len(hashes), LOOKUP_CHUNK):
+            chunk = hashes[start:start + LOOKUP_CHUNK]
+            for entry in GeocodeCache.query.filter(GeocodeCache.address_hash.in_(chunk)):
+                found[entry.address_hash] = entry
+        return found
+
+    def _geocode(self, key: str, normalized: str, entry: GeocodeCache = None) -> GeocodeCache:
+        """Look an address up in the gazetteer and store the result (into `entry` when retrying)
+
+        Without a gazetteer nothing is stored: the unsaved entry returned has no
+        coordinates, and the address is looked up again once one is configured.
+        """
+        gazetteer = self.gazetteer
+        if gazetteer is None:
+            return entry if entry is not None else GeocodeCache(address_hash=key, normalized_address=normalized)
+        if entry is None:
+            entry = GeocodeCache(address_hash=key)
+            db.session.add(entry)
+        result = gazetteer.lookup(normalized)
+        entry.normalized_address = normalized
+        entry.latitude, entry.longitude = (result[0], result[1]) if result else (None, None)
+        entry.precision = result[2] if result else 'not_found'
+        entry.source = os.path.basename(gazetteer.path)
+        return entry
+
+    def geocode_customers(self, customers: List[Customer] = None, retry_not_found: bool = False,
+                          batch_size: int = 1000) -> Dict:
+        """Geocode customers whose address changed since their coordinates were set
+
+        Defaults to every customer, read in pages of `batch_size` with a commit per
+        page. Returns counts of cache hits, gazetteer lookups and misses, and of
+        addresses skipped because no gazetteer is configured.
+        """
+        stats = {'customers': 0, 'updated': 0, 'cache_hits': 0, 'geocoded': 0, 'not_found': 0, 'skipped': 0}
+        if customers is not None:
+            for start in range(0, len(customers), batch_size):
+                self._geocode_batch(customers[start:start + batch_size], retry_not_found, stats)
+            return stats
+
+        # Keyset pages, so each batch can commit without holding a cursor open
+        last_id = 0
+        while True:
+            batch = Customer.query.filter(Customer.id > last_id).order_by(Customer.id).limit(batch_size).all()
+            if not batch:
+                return stats
+            last_id = batch[-1].id
+            self._geocode_batch(batch, retry_not_found, stats)
+
+    def _geocode_batch(self, customers: List[Customer], retry_not_found: bool, stats: Dict):
+        stats['customers'] += len(customers)
+        pending = []
+        for customer in customers:
+            key = address_hash(customer.address)
+            if customer.address_hash != key or customer.latitude is None:
+                pending.append((customer, key))
+        if not pending:
+            return
+
+        cached = self._cached(sorted({key for _, key in pending}))
+        consulted = self.gazetteer is not None
+        retried = set()
+        for customer, key in pending:
+            entry = cached.get(key)
+            if entry is None or _unconsulted(entry) or (retry_not_found and entry.latitude is None
+                                                        and key not in retried):
+                entry = cached[key] = self._geocode(key, normalize_address(customer.address), entry)
+                retried.add(key)
+                stats['geocoded' if consulted else 'skipped'] += 1
+            else:
+                stats['cache_hits'] += 1
+
+            if entry.latitude is None:
+                stats['not_found'] += 1
+            elif customer.latitude != entry.latitude or customer.longitude != entry.longitude:
+                stats['updated'] += 1
+            customer.latitude, customer.longitude = entry.latitude, entry.longitude
+            customer.address_hash = key
+        db.session.commit()
+
+    def geocode_customer(self, customer: Customer) -> bool:
+        """Geocode one customer in the current session (not committed); True if coordinates were found"""
+        key = address_hash(customer.address)
+        entry = self._cached([key]).get(key)
+        if entry is None or _unconsulted(entry):
+            entry = self._geocode(key, normalize_address(customer.address), entry)
+        customer.latitude, customer.longitude = entry.latitude, entry.longitude
+        customer.address_hash = key
+        return customer.latitude is not None
+
+
+# Shared geocoder; the gazetteer path comes from the environment
+batch_geocoder = BatchGeocoder(os.environ.get('GEOCODER_GAZETTEER', os.path.join('instance', 'gazetteer.csv')))
+
+
+if __name__ == '__main__':
+    import sys
+    from app import app
+
+    paths = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if paths:
+        batch_geocoder = BatchGeocoder(paths[0])
+    with app.app_context():
+        db.create_all()
+        print(batch_geocoder.geocode_customers(retry_not_found='--retry' in sys.argv))
@@ -0,0 +1,226 @@
+"""
+Per-department daily rollup of service requests into ServiceMetrics
+
+    python metrics_rollup.py [--start 2024-01-01] [--end 2024-12-31]
+
+Request and feedback changes adjust their day's ServiceMetrics row inside the
+same flush, so the rollup commits or rolls back together with the facts. The
+command (re)builds the rows of a date range from the fact tables.
+"""
+
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, List, Tuple
+from sqlalchemy import event, func, case
+from sqlalchemy.orm import Session
+from models import db, ServiceRequest, ServiceMetrics, CustomerFeedback
+from analytics_aggregation import date_bucket, hours_between, add_to_row, changed_rows
+from demand_aggregates import request_day, as_date, REQUEST_COLUMNS
+
+# Order of the running totals in a delta: requests, completed, response hours, responded, rating sum, ratings
+FIELDS = ('total_requests', 'completed_requests', 'response_hours_total', 'responded_requests',
+          'rating_total', 'ratings')
+# Feedback columns the rollup derives ratings from
+FEEDBACK_COLUMNS = ('rating', 'service_request_id', 'created_at')
+# Expressions of the unique department-day index, the conflict target of the upserts
+DAY_KEY = next(index for index in ServiceMetrics.__table__.indexes if index.name == 'uq_service_metrics_day').expressions
+
+
+def _response_hours(service_request) -> float:
+    if service_request.status != 'completed' or not service_request.completed_at or not service_request.created_at:
+        return None
+    return (service_request.completed_at - service_request.created_at).total_seconds() / 3600
+
+
+def _request_key(service_request) -> Tuple[int, date]:
+    return service_request.department_id, request_day(service_request)
+
+
+def _request_delta(service_request, sign: int) -> Tuple[Tuple[int, date], List[float]]:
+    hours = _response_hours(service_request)
+    completed = service_request.status == 'completed'
+    return (_request_key(service_request),
+            [sign, sign if completed else 0, sign * hours if hours is not None else 0,
+             sign if hours is not None else 0, 0, 0])
+
+
+def _feedback_key(feedback, requests: Dict, unlinked=()) -> Tuple[int, date]:
+    """(department, day) a rating counts on, or None when its request is gone; `unlinked` are the
+    ids of requests being deleted, whose feedback the flush detaches"""
+    if feedback.service_request_id is not None and feedback.service_request_id not in unlinked:
+        service_request = requests.get(feedback.service_request_id)
+        return _request_key(service_request) if service_request else None
+    # A request added in the same flush is only linked through the relationship
+    service_request = getattr(feedback, 'service_request', None)
+    if service_request is not None and service_request.id is None:
+        return _request_key(service_request)
+    # Unlinked feedback counts on the day it was given
+    return None, as_date(feedback.created_at) or datetime.utcnow().date()
+
+
+def _averages(totals: Dict) -> Dict:
+    return {'average_response_time': totals['response_hours_total'] / func.nullif(totals['responded_requests'], 0),
+            'customer_satisfaction': totals['rating_total'] / func.nullif(totals['ratings'], 0)}
+
+
+def apply_deltas(session, deltas: Dict[Tuple[int, date], List[float]]):
+    """Add running-total deltas to their ServiceMetrics rows, creating missing rows"""
+    for (department_id, metric_date), delta in deltas.items():
+        if not any(delta):
+            continue
+        totals = dict(zip(FIELDS, delta))
+        values = dict(totals, department_id=department_id, metric_date=metric_date,
+                      average_response_time=totals['response_hours_total'] / totals['responded_requests']
+                      if totals['responded_requests'] else None,
+                      customer_satisfaction=totals['rating_total'] / totals['ratings'] if totals['ratings'] else None)
+        # One upsert per row: averages are recomputed from the updated sums in the same
+        # statement, so concurrent writers never overwrite each other's increments
+        session.execute(add_to_row(ServiceMetrics, values, key=DAY_KEY, added=FIELDS, derived=_averages))
+
+
+def _date_range(column, start: date = None, end: date = None) -> List:
+    return ([column >= start] if start else []) + ([column <= end] if end else [])
+
+
+def _add(deltas: Dict, key, delta: List[float]):
+    totals = deltas[key]
+    for k, change in enumerate(delta):
+        totals[k] += change
+
+
+@event.listens_for(Session, 'before_flush')
+def _rollup_changes(session, flush_context, instances):
+    if not (session.new or session.dirty or session.deleted):
+        return
+    deltas = defaultdict(lambda: [0] * len(FIELDS))
+    new, edited, deleted, old = changed_rows(session, flush_context, ServiceRequest, REQUEST_COLUMNS)
+    for obj in new + edited:
+        _add(deltas, *_request_delta(obj, 1))
+    for previous in old.values():
+        _add(deltas, *_request_delta(previous, -1))
+
+    with session.no_autoflush:
+        _rollup_feedback(session, flush_context, deltas, edited, deleted, old)
+        apply_deltas(session, deltas)
+
+
+def _rollup_feedback(session, flush_context, deltas: Dict, edited: List, deleted: List, old_requests: Dict):
+    """Move the ratings of changed feedback, and of feedback whose request changed day or department"""
+    new, changed, removed, old = changed_rows(session, flush_context, CustomerFeedback, FEEDBACK_COLUMNS)
+    moved = {obj.id for obj in deleted}
+    moved |= {obj.id for obj in edited
+              if obj.id in old_requests and _request_key(obj) != _request_key(old_requests[obj.id])}
+    changing = {obj.id for obj in changed + removed}
+    carried = [obj for obj in session.query(CustomerFeedback).filter(CustomerFeedback.service_request_id.in_(moved))
+               if obj.id not in changing] if moved else []
+    if not (new or changed or removed or carried):
+        return
+
+    # Ratings are taken off where the old rows counted and added where the new ones count
+    before = list(old.values()) + carried
+    after = new + changed + carried
+    request_ids = {obj.service_request_id for obj in before + after if obj.service_request_id is not None}
+    current = {obj.id: obj for obj in session.query(ServiceRequest).filter(ServiceRequest.id.in_(request_ids))} \
+        if request_ids else {}
+    previous = {**current, **old_requests}
+    for feedback in before:
+        key = _feedback_key(feedback, previous)
+        if key is not None:
+            _add(deltas, key, [0, 0, 0, 0, -feedback.rating, -1])
+    for feedback in after:
+        key = _feedback_key(feedback, current, {obj.id for obj in deleted})
+        if key is not None:
+            _add(deltas, key, [0, 0, 0, 0, feedback.rating, 1])
+
+
+def backfill(start: date = None, end: date = None) -> int:
+    """Rebuild the ServiceMetrics rows of a date range (default: all history) from the fact tables
+
+    Runs one GROUP BY per fact table; returns the number of rows written.
+    """
+    day = func.coalesce(ServiceRequest.scheduled_date, func.date(ServiceRequest.created_at))
+    in_range = _date_range(day, start, end)
+    completed = ServiceRequest.status == 'completed'
+    responded = db.and_(completed, ServiceRequest.completed_at.isnot(None), ServiceRequest.created_at.isnot(None))
+
+    rows = db.session.query(
+        day, ServiceRequest.department_id, func.count(ServiceRequest.id),
+        func.sum(case((completed, 1), else_=0)),
+        func.sum(case((responded, hours_between(ServiceRequest.created_at, ServiceRequest.completed_at)), else_=0)),
+        func.sum(case((responded, 1), else_=0))
+    ).filter(*in_range).group_by(day, ServiceRequest.department_id).all()
+
+    ratings = db.session.query(
+        day, ServiceRequest.department_id, func.sum(CustomerFeedback.rating), func.count(CustomerFeedback.id)
+    ).join(ServiceRequest, ServiceRequest.id == CustomerFeedback.service_request_id) \
+        .filter(*in_range).group_by(day, ServiceRequest.department_id).all()
+    feedback_day = func.date(CustomerFeedback.created_at)
+    unlinked = db.session.query(feedback_day, func.sum(CustomerFeedback.rating), func.count(CustomerFeedback.id)) \
+        .filter(CustomerFeedback.service_request_id.is_(None), *_date_range(feedback_day, start, end)) \
+        .group_by(feedback_day).all()
+
+    deltas = defaultdict(lambda: [0] * len(FIELDS))
+    for value, department_id, requests, completed_count, hours, responded_count in rows:
+        _add(deltas, (department_id, as_date(value)),
+             [requests, completed_count or 0, float(hours or 0), responded_count or 0, 0, 0])
+    for value, department_id, rating_total, count in ratings:
+        _add(deltas, (department_id, as_date(value)),
+             [0, 0, 0, 0, float(rating_total or 0), count])
+    for value, rating_total, count in unlinked:
+        _add(deltas, (None, as_date(value)),
+             [0, 0, 0, 0, float(rating_total or 0), count])
+
+    ServiceMetrics.query.filter(*_date_range(ServiceMetrics.metric_date, start, end)) \
+        .delete(synchronize_session=False)
+    # Written directly; the new rows are totals, not changes for the flush hook to roll up
+    db.session.add_all(ServiceMetrics(
+        department_id=department_id, metric_date=metric_date, **dict(zip(FIELDS, totals)),
+        average_response_time=totals[2] / totals[3] if totals[3] else None,
+        customer_satisfaction=totals[4] / totals[5] if totals[5] else None
+    ) for (department_id, metric_date), totals in deltas.items())
+    db.session.commit()
+    return len(deltas)
+
+
+def rollup_summary(start: date = None, end: date = None, department_id: int = None) -> Dict:
+    """Totals and weighted averages over a date range, read from the rollup in O(days)"""
+    filters = _date_range(ServiceMetrics.metric_date, start, end)
+    if department_id is not None:
+        filters.append(ServiceMetrics.department_id == department_id)
+    sums = db.session.query(*[func.coalesce(func.sum(getattr(ServiceMetrics, name)), 0) for name in FIELDS]) \
+        .filter(*filters).one()
+    totals = dict(zip(FIELDS, sums))
+    return {
+        'total_requests': int(totals['total_requests']),
+        'completed_requests': int(totals['completed_requests']),
+        'completion_rate': totals['completed_requests'] / totals['total_requests'] * 100
+        if totals['total_requests'] else 0,
+        'average_response_hours': totals['response_hours_total'] / totals['responded_requests']
+        if totals['responded_requests'] else None,
+        'customer_satisfaction': totals['rating_total'] / totals['ratings'] if totals['ratings'] else None
+    }
+
+
+def rollup_series(granularity: str = 'day', start: date = None, end: date = None, department_id: int = None) -> Dict:
+    """{period: {'total_requests', 'completed_requests'}} from the rollup, oldest period first"""
+    bucket = date_bucket(ServiceMetrics.metric_date, granularity)
+    filters = _date_range(ServiceMetrics.metric_date, start, end)
+    if department_id is not None:
+        filters.append(ServiceMetrics.department_id == department_id)
+    rows = db.session.query(bucket, func.sum(ServiceMetrics.total_requests), func.sum(ServiceMetrics.completed_requests)) \
+        .filter(*filters).group_by(bucket).order_by(bucket).all()
+    return {period: {'total_requests': int(total or 0), 'completed_requests': int(completed or 0)}
+            for period, total, completed in rows}
+
+if __name__ == '__main__':
+    import argparse
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Rebuild the ServiceMetrics daily rollup')
+    parser.add_argument('--start', type=date.fromisoformat)
+    parser.add_argument('--end', type=date.fromisoformat)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        print(f"{backfill(args.start, args.end)} department-days rolled up")
@@ -1,11 +1,14 @@
 from flask import Blueprint, request, jsonify
 from flask_login import login_required, current_user
 from models import db, User, Customer, ServiceRequest, Vehicle, Employee, Route
-from datetime import datetime, timedelta
+from eta_service import eta_service
+from datetime import datetime, timedelta, timezone
 import json
 import uuid
 
 mobile_api = Blueprint('mobile_api', __name__)
+# Live tracking routes, registered on their own; the rest of the mobile API is not wired up yet
+mobile_tracking = Blueprint('mobile_tracking', __name__)
 
 # Driver Mobile API Endpoints
 @mobile_api.route('/api/mobile/driver/login', methods=['POST'])
@@ -250,27 +253,42 @@ def request_service():
         'message': 'Service request submitted successfully'
     })
 
-@mobile_api.route('/api/mobile/customer/track-service', methods=['GET'])
+def _can_track(service_request):
+    """Customers see their own requests, staff those of their department or assigned to them"""
+    # A customer's login is the user account with the customer's email
+    customer = Customer.query.filter_by(email=current_user.email).first()
+    if customer is not None and service_request.customer_id == customer.id:
+        return True
+    if service_request.assigned_to == current_user.id:
+        return True
+    # Users without a department would otherwise match requests without one
+    staff = current_user.role == 'super_admin' or current_user.department_id is not None
+    return staff and current_user.can_access_department(service_request.department_id)
+
+@mobile_tracking.route('/api/mobile/customer/track-service', methods=['GET'])
+@login_required
 def track_service():
     """Track service request status"""
-    request_id = request.args.get('request_id')
+    request_id = request.args.get('request_id', type=int)
     
-    service_request = ServiceRequest.query.get(request_id)
-    if not service_request:
+    service_request = db.session.get(ServiceRequest, request_id) if request_id else None
+    if not service_request or not _can_track(service_request):
         return jsonify({'success': False, 'message': 'Request not found'}), 404
     
-    # Get assigned employee info
-    employee = None
-    if service_request.assigned_employee_id:
-        employee = Employee.query.get(service_request.assigned_employee_id)
+    # Get assigned user info
+    assignee = db.session.get(User, service_request.assigned_to) if service_request.assigned_to else None
+    
+    # Served from the shared ETA table, no route or GPS queries
+    eta = eta_service.eta(service_request.id)
     
     tracking_info = {
         'request_id': service_request.id,
         'status': service_request.status,
-        'scheduled_date': service_request.scheduled_date.isoformat(),
-        'assigned_employee': employee.name if employee else None,
-        'estimated_arrival': None,  # Would be calculated based on route
-        'notes': service_request.notes,
+        'scheduled_date': service_request.scheduled_date.isoformat() if service_request.scheduled_date else None,
+        'assigned_employee': assignee.get_full_name() if assignee else None,
+        'estimated_arrival': eta['estimated_arrival'] if eta else None,
+        'stops_before': eta['stops_before'] if eta else None,
+        'notes': service_request.description,
         'service_type': service_request.service_type
     }
     
@@ -300,25 +318,33 @@ def customer_billing():
     return jsonify({'bills': bill_data})
 
 # Real-time Features
-@mobile_api.route('/api/mobile/realtime/location', methods=['POST'])
+@mobile_tracking.route('/api/mobile/realtime/location', methods=['POST'])
+@login_required
 def update_location():
     """Update driver's real-time location"""
     data = request.get_json()
-    driver_id = data.get('driver_id')
+    # Drivers report their own position; admins may report on behalf of one
+    driver_id = current_user.id if current_user.role == 'driver' else data.get('driver_id')
     latitude = data.get('latitude')
     longitude = data.get('longitude')
     timestamp = data.get('timestamp')
     
-    # Store location update (in production, use Redis or similar)
-    location_data = {
-        'driver_id': driver_id,
-        'latitude': latitude,
-        'longitude': longitude,
-        'timestamp': timestamp
-    }
+    if latitude is None or longitude is None:
+        return jsonify({'success': False, 'message': 'latitude and longitude are required'}), 400
+    
+    # The fix moves the driver's vehicle along its planned route for ETAs
+    vehicle = Vehicle.query.filter_by(assigned_driver_id=driver_id).first()
+    if vehicle is None:
+        return jsonify({'success': False, 'message': 'No vehicle assigned'}), 404
     
-    # Here you would store in Redis or database
-    # For now, just return success
+    fix_time = datetime.fromisoformat(timestamp) if timestamp else datetime.utcnow()
+    if fix_time.tzinfo is not None:
+        fix_time = fix_time.astimezone(timezone.utc).replace(tzinfo=None)
+    vehicle.current_latitude = float(latitude)
+    vehicle.current_longitude = float(longitude)
+    vehicle.last_location_update = fix_time
+    db.session.commit()
+    eta_service.update_position(vehicle.id, float(latitude), float(longitude), fix_time)
     
     return jsonify({'success': True, 'message': 'Location updated'})
 
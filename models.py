@@ -68,10 +68,20 @@ class Department(db.Model):
     admin_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Yard the department's vehicles start their routes from
+    depot_latitude = db.Column(db.Float)
+    depot_longitude = db.Column(db.Float)
     
     # Relationships - explicitly specify foreign_keys to avoid ambiguity
     admin = db.relationship('User', foreign_keys=[admin_id], backref=db.backref('admin_departments', lazy=True))
     
+    @property
+    def depot(self):
+        """Depot as a latitude/longitude dict, or None when the department has no yard set"""
+        if self.depot_latitude is None or self.depot_longitude is None:
+            return None
+        return {'latitude': self.depot_latitude, 'longitude': self.depot_longitude}
+    
     def get_admin(self):
         """Get department admin user"""
         return User.query.get(self.admin_id)
@@ -91,6 +101,9 @@ class Customer(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     phone = db.Column(db.String(20))
     address = db.Column(db.Text, nullable=False)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    address_hash = db.Column(db.String(64), index=True)  # hash of the normalized address the coordinates belong to
     customer_type = db.Column(db.String(20), default='residential')  # residential, commercial, industrial
     service_frequency = db.Column(db.String(20), default='weekly')  # weekly, biweekly, monthly, on-demand
     payment_method = db.Column(db.String(20), default='credit_card')
@@ -341,11 +354,32 @@ class ServiceMetrics(db.Model):
     completed_requests = db.Column(db.Integer, default=0)
     average_response_time = db.Column(db.Float)  # in hours
     customer_satisfaction = db.Column(db.Float)  # 1-5 scale
+    # Running sums behind the averages, so the rollup can be updated incrementally
+    response_hours_total = db.Column(db.Float, default=0)
+    responded_requests = db.Column(db.Integer, default=0)
+    rating_total = db.Column(db.Float, default=0)
+    ratings = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # One row per department and day; rows without a department share the key 0,
+    # since NULLs never conflict in a plain unique constraint
+    __table_args__ = (db.Index('uq_service_metrics_day', db.func.coalesce(department_id, db.literal_column('0')),
+                               metric_date, unique=True),)
+    
     # Relationships
     department = db.relationship('Department', backref='metrics')
 
+# Demand Pattern Model
+class DemandPattern(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(20), nullable=False)  # 'all', or the department id the row counts
+    weekday = db.Column(db.Integer, nullable=False)  # 0 = Monday
+    month = db.Column(db.Integer, nullable=False)  # 1-12
+    requests = db.Column(db.Integer, default=0)
+    completed = db.Column(db.Integer, default=0)
+    
+    __table_args__ = (db.UniqueConstraint('scope', 'weekday', 'month'),)
+
 # Customer Feedback Model
 class CustomerFeedback(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -408,6 +442,80 @@ class RouteOptimization(db.Model):
     route = db.relationship('Route', backref='optimizations')
     created_by_user = db.relationship('User', foreign_keys=[created_by])
 
+# Route Optimization Job Model
+class OptimizationJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    input_hash = db.Column(db.String(64), index=True, nullable=False)  # sha256 of the submitted inputs
+    status = db.Column(db.String(20), default='queued')  # queued, running, completed, failed
+    time_budget = db.Column(db.Float)  # in seconds
+    payload = db.Column(db.Text, nullable=False)  # JSON: service_requests, vehicles, constraints
+    result = db.Column(db.Text)  # JSON plan; the best one so far while running
+    result_version = db.Column(db.Integer, default=0)  # bumped whenever result is rewritten
+    progress = db.Column(db.Text)  # JSON list of plan summaries
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'))
+    
+    # Relationships
+    created_by_user = db.relationship('User', foreign_keys=[created_by])
+    
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'time_budget': self.time_budget,
+            'result_version': self.result_version,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+# Report Export Job Model
+class ExportJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    report_type = db.Column(db.String(50), nullable=False)  # customers, service_requests, payments, invoices
+    format = db.Column(db.String(10), nullable=False)  # csv, jsonl, parquet, xlsx
+    filters = db.Column(db.Text)  # JSON: start, end
+    status = db.Column(db.String(20), default='queued')  # queued, running, completed, failed
+    rows = db.Column(db.Integer, default=0)  # written so far
+    path = db.Column(db.String(500))  # finished file
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    
+    # Relationships
+    created_by_user = db.relationship('User', foreign_keys=[created_by])
+    
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'report_type': self.report_type,
+            'format': self.format,
+            'status': self.status,
+            'rows': self.rows,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+# Geocoding Cache Model
+class GeocodeCache(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    address_hash = db.Column(db.String(64), unique=True, index=True, nullable=False)
+    normalized_address = db.Column(db.Text, nullable=False)
+    latitude = db.Column(db.Float)  # None when the address could not be geocoded
+    longitude = db.Column(db.Float)
+    precision = db.Column(db.String(20))  # exact, interpolated, street, not_found
+    source = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 # Customer Portal Model
 class CustomerPortal(db.Model):
     id = db.Column(db.Integer, primary_key=True)
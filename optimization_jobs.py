@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Dict, Tuple
+from models import db, OptimizationJob, Route, Department, Customer
+from ai_route_optimization import route_optimizer
+from eta_service import eta_service
+
+
+def plan_summary(plan: Dict) -> Dict:
+    """Headline numbers of a plan, cheap enough to keep for every progress step"""
+    return {
+        'stage': plan.get('stage'),
+        'elapsed': plan.get('elapsed'),
+        'routes': len(plan.get('optimized_routes', [])),
+        'total_distance': plan.get('total_distance'),
+        'total_time': plan.get('total_time'),
+        'improvement_percentage': plan.get('improvement_percentage')
+    }
+
+
+def with_department_depots(vehicles: List[Dict]) -> List[Dict]:
+    """Copies of the vehicles with their department's depot filled in where they carry none"""
+    department_ids = {v['department_id'] for v in vehicles if v.get('department_id') and not v.get('depot')}
+    if not department_ids:
+        return vehicles
+    depots = {d.id: d.depot for d in Department.query.filter(Department.id.in_(department_ids)).all()}
+    return [dict(v, depot=depots[v['department_id']]) if depots.get(v.get('department_id')) and not v.get('depot')
+            else v for v in vehicles]
+
+
+def with_customer_coordinates(service_requests: List[Dict]) -> List[Dict]:
+    """Copies of the requests with their customer's geocoded position filled in where they carry none"""
+    missing = {r['customer_id'] for r in service_requests
+               if r.get('customer_id') is not None and (r.get('latitude') is None or r.get('longitude') is None)}
+    if not missing:
+        return service_requests
+    positions = {c.id: (c.latitude, c.longitude)
+                 for c in Customer.query.filter(Customer.id.in_(missing), Customer.latitude.isnot(None))
+                 .with_entities(Customer.id, Customer.latitude, Customer.longitude)}
+    return [dict(r, latitude=positions[r['customer_id']][0], longitude=positions[r['customer_id']][1])
+            if r.get('customer_id') in positions and (r.get('latitude') is None or r.get('longitude') is None)
+            else r for r in service_requests]
+
+
+def _to_json(value) -> str:
+    # NumPy scalars in plans serialise through their Python value
+    return json.dumps(value, default=lambda o: o.item() if hasattr(o, 'item') else str(o))
+
+
+class OptimizationJobQueue:
+    """Runs route optimizations on a local thread pool, out of the web request
+
+    Jobs live in the `OptimizationJob` table; identical inputs from the same
+    department (or user) reuse the queued, running or completed job instead of
+    solving again. A job still running `stale_after` seconds past its time
+    budget is taken to be lost with a restarted worker: it is no longer reused
+    and `resume` queues it again. Finished plans are saved as `Route` rows with
+    a `RouteOptimization` record each.
+    """
+
+    def __init__(self, app=None, workers: int = 2, stale_after: float = 1800):
+        self.app = None
+        self.workers = max(1, workers)
+        self.stale_after = stale_after
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # Each worker thread gets its own optimizer; they keep per-run state
+        self._local = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['optimization_jobs'] = self
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='route-optimization')
+            return self._executor
+
+    def _optimizer(self):
+        if getattr(self._local, 'optimizer', None) is None:
+            self._local.optimizer = route_optimizer.clone()
+        return self._local.optimizer
+
+    @staticmethod
+    def input_hash(service_requests: List[Dict], vehicles: List[Dict], constraints: Dict = None,
+                   time_budget: float = None) -> str:
+        canonical = json.dumps({'service_requests': service_requests, 'vehicles': vehicles,
+                                'constraints': constraints, 'time_budget': time_budget},
+                               sort_keys=True, default=str)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def submit(self, service_requests: List[Dict], vehicles: List[Dict], constraints: Dict = None,
+               time_budget: float = None, created_by: int = None,
+               department_id: int = None) -> Tuple[OptimizationJob, bool]:
+        """Queue an optimization; returns the job and whether it is new (False for a duplicate)"""
+        service_requests = with_customer_coordinates(service_requests)
+        vehicles = with_department_depots(vehicles)
+        input_hash = self.input_hash(service_requests, vehicles, constraints, time_budget)
+        owner = OptimizationJob.department_id == department_id if department_id is not None \
+            else db.and_(OptimizationJob.department_id.is_(None), OptimizationJob.created_by == created_by)
+        candidates = OptimizationJob.query.filter(
+            OptimizationJob.input_hash == input_hash, owner,
+            OptimizationJob.status.in_(('queued', 'running', 'completed'))
+        ).order_by(OptimizationJob.id.desc()).all()
+        now = datetime.utcnow()
+        for existing in candidates:
+            if not self.is_stale(existing, now):
+                return existing, False
+            # Superseded by the job queued below instead of being resumed
+            OptimizationJob.query.filter_by(id=existing.id, status='running', started_at=existing.started_at) \
+                .update({'status': 'failed', 'error': 'Abandoned: still running past its time budget',
+                         'finished_at': now})
+
+        job = OptimizationJob(
+            input_hash=input_hash,
+            time_budget=time_budget,
+            payload=_to_json({'service_requests': service_requests, 'vehicles': vehicles,
+                              'constraints': constraints}),
+            created_by=created_by,
+            department_id=department_id
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        self._pool().submit(self._run, job.id)
+        return job, True
+
+    def is_stale(self, job: OptimizationJob, now: datetime = None) -> bool:
+        """Whether a running job has outlived its time budget by `stale_after` seconds"""
+        if job.status != 'running' or job.started_at is None:
+            return False
+        limit = timedelta(seconds=self.stale_after + (job.time_budget or 0))
+        return (now or datetime.utcnow()) - job.started_at > limit
+
+    def resume(self):
+        """Re-dispatch jobs still queued, or left running by a lost worker, from before a restart
+        (call inside an app context)"""
+        now = datetime.utcnow()
+        for job in OptimizationJob.query.filter_by(status='running').all():
+            if self.is_stale(job, now):
+                # Conditional on the start time, so only one process requeues it
+                OptimizationJob.query.filter_by(id=job.id, status='running', started_at=job.started_at) \
+                    .update({'status': 'queued', 'started_at': None})
+        db.session.commit()
+        for job in OptimizationJob.query.filter_by(status='queued').all():
+            self._pool().submit(self._run, job.id)
+
+    def _claim(self, job_id: int) -> bool:
+        # Conditional update, so a job is only ever run by one worker (or process)
+        claimed = OptimizationJob.query.filter_by(id=job_id, status='queued').update(
+            {'status': 'running', 'started_at': datetime.utcnow()})
+        db.session.commit()
+        return claimed == 1
+
+    def _run(self, job_id: int):
+        with self.app.app_context():
+            try:
+                if not self._claim(job_id):
+                    return
+                job = db.session.get(OptimizationJob, job_id)
+                payload = json.loads(job.payload)
+                progress = []
+
+                def record_progress(plan):
+                    progress.append(plan_summary(plan))
+                    job.progress = _to_json(progress)
+                    job.result = _to_json(plan)
+                    job.result_version = (job.result_version or 0) + 1
+                    db.session.commit()
+
+                optimizer = self._optimizer()
+                result = optimizer.optimize_routes(payload['service_requests'], payload['vehicles'],
+                                                   payload.get('constraints'), time_budget=job.time_budget,
+                                                   progress=record_progress)
+                if 'error' in result:
+                    job.status = 'failed'
+                    job.error = result['error']
+                else:
+                    self._persist(job, result, optimizer)
+                    job.status = 'completed'
+                job.finished_at = datetime.utcnow()
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                OptimizationJob.query.filter_by(id=job_id).update(
+                    {'status': 'failed', 'error': str(e), 'finished_at': datetime.utcnow()})
+                db.session.commit()
+            finally:
+                db.session.remove()
+
+    def _persist(self, job: OptimizationJob, result: Dict, optimizer):
+        """Save each optimized route as a Route row and record its optimization"""
+        for route in result.get('optimized_routes', []):
+            start = route['start_location']
+            row = Route(
+                name=f"Optimized route {route['route_id'] + 1} (job {job.id})",
+                description=f"{len(route['requests'])} stops, vehicle {route.get('vehicle_id')}",
+                start_location=f"{start['latitude']:.6f},{start['longitude']:.6f}",
+                estimated_duration=int(round(route['estimated_time'] * 60)),
+                distance=route['total_distance'],
+                created_by=job.created_by,
+                department_id=job.department_id
+            )
+            db.session.add(row)
+            db.session.flush()
+            route['db_route_id'] = row.id
+
+        job.result = _to_json(result)
+        job.result_version = (job.result_version or 0) + 1
+        optimizer.record_optimization(result, job.created_by)
+        eta_service.load_plan(result)
+
+
+# Shared queue; app.py binds it to the Flask app
+optimization_jobs = OptimizationJobQueue(workers=int(os.environ.get('ROUTE_OPTIMIZATION_JOB_WORKERS', 2)),
+                                         stale_after=float(os.environ.get('ROUTE_OPTIMIZATION_JOB_TIMEOUT', 1800)))
@@ -0,0 +1,290 @@
+import csv
+import io
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import List, Iterator
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError
+from models import db, Customer, ServiceRequest, Payment, Invoice, ExportJob
+
+# Rows fetched per round trip from the server-side cursor, and per chunk of output
+EXPORT_CHUNK = 2000
+# Progress of background jobs is saved every this many rows
+PROGRESS_INTERVAL = 50000
+
+# Report type -> (model, date column filtered by start/end, exported columns)
+REPORTS = {
+    'customers': (Customer, Customer.created_at, [
+        Customer.id, Customer.name, Customer.email, Customer.phone, Customer.address, Customer.customer_type,
+        Customer.service_frequency, Customer.payment_method, Customer.is_active, Customer.latitude,
+        Customer.longitude, Customer.created_at
+    ]),
+    'service_requests': (ServiceRequest, ServiceRequest.created_at, [
+        ServiceRequest.id, ServiceRequest.customer_id, ServiceRequest.service_type, ServiceRequest.scheduled_date,
+        ServiceRequest.status, ServiceRequest.amount, ServiceRequest.department_id, ServiceRequest.assigned_to,
+        ServiceRequest.created_at, ServiceRequest.completed_at
+    ]),
+    'payments': (Payment, Payment.payment_date, [
+        Payment.id, Payment.customer_id, Payment.invoice_id, Payment.amount, Payment.payment_method,
+        Payment.status, Payment.transaction_id, Payment.payment_date
+    ]),
+    'invoices': (Invoice, Invoice.issued_date, [
+        Invoice.id, Invoice.customer_id, Invoice.invoice_number, Invoice.amount, Invoice.tax_amount,
+        Invoice.total_amount, Invoice.status, Invoice.due_date, Invoice.issued_date, Invoice.paid_date
+    ])
+}
+REPORT_ALIASES = {'requests': 'service_requests'}
+
+STREAMING_FORMATS = ('csv', 'jsonl')
+FILE_FORMATS = ('parquet', 'xlsx')  # need pyarrow / openpyxl and a complete file, so background jobs only
+MIMETYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+
+
+def report_name(report_type: str) -> str:
+    """Canonical report type, or ValueError for an unknown one"""
+    report_type = REPORT_ALIASES.get(report_type, report_type)
+    if report_type not in REPORTS:
+        raise ValueError(f"Unknown report '{report_type}', expected one of {sorted(REPORTS)}")
+    return report_type
+
+
+def check_format(fmt: str) -> str:
+    if fmt not in MIMETYPES:
+        raise ValueError(f"Unknown format '{fmt}', expected one of {sorted(MIMETYPES)}")
+    try:
+        if fmt == 'parquet':
+            import pyarrow  # noqa: F401
+        elif fmt == 'xlsx':
+            import openpyxl  # noqa: F401
+    except ImportError:
+        raise ValueError(f"The {fmt} format needs {'pyarrow' if fmt == 'parquet' else 'openpyxl'} installed")
+    return fmt
+
+
+def report_header(report_type: str) -> List[str]:
+    return [column.key for column in REPORTS[report_name(report_type)][2]]
+
+
+def stream_rows(report_type: str, start: date = None, end: date = None, session=None) -> Iterator[List[tuple]]:
+    """Chunks of plain row tuples, read through a server-side cursor in primary key order
+
+    Columns are selected directly, so no ORM objects are built and memory stays
+    at one chunk whatever the row count.
+    """
+    model, date_column, columns = REPORTS[report_name(report_type)]
+    statement = select(*columns).order_by(model.id)
+    if start:
+        statement = statement.where(date_column >= datetime.combine(start, time.min))
+    if end:
+        # An end date includes that whole day
+        statement = statement.where(date_column < datetime.combine(end + timedelta(days=1), time.min))
+    # Core execution on the session's connection: plain tuples, no ORM row processing
+    result = (session or db.session).connection().execute(statement.execution_options(yield_per=EXPORT_CHUNK))
+    try:
+        for partition in result.partitions():
+            yield [tuple(row) for row in partition]
+    finally:
+        result.close()
+
+
+def _text(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return _text(value)
+
+
+def csv_chunks(header: List[str], chunks: Iterator[List[tuple]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for rows in chunks:
+        writer.writerows(rows)  # dates and datetimes are written in ISO form by str()
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def jsonl_chunks(header: List[str], chunks: Iterator[List[tuple]]) -> Iterator[str]:
+    for rows in chunks:
+        yield ''.join(json.dumps(dict(zip(header, map(_json_value, row)))) + '\n' for row in rows)
+
+
+TEXT_WRITERS = {'csv': csv_chunks, 'jsonl': jsonl_chunks}
+
+
+def _arrow_type(pa, column):
+    # Typed from the SQL column, so chunks that are all NULL in a column still match
+    python_type = column.type.python_type
+    if python_type is bool:
+        return pa.bool_()
+    if python_type is int:
+        return pa.int64()
+    if python_type in (float, Decimal):
+        return pa.float64()
+    if python_type is datetime:
+        return pa.timestamp('us')
+    if python_type is date:
+        return pa.date32()
+    return pa.string()
+
+
+def write_parquet(path: str, report_type: str, chunks: Iterator[List[tuple]]):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = REPORTS[report_name(report_type)][2]
+    schema = pa.schema([(column.key, _arrow_type(pa, column)) for column in columns])
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in chunks:
+            values = [[float(value) if isinstance(value, Decimal) else value for value in column]
+                      for column in zip(*rows)]
+            writer.write_table(pa.table(values, schema=schema))
+
+
+def write_xlsx(path: str, report_type: str, chunks: Iterator[List[tuple]]):
+    from openpyxl import Workbook
+
+    # Write-only mode streams rows to the file instead of keeping the sheet in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(report_header(report_type))
+    for rows in chunks:
+        for row in rows:
+            sheet.append([float(value) if isinstance(value, Decimal) else value for value in row])
+    workbook.save(path)
+
+
+FILE_WRITERS = {'parquet': write_parquet, 'xlsx': write_xlsx}
+
+
+class ExportJobQueue:
+    """Writes large exports to files on a local thread pool, out of the web request
+
+    Jobs live in the `ExportJob` table, so any worker can report their status
+    and serve the finished file. Files go to `EXPORT_DIRECTORY` (default
+    instance/exports) under a temporary name until complete.
+    """
+
+    def __init__(self, app=None, workers: int = 1):
+        self.app = None
+        self.directory = None
+        self.workers = max(1, workers)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = app.config.get('EXPORT_DIRECTORY') or os.path.join(app.instance_path, 'exports')
+        app.extensions['report_exports'] = self
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='report-export')
+            return self._executor
+
+    def submit(self, report_type: str, fmt: str, start: date = None, end: date = None,
+               created_by: int = None) -> ExportJob:
+        """Queue an export; raises ValueError for an unknown report or unavailable format"""
+        job = ExportJob(report_type=report_name(report_type), format=check_format(fmt), created_by=created_by,
+                        filters=json.dumps({'start': start.isoformat() if start else None,
+                                            'end': end.isoformat() if end else None}))
+        db.session.add(job)
+        db.session.commit()
+        self._pool().submit(self._run, job.id)
+        return job
+
+    def resume(self):
+        """Re-dispatch jobs still queued from before a restart (call inside an app context)"""
+        for job in ExportJob.query.filter_by(status='queued').all():
+            self._pool().submit(self._run, job.id)
+
+    def _claim(self, job_id: int) -> bool:
+        # Conditional update, so a job is only ever run by one worker (or process)
+        claimed = ExportJob.query.filter_by(id=job_id, status='queued').update(
+            {'status': 'running', 'started_at': datetime.utcnow()})
+        db.session.commit()
+        return claimed == 1
+
+    def _progress(self, job_id: int, **values):
+        # SQLite: a write on a second connection waits out the busy timeout behind the streaming
+        # cursor's read lock, so rows are only recorded when the job finishes
+        if db.engine.dialect.name == 'sqlite':
+            return
+        # Separate connection: committing the session would close the streaming cursor
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(update(ExportJob).where(ExportJob.id == job_id).values(**values))
+        except OperationalError:
+            pass  # progress is informational
+
+    def _run(self, job_id: int):
+        with self.app.app_context():
+            path = None
+            try:
+                if not self._claim(job_id):
+                    return
+                job = db.session.get(ExportJob, job_id)
+                filters = json.loads(job.filters or '{}')
+                start, end = [date.fromisoformat(filters[key]) if filters.get(key) else None
+                              for key in ('start', 'end')]
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, f"{job.report_type}_{job.id}.{job.format}")
+                header = report_header(job.report_type)
+
+                written = [0]
+
+                def counted(chunks):
+                    reported = 0
+                    for rows in chunks:
+                        yield rows
+                        written[0] += len(rows)
+                        if written[0] - reported >= PROGRESS_INTERVAL:
+                            self._progress(job_id, rows=written[0])
+                            reported = written[0]
+
+                chunks = counted(stream_rows(job.report_type, start, end))
+                if job.format in TEXT_WRITERS:
+                    with open(path + '.part', 'w', newline='', encoding='utf-8') as f:
+                        for text in TEXT_WRITERS[job.format](header, chunks):
+                            f.write(text)
+                else:
+                    FILE_WRITERS[job.format](path + '.part', job.report_type, chunks)
+                os.replace(path + '.part', path)
+
+                job.status = 'completed'
+                job.rows = written[0]
+                job.path = path
+                job.finished_at = datetime.utcnow()
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                if path is not None and os.path.exists(path + '.part'):
+                    os.remove(path + '.part')
+                ExportJob.query.filter_by(id=job_id).update(
+                    {'status': 'failed', 'error': str(e), 'finished_at': datetime.utcnow()})
+                db.session.commit()
+            finally:
+                db.session.remove()
+
+
+# Shared queue; app.py binds it to the Flask app
+report_exports = ExportJobQueue(workers=int(os.environ.get('REPORT_EXPORT_JOB_WORKERS', 1)))
@@ -0,0 +1,164 @@
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+from typing import Sequence
+from flask import request, Response
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Models whose writes invalidate a cached response unless an endpoint names its own
+DEFAULT_MODELS = ('payment', 'service_request', 'vehicle', 'customer')
+
+
+def _table(model) -> str:
+    return model if isinstance(model, str) else model.__tablename__
+
+
+class ResponseCache:
+    """JSON responses of read-heavy endpoints in a SQLite file shared by every worker
+
+    Entries are keyed by endpoint, query string and the caller's role and
+    department. Each table has a generation counter that is bumped whenever a
+    commit wrote to it; an entry stores the generations of the tables it was
+    computed from and is served only while they are unchanged and its TTL has
+    not run out. Without `init_app` nothing is cached.
+    """
+
+    def __init__(self, app=None):
+        self.path = None
+        self._local = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.path = app.config.get('RESPONSE_CACHE_PATH') or os.path.join(app.instance_path, 'response_cache.db')
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._connection() as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS generations (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+                CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, generations TEXT NOT NULL,
+                    expires REAL NOT NULL, status INTEGER NOT NULL, mimetype TEXT, body BLOB NOT NULL);
+                CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires);
+            """)
+        app.extensions['response_cache'] = self
+
+    def _connection(self) -> sqlite3.Connection:
+        # One autocommit connection per thread and file; WAL lets workers read while another writes
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.path != self.path:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection, self._local.path = connection, self.path
+        return connection
+
+    def _generations(self, tables: Sequence[str]) -> str:
+        rows = dict(self._connection().execute(
+            f"SELECT name, value FROM generations WHERE name IN ({','.join('?' * len(tables))})", tables).fetchall())
+        return ','.join(f"{table}:{rows.get(table, 0)}" for table in tables)
+
+    def invalidate(self, tables: Sequence[str]):
+        """Bump the generation of each table, retiring every entry computed from it"""
+        if self.path is None or not tables:
+            return
+        try:
+            self._connection().executemany(
+                "INSERT INTO generations (name, value) VALUES (?, 1) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + 1", [(table,) for table in sorted(tables)])
+        except sqlite3.Error:
+            # Cannot bump: drop everything instead of serving stale data
+            self.clear()
+
+    def clear(self):
+        if self.path is not None:
+            try:
+                self._connection().execute('DELETE FROM entries')
+            except sqlite3.Error:
+                pass
+
+    @staticmethod
+    def _key() -> str:
+        if current_user and current_user.is_authenticated:
+            scope = f"{current_user.role}:{current_user.department_id}"
+            # Drivers and managers see only their own assignments
+            if current_user.role in ('driver', 'manager'):
+                scope += f":{current_user.id}"
+        else:
+            scope = 'anonymous'
+        return f"{request.endpoint}|{scope}|{request.query_string.decode()}"
+
+    def cached(self, ttl: float = 60, models: Sequence = DEFAULT_MODELS):
+        """Decorator caching a view's successful JSON responses for `ttl` seconds or until `models` change"""
+        tables = sorted({_table(model) for model in models})
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.path is None or request.method != 'GET':
+                    return view(*args, **kwargs)
+                key = self._key()
+                try:
+                    generations = self._generations(tables)
+                    hit = self._connection().execute(
+                        "SELECT status, mimetype, body FROM entries WHERE key = ? AND generations = ? AND expires > ?",
+                        (key, generations, time.time())).fetchone()
+                except sqlite3.Error:
+                    return view(*args, **kwargs)
+                if hit is not None:
+                    response = Response(hit[2], status=hit[0], mimetype=hit[1])
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                response = view(*args, **kwargs)
+                if isinstance(response, Response) and response.status_code == 200 and response.is_json:
+                    now = time.time()
+                    try:
+                        connection = self._connection()
+                        connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                                           (key, generations, now + ttl, response.status_code, response.mimetype,
+                                            response.get_data()))
+                        connection.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+                    except sqlite3.Error:
+                        pass
+                    response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+
+# Shared cache; app.py calls init_app
+response_cache = ResponseCache()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_written_tables(session, flush_context):
+    tables = session.info.setdefault('written_tables', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, '__tablename__', None)
+        if table is not None and (obj not in session.dirty or session.is_modified(obj)):
+            tables.add(table)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_writes(orm_execute_state):
+    # Query.update()/delete() and insert()/update()/delete() statements bypass the flush,
+    # including the rollup upserts the before_flush hooks run through session.execute()
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None:
+            orm_execute_state.session.info.setdefault('written_tables', set()).add(table.name)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_written_tables(session):
+    tables = session.info.pop('written_tables', None)
+    if tables:
+        response_cache.invalidate(tables)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_written_tables(session):
+    session.info.pop('written_tables', None)
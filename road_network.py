@@ -0,0 +1,326 @@
+import csv
+import heapq
+import json
+import os
+import numpy as np
+from scipy.spatial import cKDTree
+from typing import List, Dict, Tuple
+from distance_matrix import haversine_distance, to_unit_vectors
+
+# Speed assumed for edges without one, and for the straight hop from a stop to its snapped node
+DEFAULT_SPEED_KMH = 30
+SNAP_SPEED_KMH = 15
+
+
+def load_road_network(path: str, cache_path: str = None) -> 'RoadNetwork':
+    """Load a road graph and its contraction hierarchy, rebuilding the cache only when stale
+
+    `path` is either a JSON file or a directory holding `nodes.csv` and `edges.csv`;
+    see RoadNetwork.read_graph for the expected columns.
+    """
+    cache_path = cache_path or path.rstrip('/\\') + '.ch.npz'
+    signature = _file_signature(path)
+
+    if os.path.exists(cache_path):
+        network = RoadNetwork.load(cache_path)
+        if network.signature == signature:
+            return network
+
+    network = RoadNetwork(*RoadNetwork.read_graph(path))
+    network.signature = signature
+    network.save(cache_path)
+    return network
+
+
+def _file_signature(path: str) -> str:
+    files = [os.path.join(path, name) for name in ('nodes.csv', 'edges.csv')] if os.path.isdir(path) else [path]
+    return ';'.join(f"{os.path.getsize(f)}:{os.stat(f).st_mtime_ns}" for f in files)
+
+
+class RoadNetwork:
+    """Shortest driving time (and its distance) over a road graph via contraction hierarchies
+
+    Nodes are contracted in edge-difference order, adding shortcuts wherever no
+    witness path is at least as fast. Queries then only search upward in the
+    hierarchy from both ends, meeting in per-node buckets so many-to-many
+    matrices cost one small search per distinct point. Edge weights are minutes; each edge also carries km.
+    """
+
+    # Witness searches give up after settling this many nodes (a missed witness only adds a shortcut)
+    WITNESS_SETTLE_LIMIT = 500
+
+    def __init__(self, coordinates, edges, contract: bool = True):
+        self.coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+        self.signature = None
+        self._tree = cKDTree(to_unit_vectors(self.coordinates)) if len(self.coordinates) else None
+        if contract:
+            self._contract(edges)
+
+    @staticmethod
+    def read_graph(path: str) -> Tuple[np.ndarray, List[Tuple[int, int, float, float]]]:
+        """Read nodes (id, lat, lon) and edges (source, target, length in metres, speed_kmh, oneway)
+
+        Node ids are arbitrary labels; edges are returned as (u, v, minutes, km)
+        between node positions, with two-way roads expanded into both directions.
+        """
+        if os.path.isdir(path):
+            with open(os.path.join(path, 'nodes.csv'), newline='') as f:
+                nodes = [(row['id'], row['lat'], row['lon']) for row in csv.DictReader(f)]
+            with open(os.path.join(path, 'edges.csv'), newline='') as f:
+                raw_edges = [(row['source'], row['target'], row['length'], row.get('speed_kmh'), row.get('oneway'))
+                             for row in csv.DictReader(f)]
+        else:
+            with open(path) as f:
+                graph = json.load(f)
+            nodes = [(n['id'], n['lat'], n['lon']) for n in graph['nodes']]
+            raw_edges = [(e['source'], e['target'], e['length'], e.get('speed_kmh'), e.get('oneway'))
+                         for e in graph['edges']]
+
+        position = {str(node_id): k for k, (node_id, _, _) in enumerate(nodes)}
+        coordinates = np.array([[float(lat), float(lon)] for _, lat, lon in nodes])
+
+        edges = []
+        for source, target, length, speed, oneway in raw_edges:
+            u, v = position.get(str(source)), position.get(str(target))
+            if u is None or v is None or u == v:
+                continue
+            km = float(length) / 1000
+            minutes = km / (float(speed) if speed not in (None, '') else DEFAULT_SPEED_KMH) * 60
+            edges.append((u, v, minutes, km))
+            if str(oneway).lower() not in ('1', 'true', 'yes'):
+                edges.append((v, u, minutes, km))
+
+        return coordinates, edges
+
+    def _contract(self, edges):
+        n = len(self.coordinates)
+        out_edges = [dict() for _ in range(n)]
+        in_edges = [dict() for _ in range(n)]
+        for u, v, minutes, km in edges:
+            if v not in out_edges[u] or minutes < out_edges[u][v][0]:
+                out_edges[u][v] = (minutes, km)
+                in_edges[v][u] = (minutes, km)
+
+        # Plain lists: these are read element by element in the hot witness-search loops
+        rank = [-1] * n
+        contracted_neighbors = [0] * n
+        all_edges = [(u, v, w[0], w[1]) for u in range(n) for v, w in out_edges[u].items()]
+
+        heap = [(self._edge_difference(v, out_edges, in_edges, rank, contracted_neighbors), v) for v in range(n)]
+        heapq.heapify(heap)
+        next_rank = 0
+        while heap:
+            _, v = heapq.heappop(heap)
+            if rank[v] != -1:
+                continue
+            # Lazy update: re-queue if the priority went stale and is no longer the minimum
+            priority = self._edge_difference(v, out_edges, in_edges, rank, contracted_neighbors)
+            if heap and priority > heap[0][0]:
+                heapq.heappush(heap, (priority, v))
+                continue
+
+            for u, x, minutes, km in self._shortcuts(v, out_edges, in_edges, rank):
+                if x not in out_edges[u] or minutes < out_edges[u][x][0]:
+                    out_edges[u][x] = (minutes, km)
+                    in_edges[x][u] = (minutes, km)
+                    all_edges.append((u, x, minutes, km))
+            rank[v] = next_rank
+            next_rank += 1
+            for neighbor in set(out_edges[v]) | set(in_edges[v]):
+                contracted_neighbors[neighbor] += 1
+
+        self.rank = np.array(rank)
+        self._build_search_graphs(all_edges)
+
+    def _edge_difference(self, v, out_edges, in_edges, rank, contracted_neighbors) -> int:
+        removed = sum(1 for u in in_edges[v] if rank[u] == -1) + sum(1 for x in out_edges[v] if rank[x] == -1)
+        return len(self._shortcuts(v, out_edges, in_edges, rank)) - removed + contracted_neighbors[v]
+
+    def _shortcuts(self, v, out_edges, in_edges, rank) -> List[Tuple[int, int, float, float]]:
+        """Shortcuts needed to contract v: u -> v -> x pairs without a witness path"""
+        targets = {x: w for x, w in out_edges[v].items() if rank[x] == -1}
+        shortcuts = []
+        for u, (in_minutes, in_km) in in_edges[v].items():
+            if rank[u] != -1:
+                continue
+            limit = in_minutes + max((w[0] for x, w in targets.items() if x != u), default=0)
+            witness = self._witness_search(u, v, limit, set(targets) - {u}, out_edges, rank)
+            for x, (out_minutes, out_km) in targets.items():
+                if x != u and witness.get(x, np.inf) > in_minutes + out_minutes:
+                    shortcuts.append((u, x, in_minutes + out_minutes, in_km + out_km))
+        return shortcuts
+
+    def _witness_search(self, source, excluded, limit, targets, out_edges, rank) -> Dict[int, float]:
+        """Fastest times from source avoiding `excluded`, stopping once every target is settled"""
+        distances = {source: 0.0}
+        heap = [(0.0, source)]
+        settled = 0
+        remaining = len(targets)
+        while heap and settled < self.WITNESS_SETTLE_LIMIT and remaining:
+            d, node = heapq.heappop(heap)
+            if d > distances[node]:
+                continue
+            if d > limit:
+                break
+            settled += 1
+            if node in targets:
+                remaining -= 1
+            for nxt, (minutes, _) in out_edges[node].items():
+                if nxt == excluded or rank[nxt] != -1:
+                    continue
+                nd = d + minutes
+                if nd <= limit and nd < distances.get(nxt, np.inf):
+                    distances[nxt] = nd
+                    heapq.heappush(heap, (nd, nxt))
+        return distances
+
+    def _build_search_graphs(self, edges):
+        """Upward adjacency in CSR form: forward edges to higher ranks, backward edges from them"""
+        n = len(self.coordinates)
+        edges = np.array(edges, dtype=float).reshape(-1, 4)
+        u, v = edges[:, 0].astype(int), edges[:, 1].astype(int)
+        upward = self.rank[u] < self.rank[v]
+
+        self.forward = self._csr(n, u[upward], v[upward], edges[upward, 2], edges[upward, 3])
+        self.backward = self._csr(n, v[~upward], u[~upward], edges[~upward, 2], edges[~upward, 3])
+
+    @staticmethod
+    def _csr(n, sources, targets, minutes, km) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        order = np.argsort(sources, kind='stable')
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.add.at(offsets, sources + 1, 1)
+        return np.cumsum(offsets), targets[order], minutes[order], km[order]
+
+    def _adjacency(self, graph):
+        """CSR arrays as per-node Python lists, which are much faster to walk in a search loop"""
+        offsets, targets, minutes, km = graph
+        targets, minutes, km = targets.tolist(), minutes.tolist(), km.tolist()
+        return [list(zip(targets[a:b], minutes[a:b], km[a:b])) for a, b in zip(offsets[:-1], offsets[1:])]
+
+    @property
+    def _forward_lists(self):
+        if getattr(self, '_forward_cache', None) is None:
+            self._forward_cache = self._adjacency(self.forward)
+        return self._forward_cache
+
+    @property
+    def _backward_lists(self):
+        if getattr(self, '_backward_cache', None) is None:
+            self._backward_cache = self._adjacency(self.backward)
+        return self._backward_cache
+
+    def _upward_search(self, source: int, adjacency) -> Dict[int, Tuple[float, float]]:
+        """Every node reachable upward from source, with (minutes, km) of the fastest path"""
+        best = {source: (0.0, 0.0)}
+        heap = [(0.0, 0.0, source)]
+        while heap:
+            minutes, km, node = heapq.heappop(heap)
+            if minutes > best[node][0]:
+                continue
+            for nxt, edge_minutes, edge_km in adjacency[node]:
+                candidate = minutes + edge_minutes
+                if candidate < best.get(nxt, (np.inf,))[0]:
+                    best[nxt] = (candidate, km + edge_km)
+                    heapq.heappush(heap, (candidate, km + edge_km, nxt))
+        return best
+
+    def snap(self, coordinates) -> Tuple[np.ndarray, np.ndarray]:
+        """Nearest graph node of each lat/lon point, and the straight-line km to it"""
+        coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+        _, nodes = self._tree.query(to_unit_vectors(coordinates))
+        nodes = np.asarray(nodes, dtype=int).reshape(-1)
+        offsets = haversine_distance(coordinates[:, 0], coordinates[:, 1],
+                                     self.coordinates[nodes, 0], self.coordinates[nodes, 1])
+        return nodes, offsets
+
+    def route(self, origin, destination) -> Tuple[float, float]:
+        """(km, minutes) of the fastest drive between two lat/lon points"""
+        distances, durations = self.matrix([origin, destination])
+        return float(distances[0, 1]), float(durations[0, 1])
+
+    def node_matrix(self, sources: List[int], targets: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Many-to-many (km, minutes) between graph nodes using bucket-based CH search
+
+        Each target's backward upward search leaves (target, minutes, km) in a bucket
+        at every node it settles; each source's forward search then scans the buckets
+        of the nodes it reaches. Unreachable pairs are inf.
+        """
+        km_matrix = np.full((len(sources), len(targets)), np.inf)
+        minutes_matrix = np.full((len(sources), len(targets)), np.inf)
+
+        buckets = {}
+        backward_cache = {}
+        for column, target in enumerate(targets):
+            if target not in backward_cache:
+                backward_cache[target] = self._upward_search(target, self._backward_lists)
+            for node, (minutes, km) in backward_cache[target].items():
+                buckets.setdefault(node, []).append((column, minutes, km))
+
+        forward_cache = {}
+        for row, source in enumerate(sources):
+            if source not in forward_cache:
+                forward_cache[source] = self._upward_search(source, self._forward_lists)
+            best_minutes = minutes_matrix[row]
+            best_km = km_matrix[row]
+            for node, (minutes, km) in forward_cache[source].items():
+                for column, target_minutes, target_km in buckets.get(node, ()):
+                    total = minutes + target_minutes
+                    if total < best_minutes[column]:
+                        best_minutes[column] = total
+                        best_km[column] = km + target_km
+
+        return km_matrix, minutes_matrix
+
+    def matrix(self, coordinates) -> Tuple[np.ndarray, np.ndarray]:
+        """Pairwise driving (km, minutes) between lat/lon points, including the hops to the road
+
+        Pairs the graph cannot connect fall back to the straight line at SNAP_SPEED_KMH.
+        """
+        coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+        nodes, offsets = self.snap(coordinates)
+        unique, inverse = np.unique(nodes, return_inverse=True)
+        km, minutes = self.node_matrix(unique.tolist(), unique.tolist())
+        block = np.ix_(inverse.reshape(-1), inverse.reshape(-1))
+        km, minutes = km[block], minutes[block]
+
+        hop = offsets[:, None] + offsets[None, :]
+        km = km + hop
+        minutes = minutes + hop / SNAP_SPEED_KMH * 60
+
+        unreachable = ~np.isfinite(minutes)
+        if unreachable.any():
+            straight = haversine_distance(coordinates[:, 0, None], coordinates[:, 1, None],
+                                          coordinates[None, :, 0], coordinates[None, :, 1])
+            km[unreachable] = straight[unreachable]
+            minutes[unreachable] = straight[unreachable] / SNAP_SPEED_KMH * 60
+        np.fill_diagonal(km, 0.0)
+        np.fill_diagonal(minutes, 0.0)
+        return km, minutes
+
+    def save(self, path: str):
+        np.savez(path, coordinates=self.coordinates, rank=self.rank,
+                 signature=np.array(self.signature or ''),
+                 **{f'{name}_{part}': array
+                    for name, graph in (('forward', self.forward), ('backward', self.backward))
+                    for part, array in zip(('offsets', 'targets', 'minutes', 'km'), graph)})
+
+    @classmethod
+    def load(cls, path: str) -> 'RoadNetwork':
+        data = np.load(path)
+        network = cls(data['coordinates'], [], contract=False)
+        network.rank = data['rank']
+        network.signature = str(data['signature']) or None
+        network.forward = tuple(data[f'forward_{part}'] for part in ('offsets', 'targets', 'minutes', 'km'))
+        network.backward = tuple(data[f'backward_{part}'] for part in ('offsets', 'targets', 'minutes', 'km'))
+        return network
+
+
+# One network per graph file and process, so pool workers load the hierarchy once
+_open_networks = {}
+
+
+def open_road_network(path: str) -> RoadNetwork:
+    network = _open_networks.get(path)
+    if network is None:
+        network = _open_networks[path] = load_road_network(path)
+    return network
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Route optimization benchmarks on reproducible synthetic cities
+
+    python route_benchmark.py run [--suite quick|standard|full] [--workers N]
+    python route_benchmark.py compare [--baseline COMMIT] [--candidate COMMIT]
+
+Every run appends one JSON line per scenario to benchmarks/results.jsonl, tagged
+with the commit and settings it ran with; `compare` lines up two commits run with
+the same settings and exits non-zero on a regression, so it can gate a merge.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+from datetime import datetime
+from typing import List, Dict, Tuple
+
+RESULTS_FILE = os.path.join('benchmarks', 'results.jsonl')
+
+# Synthetic city: stops within CITY_RADIUS_KM of the centre, clustered ones around DISTRICTS centres
+CITY_CENTER = (40.7128, -74.0060)
+CITY_RADIUS_KM = 15.0
+DISTRICTS = 12
+KM_PER_DEGREE = 111.32
+
+# (layout, requests, vehicles)
+SUITES = {
+    'quick': [('uniform', 100, 3), ('clustered', 100, 3), ('uniform', 1000, 10), ('clustered', 1000, 10)],
+    'standard': [('uniform', 100, 3), ('clustered', 100, 3), ('uniform', 1000, 10), ('clustered', 1000, 10),
+                 ('uniform', 5000, 25), ('clustered', 5000, 25), ('clustered', 10000, 50)],
+    'full': [('uniform', 100, 3), ('clustered', 100, 3), ('uniform', 1000, 10), ('clustered', 1000, 10),
+             ('uniform', 5000, 25), ('clustered', 5000, 25), ('clustered', 10000, 50),
+             ('uniform', 20000, 50), ('clustered', 20000, 100), ('clustered', 50000, 100)]
+}
+
+# Relative changes that count as regressions in `compare`
+REGRESSION_THRESHOLDS = {'wall_time': 0.20, 'peak_memory_mb': 0.20, 'total_distance': 0.01}
+# Run settings a result depends on besides the code; `compare` only lines up results that share them
+RUN_SETTINGS = ('suite', 'workers', 'machine', 'cpus', 'seed')
+
+
+def generate_city(n_requests: int, n_vehicles: int, layout: str = 'clustered',
+                  seed: int = 0) -> Tuple[List[Dict], List[Dict]]:
+    """Service requests and vehicles of a synthetic city; the same arguments give the same city"""
+    rng = np.random.default_rng(seed)
+    scale = CITY_RADIUS_KM / KM_PER_DEGREE
+    if layout == 'uniform':
+        # Uniform over the disc
+        radius = scale * np.sqrt(rng.random(n_requests))
+        angle = rng.random(n_requests) * 2 * np.pi
+        offsets = np.column_stack([radius * np.sin(angle), radius * np.cos(angle)])
+    elif layout == 'clustered':
+        # Districts of different sizes and spreads, plus 10% scattered stops
+        centres = rng.normal(scale=scale / 2, size=(DISTRICTS, 2))
+        spread = rng.uniform(0.03, 0.12, size=DISTRICTS) * scale
+        weights = rng.dirichlet(np.ones(DISTRICTS))
+        district = rng.choice(DISTRICTS, size=n_requests, p=weights)
+        offsets = centres[district] + rng.normal(size=(n_requests, 2)) * spread[district, None]
+        scattered = rng.random(n_requests) < 0.1
+        offsets[scattered] = rng.uniform(-scale, scale, size=(scattered.sum(), 2))
+    else:
+        raise ValueError(f"Unknown layout '{layout}'")
+
+    latitude = CITY_CENTER[0] + offsets[:, 0]
+    longitude = CITY_CENTER[1] + offsets[:, 1] / np.cos(np.radians(CITY_CENTER[0]))
+    demand = rng.integers(1, 4, size=n_requests)
+    service_requests = [
+        {'id': i, 'customer_id': i, 'latitude': float(lat), 'longitude': float(lon), 'demand': int(d)}
+        for i, (lat, lon, d) in enumerate(zip(latitude, longitude, demand))
+    ]
+
+    types = ['compactor', 'rear_loader', 'side_loader', 'roll_off']
+    capacities = rng.choice([8, 10, 12, 16], size=n_vehicles)
+    vehicles = [
+        {'id': k, 'vehicle_type': types[k % len(types)], 'capacity': f"{int(c)} tons",
+         'current_latitude': CITY_CENTER[0], 'current_longitude': CITY_CENTER[1]}
+        for k, c in enumerate(capacities)
+    ]
+    return service_requests, vehicles
+
+
+def scenario_name(layout: str, n_requests: int, n_vehicles: int) -> str:
+    return f"{layout}-{n_requests}-{n_vehicles}"
+
+
+def _balance(values: List[float]) -> float:
+    """Coefficient of variation (0 is perfectly balanced)"""
+    values = np.asarray(values, dtype=float)
+    return float(values.std() / values.mean()) if len(values) and values.mean() > 0 else 0.0
+
+
+def _run_once(optimizer, service_requests: List[Dict], vehicles: List[Dict]) -> Tuple[Dict, Dict, float, float]:
+    started = time.perf_counter()
+    plan = optimizer.optimize_routes(service_requests, vehicles)
+    optimized = time.perf_counter()
+    assignment = optimizer.optimize_vehicle_assignment(plan['optimized_routes'], vehicles)
+    return plan, assignment, optimized - started, time.perf_counter() - optimized
+
+
+def run_scenario(optimizer, layout: str, n_requests: int, n_vehicles: int, repeat: int = 1,
+                 memory: bool = True, seed: int = 0) -> Dict:
+    """Benchmark one city: best wall time over `repeat` runs, then a traced run for peak memory
+
+    Peak memory is measured with tracemalloc in this process only (pool workers
+    are not traced) and in a separate run, so tracing does not skew the timings.
+    """
+    service_requests, vehicles = generate_city(n_requests, n_vehicles, layout, seed)
+
+    timings = []
+    for _ in range(max(1, repeat)):
+        plan, assignment, optimize_time, assignment_time = _run_once(optimizer, service_requests, vehicles)
+        timings.append((optimize_time, assignment_time))
+
+    peak_memory = None
+    if memory:
+        tracemalloc.start()
+        _run_once(optimizer, service_requests, vehicles)
+        peak_memory = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+
+    routes = plan['optimized_routes']
+    return {
+        'scenario': scenario_name(layout, n_requests, n_vehicles),
+        'layout': layout,
+        'requests': n_requests,
+        'vehicles': n_vehicles,
+        'seed': seed,
+        'wall_time': min(t for t, _ in timings),
+        'assignment_time': min(t for _, t in timings),
+        'peak_memory_mb': peak_memory,
+        'routes': len(routes),
+        'total_distance': plan['total_distance'],
+        'total_time': plan['total_time'],
+        'improvement_percentage': plan['improvement_percentage'],
+        'algorithm': plan['algorithm'],
+        'stops_balance': _balance([len(r['requests']) for r in routes]),
+        'distance_balance': _balance([r['total_distance'] for r in routes]),
+        'time_balance': _balance([r['estimated_time'] for r in routes]),
+        'longest_route_hours': max(r['estimated_time'] for r in routes),
+        'average_compatibility': assignment['average_compatibility']
+    }
+
+
+def current_commit() -> Dict:
+    """Commit hash of the working tree, and whether it has uncommitted changes"""
+    repo = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True, cwd=repo).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True, cwd=repo).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+    return {'commit': commit, 'dirty': dirty}
+
+
+def load_results(path: str = RESULTS_FILE) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run(args):
+    from ai_route_optimization import RouteOptimizer
+
+    optimizer = RouteOptimizer(workers=args.workers)
+    context = dict(current_commit(), run_at=datetime.utcnow().isoformat(), suite=args.suite,
+                   workers=args.workers, python=platform.python_version(), numpy=np.__version__,
+                   machine=platform.machine(), cpus=os.cpu_count())
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    try:
+        for layout, n_requests, n_vehicles in SUITES[args.suite]:
+            result = dict(context, **run_scenario(optimizer, layout, n_requests, n_vehicles,
+                                                  args.repeat, not args.no_memory, args.seed))
+            with open(args.output, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+            memory = f"{result['peak_memory_mb']:.1f} MB" if result['peak_memory_mb'] is not None else '-'
+            print(f"{result['scenario']:>22}  {result['wall_time']:8.2f} s  {memory:>10}  "
+                  f"{result['total_distance']:10.1f} km  balance {result['stops_balance']:.2f}")
+    finally:
+        optimizer.close()
+
+
+def run_settings(result: Dict) -> Tuple:
+    return tuple(result.get(name) for name in RUN_SETTINGS)
+
+
+def _describe(settings: Tuple) -> str:
+    return ', '.join(f"{name} {value}" for name, value in zip(RUN_SETTINGS, settings))
+
+
+def compare(args) -> int:
+    """Print per-scenario changes between two commits; returns 1 if any metric regressed
+
+    Only results run with the candidate's latest settings (suite, workers,
+    machine, CPU count and seed) are compared; the baseline defaults to the
+    latest other commit run with them.
+    """
+    results = load_results(args.output)
+    candidate = args.candidate or (results[-1]['commit'] if results else None)
+    candidate_runs = [r for r in results if r['commit'] == candidate]
+    if not candidate_runs:
+        print('Need results from two commits to compare')
+        return 0
+
+    settings = run_settings(candidate_runs[-1])
+    matching = [r for r in results if run_settings(r) == settings]
+    baseline = args.baseline or next((r['commit'] for r in reversed(matching) if r['commit'] != candidate), None)
+    if baseline is None or not any(r['commit'] == baseline for r in matching):
+        print(f"No results from {baseline or 'another commit'} with the settings of {candidate} "
+              f"({_describe(settings)}); not comparing")
+        return 0
+
+    # Latest result per scenario for each commit
+    latest = {baseline: {}, candidate: {}}
+    for r in matching:
+        if r['commit'] in latest:
+            latest[r['commit']][r['scenario']] = r
+
+    regressed = False
+    print(f"{baseline} -> {candidate} ({_describe(settings)})")
+    for scenario, new in latest[candidate].items():
+        old = latest[baseline].get(scenario)
+        if old is None:
+            continue
+        changes = []
+        for metric, threshold in REGRESSION_THRESHOLDS.items():
+            if not old.get(metric) or new.get(metric) is None:
+                continue
+            change = new[metric] / old[metric] - 1
+            flag = ' REGRESSION' if change > threshold else ''
+            regressed = regressed or bool(flag)
+            changes.append(f"{metric} {change:+.1%}{flag}")
+        print(f"{scenario:>22}  " + ', '.join(changes))
+    return 1 if regressed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Route optimization benchmarks')
+    parser.add_argument('--output', default=RESULTS_FILE, help='results file (JSON lines)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run a benchmark suite and append the results')
+    run_parser.add_argument('--suite', choices=sorted(SUITES), default='quick')
+    run_parser.add_argument('--workers', type=int, default=1)
+    run_parser.add_argument('--repeat', type=int, default=1, help='timed runs per scenario (best is kept)')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--no-memory', action='store_true', help='skip the traced peak-memory run')
+
+    compare_parser = commands.add_parser('compare', help='compare the results of two commits')
+    compare_parser.add_argument('--baseline',
+                                help='commit to compare against (default: previous commit run with the same settings)')
+    compare_parser.add_argument('--candidate', help='commit to check (default: latest run)')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
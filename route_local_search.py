@@ -0,0 +1,128 @@
+import numpy as np
+import time
+from typing import List, Dict, Tuple
+
+# Moves must shorten the route by more than this (km) to be applied
+IMPROVEMENT_EPSILON = 1e-9
+
+
+def improve_route(distances: np.ndarray, order: List[int], max_iterations: int = 1000,
+                  time_limit: float = None, end: int = None) -> Tuple[List[int], Dict]:
+    """Improve an open route with 2-opt and Or-opt moves
+
+    `distances` is a depot-first matrix (depot at index 0) and `order` the matrix
+    indices of the stops in visiting order. The route starts at the depot and
+    ends at its last stop, or at the fixed stop `end` (not part of `order`) when
+    given; the returned order uses the same indices.
+    """
+    started = time.perf_counter()
+    deadline = started + time_limit if time_limit is not None else None
+
+    # Append a zero-distance sentinel so the open end behaves like a regular edge
+    n = len(distances)
+    padded = np.zeros((n + 1, n + 1))
+    padded[:n, :n] = distances
+    if end is not None:
+        # A fixed end is the sentinel itself: it takes on that stop's distances
+        padded[:n, n] = distances[:, end]
+        padded[n, :n] = distances[end, :]
+    seq = np.array([0] + list(order) + [n], dtype=int)
+
+    initial_distance = _path_length(padded, seq)
+    stats = {'two_opt_moves': 0, 'or_opt_moves': 0, 'passes': 0}
+    iterations = 0
+
+    improved = len(order) > 2
+    while improved and iterations < max_iterations:
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+        stats['passes'] += 1
+
+        two_opt_moves = _two_opt_pass(padded, seq, max_iterations - iterations, deadline)
+        iterations += two_opt_moves
+
+        or_opt_moves, seq = _or_opt_pass(padded, seq, max_iterations - iterations, deadline)
+        iterations += or_opt_moves
+
+        stats['two_opt_moves'] += two_opt_moves
+        stats['or_opt_moves'] += or_opt_moves
+        improved = two_opt_moves + or_opt_moves > 0
+
+    final_distance = _path_length(padded, seq)
+    stats.update({
+        'initial_distance': initial_distance,
+        'final_distance': final_distance,
+        'improvement': initial_distance - final_distance,
+        'improvement_pct': (initial_distance - final_distance) / initial_distance * 100 if initial_distance > 0 else 0,
+        'iterations': iterations,
+        'elapsed': time.perf_counter() - started
+    })
+
+    return seq[1:-1].tolist(), stats
+
+
+def _path_length(distances: np.ndarray, seq: np.ndarray) -> float:
+    return float(distances[seq[:-1], seq[1:]].sum())
+
+
+def _two_opt_pass(distances: np.ndarray, seq: np.ndarray, budget: int, deadline: float = None) -> int:
+    """Apply the best improving segment reversal for each start position (in place)"""
+    moves = 0
+    m = len(seq)
+
+    for i in range(1, m - 2):
+        if moves >= budget or (deadline is not None and time.perf_counter() >= deadline):
+            break
+
+        # Reversing seq[i..j] replaces edges (a, b) and (c, d) with (a, c) and (b, d)
+        a, b = seq[i - 1], seq[i]
+        c = seq[i + 1:m - 1]
+        d = seq[i + 2:m]
+        delta = distances[a, c] + distances[b, d] - distances[a, b] - distances[c, d]
+
+        best = int(np.argmin(delta))
+        if delta[best] < -IMPROVEMENT_EPSILON:
+            j = i + 1 + best
+            seq[i:j + 1] = seq[i:j + 1][::-1]
+            moves += 1
+
+    return moves
+
+
+def _or_opt_pass(distances: np.ndarray, seq: np.ndarray, budget: int,
+                 deadline: float = None) -> Tuple[int, np.ndarray]:
+    """Relocate segments of 1-3 stops to their cheapest position, possibly reversed"""
+    moves = 0
+
+    for segment_length in (1, 2, 3):
+        i = 1
+        while i < len(seq) - segment_length:
+            if moves >= budget or (deadline is not None and time.perf_counter() >= deadline):
+                return moves, seq
+
+            prev, nxt = seq[i - 1], seq[i + segment_length]
+            first, last = seq[i], seq[i + segment_length - 1]
+            removal_gain = distances[prev, first] + distances[last, nxt] - distances[prev, nxt]
+
+            # Candidate insertion edges (u, v) that do not touch the segment
+            u = seq[:-1]
+            v = seq[1:]
+            forward = distances[u, first] + distances[last, v] - distances[u, v]
+            backward = distances[u, last] + distances[first, v] - distances[u, v]
+            insertion = np.minimum(forward, backward)
+            insertion[i - 1:i + segment_length] = np.inf
+
+            t = int(np.argmin(insertion))
+            if insertion[t] - removal_gain < -IMPROVEMENT_EPSILON:
+                segment = seq[i:i + segment_length]
+                if backward[t] < forward[t]:
+                    segment = segment[::-1]
+                rest = np.concatenate([seq[:i], seq[i + segment_length:]])
+                # Edge t sits after the removed segment when t >= i + segment_length
+                position = t + 1 if t < i else t + 1 - segment_length
+                seq = np.concatenate([rest[:position], segment, rest[position:]])
+                moves += 1
+            else:
+                i += 1
+
+    return moves, seq
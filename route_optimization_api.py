@@ -0,0 +1,139 @@
+from flask import Blueprint, request, jsonify, url_for
+from flask_login import login_required, current_user
+from models import db, OptimizationJob
+from optimization_jobs import optimization_jobs, with_customer_coordinates
+from route_rendering import route_render_cache, RENDERERS
+from ai_route_optimization import route_optimizer
+import json
+
+route_optimization_api = Blueprint('route_optimization_api', __name__)
+
+
+def _visible_job(job_id: int):
+    """The job if the current user created it, belongs to its department or is a super admin"""
+    job = db.session.get(OptimizationJob, job_id)
+    if job is None:
+        return None
+    if job.created_by == current_user.id or current_user.role == 'super_admin':
+        return job
+    if job.department_id is not None and current_user.can_access_department(job.department_id):
+        return job
+    return None
+
+
+@route_optimization_api.route('/api/routes/optimize', methods=['POST'])
+@login_required
+def optimize_routes():
+    """Queue a route optimization, with an optional time budget in seconds
+
+    Returns the job id and its status/result URLs straight away; submitting the
+    same inputs again for the same department (or user) returns the existing job.
+    """
+    data = request.get_json() or {}
+    service_requests = data.get('service_requests', [])
+    vehicles = data.get('vehicles', [])
+    time_budget = data.get('time_budget')
+
+    if not service_requests or not vehicles:
+        return jsonify({'error': 'service_requests and vehicles are required'}), 400
+    # Requests may give just a customer_id; its geocoded position is used
+    service_requests = with_customer_coordinates(service_requests)
+    missing = [r.get('id') for r in service_requests if r.get('latitude') is None or r.get('longitude') is None]
+    if missing:
+        return jsonify({'error': 'Some service requests have no coordinates and no geocoded customer',
+                        'request_ids': missing}), 400
+    try:
+        time_budget = float(time_budget) if time_budget is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'time_budget must be a number of seconds'}), 400
+    try:
+        department_id = int(data['department_id']) if data.get('department_id') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'department_id must be an integer'}), 400
+    if department_id is not None and not current_user.can_access_department(department_id):
+        return jsonify({'error': 'Access denied. You cannot access this department.'}), 403
+
+    job, created = optimization_jobs.submit(service_requests, vehicles, data.get('constraints'),
+                                            time_budget=time_budget, created_by=current_user.id,
+                                            department_id=department_id)
+
+    response = job.to_dict()
+    response.update({
+        'deduplicated': not created,
+        'status_url': url_for('route_optimization_api.optimization_status', job_id=job.id),
+        'result_url': url_for('route_optimization_api.optimization_result', job_id=job.id)
+    })
+    return jsonify(response), 202 if created else 200
+
+
+@route_optimization_api.route('/api/routes/optimize/<int:job_id>', methods=['GET'])
+@login_required
+def optimization_status(job_id):
+    """Poll a job; `since` skips progress entries already seen"""
+    job = _visible_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    progress = json.loads(job.progress) if job.progress else []
+    since = request.args.get('since', 0, type=int)
+
+    response = job.to_dict()
+    response.update({'progress': progress[since:], 'progress_count': len(progress)})
+    return jsonify(response)
+
+
+@route_optimization_api.route('/api/routes/optimize/<int:job_id>/result', methods=['GET'])
+@login_required
+def optimization_result(job_id):
+    """The finished plan, or the best plan so far while the job is still running"""
+    job = _visible_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.result is None:
+        return jsonify({'error': 'No result yet', 'status': job.status}), 409
+
+    response = job.to_dict()
+    response['plan'] = json.loads(job.result)
+    return jsonify(response)
+
+
+@route_optimization_api.route('/api/routes/optimize/<int:job_id>/render', methods=['GET'])
+@login_required
+def optimization_render(job_id):
+    """The plan's routes as encoded polylines (default) or GeoJSON, for map display
+
+    `routes` limits the output to a comma-separated list of route ids, `zoom` sets
+    the marker clustering grid and `markers=0` leaves markers out. Responses carry
+    an ETag of the plan version, so unchanged plans come back as 304.
+    """
+    job = _visible_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.result is None:
+        return jsonify({'error': 'No result yet', 'status': job.status}), 409
+
+    fmt = request.args.get('format', 'polyline')
+    if fmt not in RENDERERS:
+        return jsonify({'error': f"format must be one of {', '.join(sorted(RENDERERS))}"}), 400
+    try:
+        route_ids = [int(r) for r in request.args['routes'].split(',')] if request.args.get('routes') else None
+    except ValueError:
+        return jsonify({'error': 'routes must be a comma-separated list of route ids'}), 400
+    zoom = request.args.get('zoom', type=int)
+    markers = request.args.get('markers', '1') not in ('0', 'false')
+
+    version = f"{job.id}:{job.result_version or 0}"
+    rendered = route_render_cache.render(version, lambda: json.loads(job.result), fmt, route_ids, zoom, markers)
+
+    response = jsonify(dict(rendered, job_id=job.id, status=job.status, result_version=job.result_version))
+    response.set_etag(f"{version}:{fmt}:{request.query_string.decode()}")
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@route_optimization_api.route('/api/routes/demand', methods=['GET'])
+@login_required
+def demand_prediction():
+    """Expected requests per weekday, optionally for one department"""
+    return jsonify(route_optimizer.predict_demand(department_id=request.args.get('department_id', type=int)))
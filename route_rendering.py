@@ -0,0 +1,175 @@
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import List, Dict, Callable, Sequence
+
+# Digits kept by encoded polylines (5 is the format's standard, about 1 m)
+POLYLINE_PRECISION = 5
+
+# Routes with more stops than this get their markers clustered on a screen grid
+MARKER_CLUSTER_MIN_STOPS = 50
+MARKER_CELL_PIXELS = 60
+VIEWPORT_PIXELS = 800
+
+
+def encode_polyline(coordinates, precision: int = POLYLINE_PRECISION) -> str:
+    """Encoded-polyline string of (latitude, longitude) points"""
+    points = np.round(np.asarray(coordinates, dtype=float).reshape(-1, 2) * 10 ** precision).astype(np.int64)
+    if len(points) == 0:
+        return ''
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+
+    chars = []
+    for value in values.tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return ''.join(chars)
+
+
+def _mercator_pixels(coordinates: np.ndarray, zoom: int) -> np.ndarray:
+    """Web Mercator pixel positions of (latitude, longitude) points at a zoom level"""
+    scale = 256 * 2 ** zoom
+    lat = np.radians(np.clip(coordinates[:, 0], -85.0511, 85.0511))
+    x = (coordinates[:, 1] + 180) / 360 * scale
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * scale
+    return np.column_stack([x, y])
+
+
+def fit_zoom(coordinates: np.ndarray, viewport: int = VIEWPORT_PIXELS) -> int:
+    """Largest zoom level at which all points fit in a square viewport"""
+    for zoom in range(18, 0, -1):
+        pixels = _mercator_pixels(coordinates, zoom)
+        if np.all(pixels.max(axis=0) - pixels.min(axis=0) <= viewport):
+            return zoom
+    return 0
+
+
+def cluster_markers(coordinates: np.ndarray, zoom: int = None, cell: int = MARKER_CELL_PIXELS) -> List[Dict]:
+    """Stop markers, merged per grid cell of `cell` pixels when a route is dense
+
+    Single stops keep their position in the route as 'stop'; clusters carry their
+    size and centroid.
+    """
+    coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+    if len(coordinates) <= MARKER_CLUSTER_MIN_STOPS:
+        return [{'latitude': lat, 'longitude': lon, 'count': 1, 'stop': k}
+                for k, (lat, lon) in enumerate(np.round(coordinates, 6).tolist())]
+
+    zoom = fit_zoom(coordinates) if zoom is None else zoom
+    cells = np.floor(_mercator_pixels(coordinates, zoom) / cell).astype(np.int64)
+    _, labels, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    labels = labels.ravel()
+    centroids = np.column_stack([np.bincount(labels, coordinates[:, 0]), np.bincount(labels, coordinates[:, 1])])
+    centroids = np.round(centroids / counts[:, None], 6)
+    first = np.full(len(counts), len(coordinates))
+    np.minimum.at(first, labels, np.arange(len(coordinates)))
+
+    markers = []
+    for c in np.argsort(first).tolist():
+        lat, lon = centroids[c].tolist()
+        marker = {'latitude': lat, 'longitude': lon, 'count': int(counts[c])}
+        if counts[c] == 1:
+            marker['stop'] = int(first[c])
+        markers.append(marker)
+    return markers
+
+
+def route_coordinates(route: Dict) -> np.ndarray:
+    """Depot followed by the route's stops, as an (n, 2) array"""
+    points = [[req['latitude'], req['longitude']] for req in route.get('requests', [])]
+    depot = route.get('depot')
+    if depot:
+        points.insert(0, [depot['latitude'], depot['longitude']])
+    return np.array(points, dtype=float).reshape(-1, 2)
+
+
+def _route_properties(route: Dict) -> Dict:
+    return {
+        'route_id': route.get('route_id'),
+        'vehicle_id': route.get('vehicle_id'),
+        'db_route_id': route.get('db_route_id'),
+        'stops': len(route.get('requests', [])),
+        'total_distance': route.get('total_distance'),
+        'estimated_time': route.get('estimated_time')
+    }
+
+
+def render_polylines(routes: List[Dict], zoom: int = None, markers: bool = True) -> Dict:
+    """Routes as encoded polylines (depot first) with optional clustered stop markers"""
+    rendered = []
+    for route in routes:
+        path = route_coordinates(route)
+        item = dict(_route_properties(route), polyline=encode_polyline(path))
+        if markers:
+            item['markers'] = cluster_markers(path[1:] if route.get('depot') else path, zoom)
+        rendered.append(item)
+    return {'format': 'polyline', 'precision': POLYLINE_PRECISION, 'routes': rendered}
+
+
+def render_geojson(routes: List[Dict], zoom: int = None, markers: bool = True) -> Dict:
+    """Routes as a GeoJSON FeatureCollection: one LineString per route plus marker Points"""
+    features = []
+    for route in routes:
+        path = route_coordinates(route)
+        properties = _route_properties(route)
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'LineString', 'coordinates': np.round(path[:, ::-1], 6).tolist()},
+            'properties': properties
+        })
+        if not markers:
+            continue
+        for marker in cluster_markers(path[1:] if route.get('depot') else path, zoom):
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [marker.pop('longitude'), marker.pop('latitude')]},
+                'properties': dict(marker, route_id=properties['route_id'])
+            })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+RENDERERS = {'polyline': render_polylines, 'geojson': render_geojson}
+
+
+class RouteRenderCache:
+    """In-memory LRU of rendered routes keyed by plan version and render options
+
+    A plan's version changes whenever it is rewritten, so entries never go stale;
+    on a hit the plan itself is not even loaded.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, version: str, load_plan: Callable[[], Dict], fmt: str = 'polyline',
+               route_ids: Sequence[int] = None, zoom: int = None, markers: bool = True) -> Dict:
+        """Rendered routes of a plan (all of them, or those in `route_ids`)"""
+        if fmt not in RENDERERS:
+            raise ValueError(f"Unknown format '{fmt}', expected one of {sorted(RENDERERS)}")
+        key = (version, fmt, None if route_ids is None else tuple(sorted(route_ids)), zoom, markers)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        routes = load_plan().get('optimized_routes', [])
+        if route_ids is not None:
+            wanted = set(route_ids)
+            routes = [route for route in routes if route.get('route_id') in wanted]
+        rendered = RENDERERS[fmt](routes, zoom, markers)
+
+        with self._lock:
+            self._entries[key] = rendered
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return rendered
+
+
+# Shared cache for the rendering endpoint
+route_render_cache = RouteRenderCache(max_entries=int(os.environ.get('ROUTE_RENDER_CACHE_SIZE', 256)))
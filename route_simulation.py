@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Discrete-event replay of a day of operations against the route optimizer
+
+    python route_simulation.py 2026-10-12 [--strategy static insert batch] [--interval 30 60]
+
+Trucks drive optimized routes at the optimizer's average speed and serve each
+stop for its service time; requests appear at their historical creation time
+and are handled by the chosen re-optimization strategy. Each run reports
+distance, lateness and truck utilization, so strategies and parameters can be
+swept offline.
+"""
+
+import copy
+import heapq
+import itertools
+import time
+import numpy as np
+from datetime import date
+from typing import List, Dict, Tuple
+from distance_matrix import haversine_distance
+from stop_array import to_minutes
+
+STRATEGIES = ('static', 'insert', 'batch', 'insert+batch')
+
+# Event kinds, in the order they are handled when due at the same minute
+RELEASE, REOPTIMIZE, READY = 0, 1, 2
+
+
+class _Truck:
+    __slots__ = ('vehicle', 'home', 'position', 'free_at', 'idle', 'distance', 'busy', 'stops', 'load',
+                 'finished_at')
+
+    def __init__(self, vehicle: Dict, home: Dict, start: float):
+        self.vehicle = vehicle
+        self.home = home
+        self.position = home
+        self.free_at = start
+        self.idle = True
+        self.distance = 0.0
+        self.busy = 0.0  # minutes driving or serving
+        self.stops = 0
+        self.load = 0.0  # demand collected so far
+        self.finished_at = start
+
+
+class RouteSimulator:
+    """Replays requests against a RouteOptimizer under one re-optimization strategy
+
+    Strategies: 'static' plans once at shift start and misses later requests;
+    'insert' adds each new request to the live plan by cheapest insertion;
+    'batch' re-plans everything not yet driven to every `reoptimize_interval`
+    minutes; 'insert+batch' does both. Trucks commit to their next stop when
+    they leave the previous one, so re-plans never divert a truck mid-leg.
+    """
+
+    def __init__(self, optimizer=None, strategy: str = 'insert', reoptimize_interval: float = 60,
+                 constraints: Dict = None, shift_start='07:00', shift_end='19:00',
+                 time_window_slack: float = 60, return_to_depot: bool = True):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy '{strategy}', expected one of {STRATEGIES}")
+        if optimizer is None:
+            from ai_route_optimization import RouteOptimizer
+            optimizer = RouteOptimizer(local_search_time_limit=0.2)
+        self.optimizer = optimizer
+        self.strategy = strategy
+        self.reoptimize_interval = reoptimize_interval
+        # With constraints every plan is a CVRPTW; without, the clustering planner is used
+        self.constraints = constraints
+        self.shift = (to_minutes(shift_start), to_minutes(shift_end))
+        self.time_window_slack = time_window_slack
+        self.return_to_depot = return_to_depot
+
+    def _travel_minutes(self, distance_km: float) -> float:
+        return distance_km / self.optimizer.avg_speed_kmh * 60
+
+    def _constraints_at(self, now: float) -> Dict:
+        if self.constraints is None:
+            return None
+        return dict(self.constraints, shift_start=now, shift_end=self.shift[1],
+                    time_window_slack=self.time_window_slack)
+
+    def _remaining_capacity(self, truck: _Truck) -> float:
+        default = self.constraints.get('vehicle_capacity', 10)
+        return max(0.0, self.optimizer._parse_capacity(truck.vehicle.get('capacity'), default) - truck.load)
+
+    def _plan(self, now: float, requests: List[Dict], trucks: List[_Truck]) -> Tuple[Dict, List[Dict]]:
+        """Plan `requests` from every truck's next free position; returns the plan and what it left out"""
+        vehicles = [dict(t.vehicle, depot=t.position) for t in trucks]
+        if self.constraints is not None:
+            # Trucks are not emptied during the shift: plan with what is left of each capacity
+            for vehicle, truck in zip(vehicles, trucks):
+                vehicle['capacity'] = self._remaining_capacity(truck)
+        plan = self.optimizer.optimize_routes(requests, vehicles, self._constraints_at(now)) if requests else {}
+        routes = {route['vehicle_id']: route for route in plan.get('optimized_routes', [])}
+
+        # One route per truck, empty ones included, so insertion can use idle trucks
+        plan['optimized_routes'] = []
+        for vehicle, truck in zip(vehicles, trucks):
+            route = routes.get(vehicle['id']) or {
+                'vehicle_id': vehicle['id'], 'requests': [],
+                'total_distance': 0.0, 'estimated_time': 0.0, 'efficiency_score': 0.0
+            }
+            if self.constraints is not None and 'capacity' not in route:
+                route.update(capacity=vehicle['capacity'], load=0)
+            route['depot'] = truck.position
+            plan['optimized_routes'].append(route)
+        plan['constraints'] = self._constraints_at(now)
+        return plan, plan.pop('unassigned_requests', [])
+
+    def run(self, requests: List[Dict], vehicles: List[Dict]) -> Dict:
+        """Simulate one shift; requests carry 'created_at' (minutes, time or datetime) as release time"""
+        started = time.perf_counter()
+        shift_start, shift_end = self.shift
+        release = {id(req): self._release_minute(req) for req in requests}
+
+        trucks = [_Truck(v, self.optimizer._vehicle_depot(v), shift_start) for v in vehicles]
+        known = [req for req in requests if release[id(req)] <= shift_start]
+        optimizer_seconds = 0.0
+
+        tick = time.perf_counter()
+        plan, pending = self._plan(shift_start, known, trucks)
+        optimizer_seconds += time.perf_counter() - tick
+        reoptimizations = 1
+
+        events, sequence = [], itertools.count()
+        for req in requests:
+            if release[id(req)] > shift_start:
+                heapq.heappush(events, (release[id(req)], RELEASE, next(sequence), req))
+        if self.strategy in ('batch', 'insert+batch'):
+            for minute in np.arange(shift_start + self.reoptimize_interval, shift_end, self.reoptimize_interval):
+                heapq.heappush(events, (float(minute), REOPTIMIZE, next(sequence), None))
+        for k in range(len(trucks)):
+            heapq.heappush(events, (shift_start, READY, next(sequence), k))
+
+        missed, lateness = [], []
+        while events:
+            now, kind, _, payload = heapq.heappop(events)
+
+            if kind == READY:
+                truck, route = trucks[payload], plan['optimized_routes'][payload]
+                if now >= shift_end or not route['requests']:
+                    truck.idle = True
+                    continue
+                req = route['requests'].pop(0)
+                leg = float(haversine_distance(truck.position['latitude'], truck.position['longitude'],
+                                               req['latitude'], req['longitude']))
+                arrival = now + self._travel_minutes(leg)
+                window = self.optimizer._time_window(req, self.shift, self.time_window_slack)
+                begin = max(arrival, window[0])
+                service = req.get('service_minutes', self.optimizer.service_time_hours * 60)
+                demand = req.get('demand', (self.constraints or {}).get('default_demand', 1))
+                lateness.append(max(0.0, begin - window[1]))
+
+                truck.position = {'latitude': req['latitude'], 'longitude': req['longitude']}
+                truck.free_at = begin + service
+                truck.distance += leg
+                truck.busy += arrival - now + service
+                truck.stops += 1
+                truck.load += demand
+                truck.idle = False
+                route['depot'] = truck.position
+                heapq.heappush(events, (truck.free_at, READY, next(sequence), payload))
+                continue
+
+            if kind == RELEASE:
+                if self.strategy == 'static':
+                    missed.append(payload)
+                    continue
+                if self.strategy == 'batch':
+                    pending.append(payload)
+                    continue
+                tick = time.perf_counter()
+                plan['constraints'] = self._constraints_at(now)
+                self.optimizer.insert_request(plan, payload)
+                pending.extend(plan.pop('unassigned_requests', []))
+                optimizer_seconds += time.perf_counter() - tick
+
+            elif kind == REOPTIMIZE:
+                remaining = [req for route in plan['optimized_routes'] for req in route['requests']] + pending
+                tick = time.perf_counter()
+                plan, pending = self._plan(now, remaining, trucks)
+                optimizer_seconds += time.perf_counter() - tick
+                reoptimizations += 1
+
+            # New work may wake idle trucks
+            for k, truck in enumerate(trucks):
+                if truck.idle and plan['optimized_routes'][k]['requests']:
+                    truck.idle = False
+                    heapq.heappush(events, (max(now, truck.free_at), READY, next(sequence), k))
+
+        missed += pending + [req for route in plan['optimized_routes'] for req in route['requests']]
+        return self._report(requests, trucks, missed, lateness, reoptimizations, optimizer_seconds, started)
+
+    def _release_minute(self, request: Dict) -> float:
+        created = request.get('created_at')
+        if created is None:
+            return self.shift[0]
+        return to_minutes(created)
+
+    def _report(self, requests: List[Dict], trucks: List[_Truck], missed: List[Dict], lateness: List[float],
+                reoptimizations: int, optimizer_seconds: float, started: float) -> Dict:
+        shift_start, shift_end = self.shift
+        overtime = 0.0
+        for truck in trucks:
+            truck.finished_at = truck.free_at
+            if self.return_to_depot and truck.stops:
+                back = float(haversine_distance(truck.position['latitude'], truck.position['longitude'],
+                                                truck.home['latitude'], truck.home['longitude']))
+                truck.distance += back
+                truck.busy += self._travel_minutes(back)
+                truck.finished_at += self._travel_minutes(back)
+            overtime += max(0.0, truck.finished_at - shift_end)
+
+        lateness = np.asarray(lateness, dtype=float)
+        shift_minutes = shift_end - shift_start
+        utilization = {t.vehicle['id']: t.busy / shift_minutes for t in trucks}
+        return {
+            'strategy': self.strategy,
+            'reoptimize_interval': self.reoptimize_interval if 'batch' in self.strategy else None,
+            'requests': len(requests),
+            'served': int(len(lateness)),
+            'missed': len(missed),
+            'missed_request_ids': [req.get('id') for req in missed],
+            'total_distance': sum(t.distance for t in trucks),
+            'late_stops': int((lateness > 0).sum()),
+            'total_lateness_minutes': float(lateness.sum()),
+            'max_lateness_minutes': float(lateness.max()) if len(lateness) else 0.0,
+            'average_utilization': float(np.mean(list(utilization.values()))) if trucks else 0.0,
+            'vehicle_utilization': utilization,
+            'overtime_minutes': overtime,
+            'reoptimizations': reoptimizations,
+            'optimizer_seconds': optimizer_seconds,
+            'wall_time': time.perf_counter() - started
+        }
+
+
+def sweep(requests: List[Dict], vehicles: List[Dict], configurations: List[Dict], optimizer=None) -> List[Dict]:
+    """Run the same day under several RouteSimulator configurations"""
+    results = []
+    for configuration in configurations:
+        simulator = RouteSimulator(optimizer=optimizer, **configuration)
+        # Plans edit request lists in place; every run starts from its own copy
+        results.append(simulator.run(copy.deepcopy(requests), vehicles))
+    return results
+
+
+def load_day(day: date, department_id: int = None) -> Tuple[List[Dict], List[Dict]]:
+    """A historical day's requests and fleet from the database (call inside an app context)
+
+    Requests scheduled for `day` with a geocoded customer; those created during
+    the day are released at their creation time, earlier ones at shift start.
+    """
+    from models import db, ServiceRequest, Customer, Schedule, Vehicle
+    from optimization_jobs import with_department_depots
+
+    query = db.session.query(ServiceRequest.id, ServiceRequest.customer_id, ServiceRequest.created_at,
+                             Customer.latitude, Customer.longitude, Schedule.scheduled_time) \
+        .join(Customer, Customer.id == ServiceRequest.customer_id) \
+        .outerjoin(Schedule, Schedule.request_id == ServiceRequest.id) \
+        .filter(ServiceRequest.scheduled_date == day, Customer.latitude.isnot(None))
+    if department_id is not None:
+        query = query.filter(ServiceRequest.department_id == department_id)
+
+    requests, seen = [], set()
+    for request_id, customer_id, created_at, latitude, longitude, scheduled_time in query:
+        if request_id in seen:
+            continue
+        seen.add(request_id)
+        request = {'id': request_id, 'customer_id': customer_id, 'latitude': latitude, 'longitude': longitude}
+        if created_at is not None and created_at.date() == day:
+            request['created_at'] = created_at
+        if scheduled_time is not None:
+            request['scheduled_time'] = scheduled_time
+        requests.append(request)
+
+    vehicles_query = Vehicle.query.filter(Vehicle.status != 'out_of_service')
+    if department_id is not None:
+        vehicles_query = vehicles_query.filter(Vehicle.department_id == department_id)
+    vehicles = [{'id': v.id, 'vehicle_type': v.vehicle_type, 'capacity': v.capacity, 'department_id': v.department_id}
+                for v in vehicles_query.all()]
+    return requests, with_department_depots(vehicles)
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Replay a day of operations under routing strategies')
+    parser.add_argument('day', type=date.fromisoformat)
+    parser.add_argument('--department', type=int)
+    parser.add_argument('--strategy', nargs='+', choices=STRATEGIES, default=list(STRATEGIES))
+    parser.add_argument('--interval', nargs='+', type=float, default=[60], help='batch re-plan interval(s) in minutes')
+    parser.add_argument('--constrained', action='store_true', help='plan with capacities and time windows')
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        requests, vehicles = load_day(args.day, args.department)
+    configurations = [{'strategy': strategy, 'reoptimize_interval': interval,
+                       'constraints': {} if args.constrained else None}
+                      for strategy in args.strategy
+                      for interval in (args.interval if 'batch' in strategy else args.interval[:1])]
+    for result in sweep(requests, vehicles, configurations):
+        result.pop('missed_request_ids')
+        print(json.dumps(result, default=str))
@@ -0,0 +1,115 @@
+"""
+Bring an existing database up to the current models
+
+    python schema_upgrade.py
+
+`db.create_all()` creates missing tables but never touches existing ones, so
+columns and indexes added to a model since the database was created are added
+here with ALTER TABLE / CREATE INDEX. init_database() runs it on every start;
+it is a no-op on an up-to-date database.
+"""
+
+from typing import List
+from sqlalchemy import inspect
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from models import db
+
+# Columns whose existing rows have to be recomputed once the column is added, and unique
+# indexes whose existing rows may hold duplicates; the rollup rebuild fixes both
+REBUILT_BY_ROLLUP = {'service_metrics.response_hours_total', 'service_metrics.responded_requests',
+                     'service_metrics.rating_total', 'service_metrics.ratings',
+                     'service_metrics.uq_service_metrics_day'}
+
+
+def _column_ddl(column, dialect) -> str:
+    preparer = dialect.identifier_preparer
+    ddl = f"{preparer.format_column(column)} {column.type.compile(dialect=dialect)}"
+    default = column.default
+    if default is not None and default.is_scalar:
+        # Existing rows take the default instead of NULL
+        literal = column.type.literal_processor(dialect)
+        ddl += f" DEFAULT {literal(default.arg) if literal else repr(default.arg)}"
+    elif not column.nullable:
+        raise ValueError(f"Cannot add NOT NULL column {column.table.name}.{column.name} without a default")
+    return ddl
+
+
+def _add_column(connection, table, column):
+    dialect = connection.dialect
+    try:
+        connection.exec_driver_sql(f"ALTER TABLE {dialect.identifier_preparer.format_table(table)} "
+                                   f"ADD COLUMN {_column_ddl(column, dialect)}")
+    except (OperationalError, ProgrammingError):
+        # Another worker starting at the same time may have added it first
+        connection.rollback()
+        if column.name not in {c['name'] for c in inspect(connection).get_columns(table.name)}:
+            raise
+
+
+def _index_names(connection, inspector, table) -> set:
+    if connection.dialect.name == 'sqlite':
+        # SQLite reflection leaves out expression indexes
+        return set(connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", (table.name,)).scalars())
+    return {index['name'] for index in inspector.get_indexes(table.name)}
+
+
+def _create_index(connection, inspector, index):
+    try:
+        index.create(connection)
+    except (OperationalError, ProgrammingError):
+        # Another worker starting at the same time may have created it first
+        connection.rollback()
+        inspector.clear_cache()
+        if index.name not in _index_names(connection, inspector, index.table):
+            raise
+
+
+def _rebuild_rollup():
+    # Running sums of rows written before they existed start at zero, and rows written before
+    # the unique index may repeat a department-day; rebuild them from the facts
+    from metrics_rollup import backfill
+    backfill()
+
+
+def upgrade_schema() -> List[str]:
+    """Add the model columns and indexes missing from existing tables; returns the 'table.column'
+    (or 'table.index') names added"""
+    added = []
+    rebuilt = False
+    with db.engine.connect() as connection:
+        inspector = inspect(connection)
+        for table in db.metadata.tables.values():
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    _add_column(connection, table, column)
+                    connection.commit()
+                    added.append(f"{table.name}.{column.name}")
+            indexes = _index_names(connection, inspector, table)
+            for index in table.indexes:
+                if index.name in indexes:
+                    continue
+                name = f"{table.name}.{index.name}"
+                if name in REBUILT_BY_ROLLUP and not rebuilt:
+                    connection.commit()
+                    _rebuild_rollup()
+                    rebuilt = True
+                _create_index(connection, inspector, index)
+                connection.commit()
+                added.append(name)
+
+    if REBUILT_BY_ROLLUP & set(added) and not rebuilt:
+        _rebuild_rollup()
+    return added
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        db.create_all()
+        added = upgrade_schema()
+        print('\n'.join(f"added {name}" for name in added) or 'schema is up to date')
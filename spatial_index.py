@@ -0,0 +1,134 @@
+import heapq
+import numpy as np
+from typing import List
+from distance_matrix import to_unit_vectors
+
+
+class StopIndex:
+    """KD-tree over stop coordinates that supports removing visited stops
+
+    Points live on the unit sphere, so the nearest point by chord length is also
+    the nearest by great-circle distance. Each node keeps a count of the stops
+    still present below it, letting queries skip emptied subtrees.
+    """
+
+    LEAF_SIZE = 16
+
+    def __init__(self, coordinates, leaf_size: int = None):
+        self.points = to_unit_vectors(coordinates)
+        self.leaf_size = leaf_size or self.LEAF_SIZE
+        n = len(self.points)
+
+        self.alive = np.ones(n, dtype=bool)
+        self.order = np.arange(n)
+        self.leaf_of = np.zeros(n, dtype=int)
+
+        # Flat node arrays: point range, bounding box, children, parent and live count
+        self.start, self.end, self.low, self.high = [], [], [], []
+        self.left, self.right, self.parent, self.count = [], [], [], []
+        if n:
+            self._build()
+
+    def __len__(self) -> int:
+        return self.count[0] if self.count else 0
+
+    def _add_node(self, start: int, end: int, parent: int) -> int:
+        box = self.points[self.order[start:end]]
+        self.start.append(start)
+        self.end.append(end)
+        self.low.append(box.min(axis=0))
+        self.high.append(box.max(axis=0))
+        self.left.append(-1)
+        self.right.append(-1)
+        self.parent.append(parent)
+        self.count.append(end - start)
+        return len(self.start) - 1
+
+    def _build(self):
+        stack = [self._add_node(0, len(self.points), -1)]
+        while stack:
+            node = stack.pop()
+            start, end = self.start[node], self.end[node]
+            if end - start <= self.leaf_size:
+                self.leaf_of[self.order[start:end]] = node
+                continue
+
+            # Split on the widest dimension at the median
+            dim = int(np.argmax(self.high[node] - self.low[node]))
+            segment = self.order[start:end]
+            mid = (end - start) // 2
+            self.order[start:end] = segment[np.argpartition(self.points[segment, dim], mid)]
+
+            self.left[node] = self._add_node(start, start + mid, node)
+            self.right[node] = self._add_node(start + mid, end, node)
+            stack.extend((self.left[node], self.right[node]))
+
+        # Plain tuples: per-node box checks are too small to benefit from NumPy
+        self.low = [tuple(map(float, box)) for box in self.low]
+        self.high = [tuple(map(float, box)) for box in self.high]
+
+    def remove(self, index: int):
+        """Remove a stop so it is no longer returned by nearest()"""
+        if not self.alive[index]:
+            return
+        self.alive[index] = False
+        node = self.leaf_of[index]
+        while node != -1:
+            self.count[node] -= 1
+            node = self.parent[node]
+
+    def _box_distance(self, node: int, point) -> float:
+        total = 0.0
+        for value, low, high in zip(point, self.low[node], self.high[node]):
+            if value < low:
+                total += (low - value) ** 2
+            elif value > high:
+                total += (value - high) ** 2
+        return total
+
+    def nearest(self, coordinate) -> int:
+        """Index of the nearest stop (to a lat/lon pair) still in the index, or -1 when it is empty"""
+        return self._nearest_point(to_unit_vectors(coordinate)[0])
+
+    def _nearest_point(self, point: np.ndarray) -> int:
+        if not self.count or self.count[0] == 0:
+            return -1
+
+        best, best_distance = -1, np.inf
+        coordinates = tuple(map(float, point))
+        heap = [(0.0, 0)]
+
+        while heap:
+            bound, node = heapq.heappop(heap)
+            if bound >= best_distance:
+                break
+            if self.count[node] == 0:
+                continue
+
+            if self.left[node] == -1:
+                members = self.order[self.start[node]:self.end[node]]
+                members = members[self.alive[members]]
+                offsets = self.points[members] - point
+                distances = np.einsum('ij,ij->i', offsets, offsets)
+                k = int(np.argmin(distances))
+                if distances[k] < best_distance:
+                    best, best_distance = int(members[k]), float(distances[k])
+                continue
+
+            for child in (self.left[node], self.right[node]):
+                if self.count[child]:
+                    child_bound = self._box_distance(child, coordinates)
+                    if child_bound < best_distance:
+                        heapq.heappush(heap, (child_bound, child))
+
+        return best
+
+    def nearest_neighbor_tour(self, start_coordinate) -> List[int]:
+        """Greedy tour from a lat/lon start point, removing every stop as it is visited"""
+        tour = []
+        stop = self.nearest(start_coordinate)
+        while stop != -1:
+            self.remove(stop)
+            tour.append(stop)
+            stop = self._nearest_point(self.points[stop])
+        return tour
@@ -0,0 +1,49 @@
+// Draws an optimization job's routes on a Leaflet map from the render endpoint
+
+// Decode an encoded polyline into [lat, lng] pairs
+function decodePolyline(encoded, precision) {
+    const factor = Math.pow(10, precision || 5);
+    const points = [];
+    let index = 0, lat = 0, lng = 0;
+
+    while (index < encoded.length) {
+        const deltas = [];
+        for (let k = 0; k < 2; k++) {
+            let result = 0, shift = 0, byte;
+            do {
+                byte = encoded.charCodeAt(index++) - 63;
+                result |= (byte & 0x1f) << shift;
+                shift += 5;
+            } while (byte >= 0x20);
+            deltas.push(result & 1 ? ~(result >> 1) : result >> 1);
+        }
+        lat += deltas[0];
+        lng += deltas[1];
+        points.push([lat / factor, lng / factor]);
+    }
+    return points;
+}
+
+function loadRouteOverlay(map, jobId) {
+    return fetch(`/api/routes/optimize/${jobId}/render?zoom=${map.getZoom()}`)
+        .then(response => response.json())
+        .then(data => {
+            if (!data.routes) return data;
+            const bounds = [];
+            data.routes.forEach(route => {
+                const path = decodePolyline(route.polyline, data.precision);
+                L.polyline(path, {weight: 3, opacity: 0.8})
+                    .bindPopup(`Route ${route.route_id + 1}: ${route.stops} stops, ${route.total_distance.toFixed(1)} km`)
+                    .addTo(map);
+                (route.markers || []).forEach(marker => {
+                    L.circleMarker([marker.latitude, marker.longitude], {radius: marker.count > 1 ? 8 : 4})
+                        .bindPopup(marker.count > 1 ? `${marker.count} stops` : `Stop ${marker.stop + 1}`)
+                        .addTo(map);
+                });
+                bounds.push(...path);
+            });
+            if (bounds.length) map.fitBounds(bounds);
+            return data;
+        })
+        .catch(error => console.error('Error loading route overlay:', error));
+}
@@ -0,0 +1,81 @@
+import numpy as np
+from datetime import datetime
+from typing import List, Dict
+
+# Ids that are absent (or not integers) are stored as this value
+MISSING_ID = -1
+
+# One record per stop. NaN means "not given" so the optimizer's defaults apply; times
+# are minutes from midnight. 72 bytes a stop, against several hundred for a request dict.
+STOP_DTYPE = np.dtype([
+    ('id', np.int64),
+    ('customer_id', np.int64),
+    ('latitude', np.float64),
+    ('longitude', np.float64),
+    ('demand', np.float64),
+    ('service_minutes', np.float64),
+    ('window_start', np.float64),
+    ('window_end', np.float64),
+    ('scheduled', np.float64)
+])
+
+
+def to_minutes(value) -> float:
+    """Minutes from midnight for 'HH:MM' strings, time/datetime objects or plain minutes"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.strptime(value[:5], '%H:%M')
+    return value.hour * 60 + value.minute + value.second / 60
+
+
+def make_stops(latitude, longitude, ids=None, **fields) -> np.ndarray:
+    """Stop array from column arrays; other STOP_DTYPE fields may be passed by name"""
+    latitude = np.asarray(latitude, dtype=float)
+    stops = np.empty(len(latitude), dtype=STOP_DTYPE)
+    stops['id'] = np.arange(len(latitude)) if ids is None else ids
+    stops['customer_id'] = MISSING_ID
+    stops['latitude'] = latitude
+    stops['longitude'] = longitude
+    for name in ('demand', 'service_minutes', 'window_start', 'window_end', 'scheduled'):
+        stops[name] = np.nan
+    for name, values in fields.items():
+        stops[name] = values
+    return stops
+
+
+def _int_or_missing(value) -> int:
+    return value if isinstance(value, (int, np.integer)) and not isinstance(value, bool) else MISSING_ID
+
+
+def _float_or_nan(value) -> float:
+    return np.nan if value is None else float(value)
+
+
+def _minutes_or_nan(value) -> float:
+    minutes = to_minutes(value)
+    return np.nan if minutes is None else minutes
+
+
+def stops_from_requests(requests: List[Dict]) -> np.ndarray:
+    """Stop array from request dicts (the dict API), reading each dict exactly once"""
+    stops = np.empty(len(requests), dtype=STOP_DTYPE)
+    stops[:] = [(
+        _int_or_missing(req.get('id')),
+        _int_or_missing(req.get('customer_id')),
+        req['latitude'],
+        req['longitude'],
+        _float_or_nan(req.get('demand')),
+        _float_or_nan(req.get('service_minutes')),
+        _minutes_or_nan(req.get('time_window_start')),
+        _minutes_or_nan(req.get('time_window_end')),
+        _minutes_or_nan(req.get('scheduled_time'))
+    ) for req in requests]
+    return stops
+
+
+def stop_coordinates(stops: np.ndarray) -> np.ndarray:
+    """(n, 2) latitude/longitude array of a stop array"""
+    return np.column_stack([stops['latitude'], stops['longitude']]).astype(float)
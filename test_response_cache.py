@@ -0,0 +1,45 @@
+from datetime import datetime
+from flask import Flask, jsonify
+from flask_login import LoginManager
+from models import db, Customer, ServiceRequest, ServiceMetrics
+from metrics_rollup import rollup_summary
+from response_cache import response_cache
+
+
+def test_rollup_upsert_invalidates_cached_metrics(tmp_path):
+    """Requests reach ServiceMetrics only through the rollup upsert, which must still retire cached responses"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'app.db'}"
+    app.config['RESPONSE_CACHE_PATH'] = str(tmp_path / 'response_cache.db')
+    db.init_app(app)
+    LoginManager(app).user_loader(lambda user_id: None)
+    response_cache.init_app(app)
+
+    @app.route('/metrics')
+    @response_cache.cached(models=(ServiceMetrics,))
+    def metrics():
+        return jsonify(rollup_summary())
+
+    with app.app_context():
+        db.create_all()
+        customer = Customer(name='Test Customer', email='customer@example.com', address='1 Main St')
+        db.session.add(customer)
+        db.session.commit()
+
+        client = app.test_client()
+        assert client.get('/metrics').headers['X-Cache'] == 'MISS'
+        assert client.get('/metrics').headers['X-Cache'] == 'HIT'
+
+        service_request = ServiceRequest(customer_id=customer.id, service_type='residential')
+        db.session.add(service_request)
+        db.session.commit()
+        response = client.get('/metrics')
+        assert response.headers['X-Cache'] == 'MISS'
+        assert response.get_json()['total_requests'] == 1
+
+        service_request.status = 'completed'
+        service_request.completed_at = datetime.utcnow()
+        db.session.commit()
+        response = client.get('/metrics')
+        assert response.headers['X-Cache'] == 'MISS'
+        assert response.get_json()['completed_requests'] == 1
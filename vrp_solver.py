@@ -0,0 +1,364 @@
+import numpy as np
+import time
+from scipy.spatial import cKDTree
+from typing import List, Dict, Tuple
+from distance_matrix import DistanceMatrix, haversine_distance, to_unit_vectors
+from route_local_search import improve_route
+
+# Moves must save more than this (km) to be applied
+IMPROVEMENT_EPSILON = 1e-9
+
+
+class _Route:
+    """A vehicle route as an ordered list of stop indices plus its cached schedule"""
+    __slots__ = ('stops', 'load', 'capacity', 'vehicle_index', 'legs', 'finish', 'latest',
+                 'construction_distance')
+
+    def __init__(self, stops: List[int], load: float):
+        self.stops = stops
+        self.load = load
+        self.capacity = None
+        self.vehicle_index = None
+        self.legs = None  # leg distances (km) along depot -> stops
+        self.finish = None  # service end time (minutes) at every stop
+        self.latest = None  # latest feasible arrival (minutes) at every stop
+        self.construction_distance = None
+
+    @property
+    def distance(self) -> float:
+        return float(self.legs.sum())
+
+
+class VRPTWSolver:
+    """Capacitated vehicle routing with time windows
+
+    Routes are built with the Clarke-Wright savings heuristic (first over each
+    stop's nearest neighbours, then over route end points until the fleet size is
+    met), assigned to vehicles by capacity, and improved by inter-route relocation
+    and intra-route 2-opt / Or-opt within a wall-clock budget. All times are
+    minutes from midnight; every route leaves the depot at shift start.
+    """
+
+    def __init__(self, depot: Dict, avg_speed_kmh: float = 30, neighbors: int = 20,
+                 time_limit: float = 10.0, local_search_iterations: int = 1000):
+        self.depot = np.array([depot['latitude'], depot['longitude']], dtype=float)
+        self.avg_speed_kmh = avg_speed_kmh
+        self.neighbors = neighbors
+        self.time_limit = time_limit
+        self.local_search_iterations = local_search_iterations
+
+    def solve(self, coordinates: np.ndarray, demands: np.ndarray, time_windows: np.ndarray,
+              service_minutes: np.ndarray, capacities: List[float], shift: Tuple[float, float]) -> Dict:
+        """Solve one instance; returns routes as stop-index lists plus unassigned stops"""
+        self._started = time.perf_counter()
+        self._deadline = self._started + self.time_limit
+        self.coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+        self.demands = np.asarray(demands, dtype=float)
+        self.windows = np.asarray(time_windows, dtype=float).reshape(-1, 2)
+        self.service = np.asarray(service_minutes, dtype=float)
+        self.shift_start, self.shift_end = shift
+        self.depot_km = haversine_distance(self.depot[0], self.depot[1],
+                                           self.coordinates[:, 0], self.coordinates[:, 1])
+
+        # Nearest neighbours bound both the savings list and the relocation targets
+        n = len(self.coordinates)
+        k = min(self.neighbors + 1, n)
+        points = to_unit_vectors(self.coordinates)
+        self._neighbors = cKDTree(points).query(points, k=k)[1].reshape(n, k)[:, 1:]
+
+        routes, unassigned = self._savings_construction(capacities)
+        routes, leftover = self._assign_vehicles(routes, capacities)
+        self._route_of = np.full(n, -1)
+        for index, route in enumerate(routes):
+            self._route_of[route.stops] = index
+
+        unassigned = self._insert_unassigned(routes, unassigned + leftover)
+        for route in routes:
+            route.construction_distance = route.distance
+
+        relocations = self._relocate_pass(routes)
+        self._improve_routes(routes)
+
+        return {
+            'routes': [{
+                'vehicle_index': route.vehicle_index,
+                'stops': list(route.stops),
+                'load': route.load,
+                'capacity': route.capacity,
+                'arrival_times': self._arrival_times(route),
+                'finish_time': float(route.finish[-1]),
+                'distance': route.distance,
+                'construction_distance': route.construction_distance
+            } for route in routes if route.stops],
+            'unassigned': sorted(unassigned),
+            'relocations': relocations,
+            'elapsed': time.perf_counter() - self._started
+        }
+
+    def _out_of_time(self) -> bool:
+        return time.perf_counter() >= self._deadline
+
+    def _travel_minutes(self, km):
+        return km / self.avg_speed_kmh * 60
+
+    def _arrival_times(self, route: _Route) -> List[float]:
+        previous = np.concatenate([[self.shift_start], route.finish[:-1]])
+        return (previous + self._travel_minutes(route.legs)).tolist()
+
+    def _schedule(self, route: _Route) -> bool:
+        """Refresh the route's legs, finish and latest-arrival arrays; returns feasibility"""
+        stops = route.stops
+        points = np.vstack([self.depot, self.coordinates[stops]])
+        route.legs = haversine_distance(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1])
+        travel = self._travel_minutes(route.legs)
+        finish = np.empty(len(stops))
+        latest = np.empty(len(stops))
+
+        clock = self.shift_start
+        for k, stop in enumerate(stops):
+            clock = max(clock + travel[k], self.windows[stop, 0]) + self.service[stop]
+            finish[k] = clock
+
+        # Latest arrival at each stop that keeps the rest of the route on time
+        bound = self.shift_end
+        for k in range(len(stops) - 1, -1, -1):
+            stop = stops[k]
+            bound = min(self.windows[stop, 1], bound - self.service[stop])
+            latest[k] = bound
+            bound -= travel[k]
+
+        route.finish = finish
+        route.latest = latest
+        starts = finish - self.service[stops]
+        return bool(np.all(starts <= latest + 1e-9))
+
+    def _merge(self, left: _Route, right: _Route):
+        left.stops.extend(right.stops)
+        left.load += right.load
+        self._schedule(left)
+
+    def _savings_construction(self, capacities: List[float]) -> Tuple[List[_Route], List[int]]:
+        """Merge single-stop routes by descending savings while capacity and windows allow"""
+        n = len(self.coordinates)
+        max_capacity = max(capacities) if capacities else 0
+        arrival = self.shift_start + self._travel_minutes(self.depot_km)
+        start = np.maximum(arrival, self.windows[:, 0])
+        feasible = ((start <= self.windows[:, 1]) & (start + self.service <= self.shift_end)
+                    & (self.demands <= max_capacity))
+
+        routes = {}
+        route_of = np.full(n, -1)
+        for i in np.flatnonzero(feasible):
+            route = _Route([int(i)], float(self.demands[i]))
+            self._schedule(route)
+            routes[int(i)] = route
+            route_of[i] = i
+        unassigned = np.flatnonzero(~feasible).tolist()
+
+        # Savings of appending the route starting at j to the route ending at i (open routes)
+        first = np.repeat(np.arange(n), self._neighbors.shape[1])
+        second = self._neighbors.ravel()
+        pair_km = haversine_distance(self.coordinates[first, 0], self.coordinates[first, 1],
+                                     self.coordinates[second, 0], self.coordinates[second, 1])
+        savings = self.depot_km[second] - pair_km
+        candidates = (savings > 0) & feasible[first] & feasible[second] & (first != second)
+
+        for p in np.flatnonzero(candidates)[np.argsort(-savings[candidates], kind='stable')]:
+            if self._out_of_time():
+                break
+            i, j = int(first[p]), int(second[p])
+            a, b = route_of[i], route_of[j]
+            if a == b:
+                continue
+            left, right = routes[a], routes[b]
+            if left.stops[-1] != i or right.stops[0] != j or left.load + right.load > max_capacity:
+                continue
+            if left.finish[-1] + self._travel_minutes(pair_km[p]) > right.latest[0]:
+                continue
+            self._merge(left, right)
+            route_of[right.stops] = a
+            del routes[b]
+
+        return self._merge_route_ends(list(routes.values()), len(capacities), max_capacity), unassigned
+
+    def _merge_route_ends(self, routes: List[_Route], fleet_size: int, max_capacity: float) -> List[_Route]:
+        """Savings rounds over whole-route end points, down to the fleet size if needed"""
+        while len(routes) > 1 and not self._out_of_time():
+            firsts = [route.stops[0] for route in routes]
+            ends = self.coordinates[[route.stops[-1] for route in routes]]
+            starts = self.coordinates[firsts]
+            gap_km = haversine_distance(ends[:, 0, None], ends[:, 1, None], starts[None, :, 0], starts[None, :, 1])
+            savings = self.depot_km[firsts][None, :] - gap_km
+
+            loads = np.array([route.load for route in routes])
+            finish = np.array([route.finish[-1] for route in routes])
+            latest = np.array([route.latest[0] for route in routes])
+            feasible = ((loads[:, None] + loads[None, :] <= max_capacity)
+                        & (finish[:, None] + self._travel_minutes(gap_km) <= latest[None, :]))
+            np.fill_diagonal(feasible, False)
+            # Unprofitable merges are only taken while there are more routes than vehicles
+            excess = len(routes) - fleet_size
+            if excess <= 0:
+                feasible &= savings > 0
+
+            left_index, right_index = np.nonzero(feasible)
+            if len(left_index) == 0:
+                break
+
+            touched = set()
+            merged = set()
+            for p in np.argsort(-savings[left_index, right_index], kind='stable'):
+                a, b = int(left_index[p]), int(right_index[p])
+                if a in touched or b in touched:
+                    continue
+                if savings[a, b] <= 0 and len(merged) >= excess:
+                    break
+                self._merge(routes[a], routes[b])
+                touched.update((a, b))
+                merged.add(b)
+
+            if not merged:
+                break
+            routes = [route for index, route in enumerate(routes) if index not in merged]
+
+        return routes
+
+    def _assign_vehicles(self, routes: List[_Route], capacities: List[float]) -> Tuple[List[_Route], List[int]]:
+        """Best-fit the heaviest routes onto the smallest vehicle that can carry them"""
+        free = sorted(range(len(capacities)), key=lambda v: capacities[v])
+        assigned = []
+        leftover = []
+
+        for route in sorted(routes, key=lambda r: (-r.load, r.stops[0])):
+            vehicle = next((v for v in free if capacities[v] >= route.load), None)
+            if vehicle is None:
+                leftover.extend(route.stops)
+                continue
+            free.remove(vehicle)
+            route.vehicle_index = vehicle
+            route.capacity = capacities[vehicle]
+            assigned.append(route)
+
+        # Idle vehicles get empty routes so unassigned stops can still be inserted
+        for vehicle in free:
+            route = _Route([], 0.0)
+            route.vehicle_index = vehicle
+            route.capacity = capacities[vehicle]
+            self._schedule(route)
+            assigned.append(route)
+
+        return assigned, leftover
+
+    def _best_insertion(self, route: _Route, stop: int) -> Tuple[float, int]:
+        """Cheapest feasible (extra km, position) for inserting a stop into a route"""
+        if route.load + self.demands[stop] > route.capacity:
+            return np.inf, -1
+
+        stops = route.stops
+        lat, lon = self.coordinates[stop]
+        previous = np.vstack([self.depot, self.coordinates[stops]])
+        to_stop = haversine_distance(previous[:, 0], previous[:, 1], lat, lon)
+        previous_finish = np.concatenate([[self.shift_start], route.finish])
+
+        arrival = previous_finish + self._travel_minutes(to_stop)
+        start = np.maximum(arrival, self.windows[stop, 0])
+        finish = start + self.service[stop]
+        feasible = start <= self.windows[stop, 1]
+
+        # Extra distance and the knock-on arrival at the following stop
+        from_stop = np.zeros(len(stops) + 1)
+        replaced = np.zeros(len(stops) + 1)
+        if stops:
+            from_stop[:-1] = to_stop[1:]
+            replaced[:-1] = route.legs
+            feasible[:-1] &= finish[:-1] + self._travel_minutes(from_stop[:-1]) <= route.latest
+        feasible[-1] &= finish[-1] <= self.shift_end
+
+        cost = np.where(feasible, to_stop + from_stop - replaced, np.inf)
+        position = int(np.argmin(cost))
+        return float(cost[position]), position
+
+    def _candidate_routes(self, routes: List[_Route], stop: int) -> List[int]:
+        """Routes serving the stop's nearest neighbours, falling back to every other route"""
+        own = self._route_of[stop]
+        nearby = set(self._route_of[self._neighbors[stop]].tolist()) - {-1, own}
+        return sorted(nearby) if nearby else [r for r in range(len(routes)) if r != own]
+
+    def _cheapest_insertion(self, routes: List[_Route], stop: int, targets) -> Tuple[float, int, int]:
+        best_cost, best_route, best_position = np.inf, -1, -1
+        for r in targets:
+            cost, position = self._best_insertion(routes[r], stop)
+            if cost < best_cost:
+                best_cost, best_route, best_position = cost, r, position
+        return best_cost, best_route, best_position
+
+    def _insert(self, routes: List[_Route], r: int, stop: int, position: int):
+        route = routes[r]
+        route.stops.insert(position, stop)
+        route.load += self.demands[stop]
+        self._schedule(route)
+        self._route_of[stop] = r
+
+    def _insert_unassigned(self, routes: List[_Route], unassigned: List[int]) -> List[int]:
+        """Cheapest feasible insertion of stops no route could absorb during construction"""
+        remaining = []
+        for stop in sorted(unassigned, key=lambda s: (self.windows[s, 1] - self.windows[s, 0], s)):
+            if self._out_of_time():
+                remaining.append(stop)
+                continue
+            cost, r, position = self._cheapest_insertion(routes, stop, self._candidate_routes(routes, stop))
+            if not np.isfinite(cost):
+                cost, r, position = self._cheapest_insertion(routes, stop, range(len(routes)))
+            if not np.isfinite(cost):
+                remaining.append(stop)
+                continue
+            self._insert(routes, r, stop, position)
+        return remaining
+
+    def _relocate_pass(self, routes: List[_Route]) -> int:
+        """Move single stops to a nearby route when that shortens the total distance"""
+        moves = 0
+        for source in routes:
+            k = 0
+            while k < len(source.stops):
+                if self._out_of_time() or moves >= self.local_search_iterations:
+                    return moves
+                stop = source.stops[k]
+
+                # Dropping a stop never breaks the remaining windows (triangle inequality)
+                if k + 1 < len(source.stops):
+                    before = self.coordinates[source.stops[k - 1]] if k > 0 else self.depot
+                    after = self.coordinates[source.stops[k + 1]]
+                    bridge = float(haversine_distance(before[0], before[1], after[0], after[1]))
+                    removal_gain = source.legs[k] + source.legs[k + 1] - bridge
+                else:
+                    removal_gain = source.legs[k]
+
+                cost, r, position = self._cheapest_insertion(routes, stop, self._candidate_routes(routes, stop))
+                if r >= 0 and cost < removal_gain - IMPROVEMENT_EPSILON:
+                    del source.stops[k]
+                    source.load -= self.demands[stop]
+                    self._schedule(source)
+                    self._insert(routes, r, stop, position)
+                    moves += 1
+                else:
+                    k += 1
+        return moves
+
+    def _improve_routes(self, routes: List[_Route]):
+        """Intra-route 2-opt / Or-opt, keeping the result only if windows still hold"""
+        for route in routes:
+            if len(route.stops) < 3 or self._out_of_time():
+                continue
+            matrix = DistanceMatrix(np.vstack([self.depot, self.coordinates[route.stops]]))
+            order, stats = improve_route(matrix.distances, list(range(1, len(route.stops) + 1)),
+                                         self.local_search_iterations,
+                                         max(0.0, self._deadline - time.perf_counter()))
+            if stats['improvement'] <= IMPROVEMENT_EPSILON:
+                continue
+
+            previous = route.stops
+            route.stops = [previous[k - 1] for k in order]
+            if not self._schedule(route):
+                route.stops = previous
+                self._schedule(route)